@@ -2,7 +2,7 @@ import tkinter
 from tkinter import ttk
 import customtkinter as ctk
 import tkinter.messagebox as messagebox
-from utils.database import Database
+from utils.database import Database, client_pool
 import hashlib
 
 
@@ -293,3 +293,4 @@ class EditAccountForm(ctk.CTkToplevel):
 
 accounts = Accounts()
 accounts.mainloop()
+client_pool.close()
@@ -1,13 +1,43 @@
+import time
+
+# Startup timings are measured from here
+started = time.perf_counter()
+
 import tkinter.messagebox as messagebox
-from utils.database import Database
+from utils.database import Database, client_pool, connect, database_mode
 import customtkinter as ctk
 from tkinter import ttk
 from datetime import datetime
 from utils.sms import *
-from utils.common import message_templates
-import re
+from utils.templates import TemplateError, compile_template, count_segments
+from utils.common import message_templates, projections
+from utils.importer import import_students, required_columns
+from utils.tasks import task_runner
+from utils.outbox import shared_outbox
+from utils.virtual_table import VirtualTable
+from utils.live_search import LiveSearch
+from utils.async_database import shared_async_database, run as run_async
+from utils.changes import shared_feed, RESYNC
+from utils.metrics import metrics
+import utils.async_database as async_database
+import utils.changes as change_feed
+from operator import itemgetter
+import logging
+import os
+
+imported = time.perf_counter()
+metrics.record("startup.imports", started, imported - started)
 
 ctk.set_appearance_mode("dark")
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
+
+def show_error(error):
+    messagebox.showerror("Error", f"Something went wrong: {error}")
 
 
 class Login(ctk.CTk):
@@ -49,6 +79,20 @@ class Login(ctk.CTk):
             row=5, column=0, columnspan=2, padx=10, pady=(20, 10), sticky="ew"
         )
 
+        self.after_idle(self.on_first_paint)
+
+    def on_first_paint(self):
+        painted = time.perf_counter()
+        metrics.record("startup.first_paint", started, painted - started)
+        logger.info(
+            "Startup: imports %.0f ms, first paint %.0f ms",
+            (imported - started) * 1000,
+            (painted - started) * 1000,
+        )
+
+        # Connect while the user types their credentials
+        task_runner.submit(connect, key="connect", on_error=show_error, owner=self)
+
     def login(self):
         employee_number = self.employee_number_entry.get()
         password = self.password_entry.get()
@@ -69,9 +113,25 @@ class Login(ctk.CTk):
 
         # Check the login credentials against the database
         db = Database()
-        if db.verify_login(employee_number, password):
+        task_runner.submit(
+            db.verify_login,
+            employee_number,
+            password,
+            key="login",
+            on_success=self.on_login_result,
+            on_error=show_error,
+        )
+
+    def on_login_result(self, verified):
+        if verified:
             self.withdraw()  # Close the login window
+            opened = time.perf_counter()
             main_window = MainWindow(self)
+            main_window.after_idle(
+                lambda: metrics.record(
+                    "startup.main_window", opened, time.perf_counter() - opened
+                )
+            )
             main_window.show()
         else:
             messagebox.showwarning(
@@ -80,6 +140,8 @@ class Login(ctk.CTk):
 
 
 class MainWindow(ctk.CTkToplevel):
+    replica_check_interval = 5000
+
     def __init__(self, master):
         super().__init__(master)
         self.title("Office of the University Registrar Inquiry System")
@@ -89,20 +151,36 @@ class MainWindow(ctk.CTkToplevel):
         self.tabview = ctk.CTkTabview(self, command=self.on_tab_change)
         self.tabview.pack(padx=18, pady=(0, 18), fill="both", expand=True)
 
-        self.students_tab = self.tabview.add("Students")
-        self.grades_tab = self.tabview.add("Grades")
-        self.documents_tab = self.tabview.add("Document Requests")
-        self.sms_tab = self.tabview.add("Bulk SMS")
-
-        self.students_tab_view = StudentsTab(self.students_tab)
-        self.grades_tab_view = GradesTab(self.grades_tab)
-        self.documents_tab_view = DocumentsTab(self.documents_tab)
-        self.sms_tab_view = SMSTab(self.sms_tab)
-
-        self.students_tab_view.pack(fill="both", expand=True)
-        self.grades_tab_view.pack(fill="both", expand=True)
-        self.documents_tab_view.pack(fill="both", expand=True)
-        self.sms_tab_view.pack(fill="both", expand=True)
+        # Shown while background tasks are running
+        self.busy_bar = ctk.CTkProgressBar(self, mode="indeterminate", height=4)
+        task_runner.add_busy_listener(self.on_busy_change)
+
+        # Offline work and the writes the server rejected, in replica mode
+        self.replica_label = ctk.CTkLabel(self, text="", anchor="w")
+        self.replica = connect() if database_mode == "replica" else None
+        self.replica_check_id = None
+        if self.replica is not None:
+            self.check_replica()
+
+        # Connects in the background, the tabs subscribe to it
+        shared_feed()
+
+        self.tab_classes = {
+            "Students": StudentsTab,
+            "Grades": GradesTab,
+            "Document Requests": DocumentsTab,
+            "Bulk SMS": SMSTab,
+        }
+        self.tab_views = {}
+        for name in self.tab_classes:
+            self.tabview.add(name)
+
+        # The other tabs, and their queries, wait until they are first opened
+        self.build_tab("Students")
+
+        # Hidden diagnostics panel
+        self.diagnostics_window = None
+        self.bind("<Control-Shift-KeyPress-D>", self.toggle_diagnostics)
 
     def show(self):
         self.wait_visibility()  # Ensure the window is visible
@@ -110,17 +188,176 @@ class MainWindow(ctk.CTkToplevel):
         self.protocol("WM_DELETE_WINDOW", self.on_close)  # Handle window close event
         self.focus_set()  # Set focus to this window
 
+    def on_busy_change(self, pending):
+        if pending and not self.busy_bar.winfo_ismapped():
+            self.busy_bar.pack(before=self.tabview, padx=18, pady=(6, 0), fill="x")
+            self.busy_bar.start()
+        elif not pending and self.busy_bar.winfo_ismapped():
+            self.busy_bar.stop()
+            self.busy_bar.pack_forget()
+
+    def check_replica(self):
+        pending = self.replica.pending_count()
+        if not self.replica.online:
+            text = f"Working offline, {pending} change(s) waiting to be sent"
+        elif pending:
+            text = f"{pending} change(s) waiting to be sent"
+        else:
+            text = ""
+
+        if text:
+            self.replica_label.configure(text=text)
+            if not self.replica_label.winfo_ismapped():
+                self.replica_label.pack(before=self.tabview, padx=18, fill="x")
+        elif self.replica_label.winfo_ismapped():
+            self.replica_label.pack_forget()
+
+        failed = self.replica.failed_writes()
+        if failed:
+            # Dismissed first, so they are only shown once
+            self.replica.dismiss_failed_writes([write["id"] for write in failed])
+            lines = [
+                f"{write['operation']} on {write['table']}: {write['error']}"
+                for write in failed[:10]
+            ]
+            if len(failed) > 10:
+                lines.append(f"and {len(failed) - 10} more")
+            messagebox.showerror(
+                "Changes rejected",
+                f"The server rejected {len(failed)} change(s) made offline, "
+                "they were not saved:\n\n" + "\n".join(lines),
+            )
+
+        self.replica_check_id = self.after(
+            self.replica_check_interval, self.check_replica
+        )
+
     def on_close(self):
+        if self.replica_check_id is not None:
+            self.after_cancel(self.replica_check_id)
+        task_runner.remove_busy_listener(self.on_busy_change)
         self.grab_release()  # Release the modal state
         self.destroy()  # Close the main window
         self.master.destroy()  # Show the login window again
 
+    def toggle_diagnostics(self, event=None):
+        if (
+            self.diagnostics_window is not None
+            and self.diagnostics_window.winfo_exists()
+        ):
+            self.diagnostics_window.destroy()
+            self.diagnostics_window = None
+            return
+
+        self.diagnostics_window = DiagnosticsWindow(self)
+
+    def build_tab(self, name):
+        view = self.tab_classes[name](self.tabview.tab(name))
+        view.pack(fill="both", expand=True)
+        self.tab_views[name] = view
+
     def on_tab_change(self):
-        # Re-initialize selected tab
-        if self.tabview.get() == "Bulk SMS":
-            self.sms_tab_view.destroy()
-            self.sms_tab_view = SMSTab(self.sms_tab)
-            self.sms_tab_view.pack(fill="both", expand=True)
+        name = self.tabview.get()
+        if name not in self.tab_views:
+            self.build_tab(name)
+        elif name == "Bulk SMS":
+            # Kept alive, the recipients are only fetched again when stale
+            self.tab_views[name].refresh_if_stale()
+
+
+class DiagnosticsWindow(ctk.CTkToplevel):
+    """Shows how long each operation takes, from the recorded metrics.
+
+    Opened with Ctrl+Shift+D from the main window.
+    """
+
+    refresh_interval = 1000
+
+    def __init__(self, master):
+        super().__init__(master)
+        self.title("Diagnostics")
+        self.geometry("820x420")
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+        columns = ("operation", "count", "p50", "p95", "max", "rows", "bytes")
+        self.summary_table = ttk.Treeview(self, columns=columns, show="headings")
+        self.summary_table.heading("operation", text="Operation")
+        self.summary_table.heading("count", text="Calls")
+        self.summary_table.heading("p50", text="p50 (ms)")
+        self.summary_table.heading("p95", text="p95 (ms)")
+        self.summary_table.heading("max", text="Max (ms)")
+        self.summary_table.heading("rows", text="Rows")
+        self.summary_table.heading("bytes", text="KiB")
+        self.summary_table.column("operation", width=300)
+        for column in columns[1:]:
+            self.summary_table.column(column, width=80, anchor="e")
+
+        self.buttons = ctk.CTkFrame(self, fg_color="transparent")
+        self.clear_button = ctk.CTkButton(
+            self.buttons, text="Clear", command=self.clear
+        )
+        self.export_json_button = ctk.CTkButton(
+            self.buttons, text="Export JSON", command=self.export_json
+        )
+        self.export_trace_button = ctk.CTkButton(
+            self.buttons, text="Export Chrome trace", command=self.export_trace
+        )
+
+        self.summary_table.grid(row=0, column=0, padx=10, pady=(10, 0), sticky="nsew")
+        self.buttons.grid(row=1, column=0, padx=10, pady=10, sticky="e")
+        self.clear_button.grid(row=0, column=0, padx=(0, 10))
+        self.export_json_button.grid(row=0, column=1, padx=(0, 10))
+        self.export_trace_button.grid(row=0, column=2)
+
+        self.refresh_id = None
+        self.refresh()
+
+    def refresh(self):
+        self.summary_table.delete(*self.summary_table.get_children())
+        for name, summary in metrics.summary().items():
+            self.summary_table.insert(
+                "",
+                "end",
+                values=(
+                    name,
+                    summary["count"],
+                    f"{summary['p50_ms']:.1f}",
+                    f"{summary['p95_ms']:.1f}",
+                    f"{summary['max_ms']:.1f}",
+                    summary["rows"],
+                    f"{summary['bytes'] / 1024:.0f}",
+                ),
+            )
+
+        self.refresh_id = self.after(self.refresh_interval, self.refresh)
+
+    def destroy(self):
+        if self.refresh_id is not None:
+            self.after_cancel(self.refresh_id)
+        super().destroy()
+
+    def clear(self):
+        metrics.clear()
+        self.summary_table.delete(*self.summary_table.get_children())
+
+    def export_json(self):
+        from tkinter import filedialog
+
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json", filetypes=[("JSON files", "*.json")]
+        )
+        if file_path:
+            metrics.export_json(file_path)
+
+    def export_trace(self):
+        from tkinter import filedialog
+
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json", filetypes=[("Chrome trace", "*.json")]
+        )
+        if file_path:
+            metrics.export_chrome_trace(file_path)
 
 
 class StudentsTab(ctk.CTkFrame):
@@ -129,8 +366,15 @@ class StudentsTab(ctk.CTkFrame):
         self.grid_columnconfigure(0, weight=1)
         self.grid_rowconfigure(1, weight=1)
 
+        self.roster_loaded = False
+        self.roster_loading = False
+
+        # The roster is fetched while the widgets are built, its pages are
+        # delivered to the table once the main loop runs again
+        self.load_roster()
+
         # Widgets
-        self.students_table = ttk.Treeview(
+        self.students_table = VirtualTable(
             self,
             columns=(
                 "student_number",
@@ -154,15 +398,16 @@ class StudentsTab(ctk.CTkFrame):
         self.students_table.heading("contact_number", text="Contact number")
         self.students_table.heading("course_code", text="Course code")
 
-        self.populate_students_table()
+        shared_feed().subscribe(self.on_students_changed, ["student_info"], owner=self)
 
         s = ttk.Style()
         s.configure("Treeview", rowheight=25)
 
         self.search_frame = ctk.CTkFrame(self)
         self.search_bar = ctk.CTkEntry(
-            self.search_frame, placeholder_text="Enter student no."
+            self.search_frame, placeholder_text="Enter student no. or name", width=200
         )
+        self.live_search = LiveSearch(self.search_bar, self.filter_students, "students")
         self.search_button = ctk.CTkButton(
             self.search_frame, text="🔍 Search", command=self.search, width=40
         )
@@ -234,57 +479,160 @@ class StudentsTab(ctk.CTkFrame):
 
     def populate_students_table(self, students=None):
         if not students:
-            db = Database()
-            students = db.get_all("student_info")
+            if not self.roster_loaded:
+                # Pages of an unfinished first load, which this one replaces
+                self.students_table.set_rows([], keys=[])
+            self.load_roster()
+            return
 
-        students = sorted(students, key=lambda student: student["student_id"])
+        self.show_students(students)
 
-        self.students_table.delete(*self.students_table.get_children())
+    def load_roster(self):
+        """Stream the roster from the database in pages.
 
-        for student in students:
-            self.students_table.insert(
-                "",
-                "end",
-                values=(
-                    student["student_id"],
-                    student["first_name"],
-                    student["middle_name"],
-                    student["last_name"],
-                    student["year_level"],
-                    student["email"],
-                    student["contact_number"],
-                    student["course_code"],
-                ),
+        Only the callbacks touch the table, so the load can start before the
+        table is built.
+        """
+        db = Database()
+        self.roster = []
+        self.roster_loading = True
+        task_runner.stream(
+            db.iter_all,
+            "student_info",
+            columns=projections["student"],
+            key="students_table",
+            on_item=self.add_roster_page,
+            on_success=lambda _: self.show_roster(self.roster),
+            on_error=self.on_roster_error,
+            owner=self,
+            span="StudentsTab.populate_students_table",
+        )
+
+    def on_roster_error(self, error):
+        self.roster_loading = False
+        show_error(error)
+
+    def add_roster_page(self, students):
+        self.roster += students
+
+        # The first load shows each page as it arrives, pages come sorted by
+        # student ID. A refresh swaps the whole roster in once complete.
+        if not self.roster_loaded and not self.search_bar.get():
+            self.students_table.append_rows(
+                map(self.student_row, students),
+                keys=map(itemgetter("student_id"), students),
             )
 
-        # Set alternating row colors
-        self.students_table.tag_configure("oddrow", background="#252525")
-        self.students_table.tag_configure("evenrow", background="#353535")
-        # Apply alternating colors to rows
-        for index, student in enumerate(self.students_table.get_children()):
-            if index % 2 == 0:
-                self.students_table.item(student, tags=("evenrow",))
-            else:
-                self.students_table.item(student, tags=("oddrow",))
+    def show_roster(self, students):
+        self.roster_loaded = True
+        self.roster_loading = False
+
+        # Keep the filter being typed when the roster is refreshed
+        query = self.search_bar.get()
+        if query:
+            self.filter_students(query)
+        else:
+            self.show_students(students)
+
+    student_row = itemgetter(
+        "student_id",
+        "first_name",
+        "middle_name",
+        "last_name",
+        "year_level",
+        "email",
+        "contact_number",
+        "course_code",
+    )
+
+    def show_students(self, students):
+        students = sorted(students, key=itemgetter("student_id"))
+
+        # Rows are striped by the table itself
+        self.students_table.set_rows(
+            map(self.student_row, students),
+            keys=map(itemgetter("student_id"), students),
+        )
 
     def search(self):
-        student_number = self.search_bar.get()
+        query = self.search_bar.get()
 
-        if student_number == "":
+        if query == "":
             return
 
         db = Database()
-        student = db.get_student(student_number)
-        if student is not None:
-            self.populate_students_table([student])
+        task_runner.submit(
+            db.search_students,
+            query,
+            key="students_table",
+            on_success=self.show_search_result,
+            on_error=show_error,
+            owner=self,
+        )
+
+    def show_search_result(self, students):
+        if students:
+            self.populate_students_table(students)
         else:
             messagebox.showwarning(
-                "Student not found", "Student number not found in the database."
+                "Student not found", "No student matches the search."
+            )
+
+    def filter_students(self, query):
+        """Show the students matching a query as it is typed.
+
+        Matches come from the in-memory student index. A student number the
+        index does not know about is looked up in the database. A query typed
+        before the roster is loaded is applied once it is, the loaded roster
+        builds the index.
+
+        Args:
+            query (str): The search bar's text.
+        """
+        db = Database()
+        task_runner.cancel("students_search")
+
+        if not db.index.ready:
+            # show_roster filters by the search bar's text
+            if not self.roster_loading:
+                self.populate_students_table()
+            return
+
+        if query == "":
+            self.show_students(db.index.students())
+            return
+
+        students = db.index.search(query)
+        self.show_students(students)
+
+        if not students and query.isdigit():
+            # Added since the index was built, e.g. from another computer
+            task_runner.submit(
+                db.get_student,
+                query,
+                key="students_search",
+                on_success=self.show_fallback_student,
+                on_error=show_error,
+                owner=self,
             )
 
+    def show_fallback_student(self, student):
+        if student is not None:
+            self.show_students([student])
+
+    def on_students_changed(self, changes):
+        if any(change["type"] == RESYNC for change in changes["student_info"]):
+            self.populate_students_table()
+            return
+
+        # The change feed already applied the changes to the index
+        if self.roster_loaded and Database().index.ready:
+            self.filter_students(self.search_bar.get())
+
     def reset_table(self):
         self.populate_students_table()
         self.search_bar.delete(0, "end")
+        self.live_search.reset()
 
     def delete_student_cmd(self):
         selected = self.get_selected_students()
@@ -301,9 +649,19 @@ class StudentsTab(ctk.CTkFrame):
 
         if confirmation:
             db = Database()
-            for student in selected:
-                db.delete_student(student[0])
-            self.populate_students_table()
+            task_runner.submit(
+                self.delete_students,
+                db,
+                [student[0] for student in selected],
+                on_success=lambda _: self.populate_students_table(),
+                on_error=show_error,
+                owner=self,
+            )
+
+    @staticmethod
+    def delete_students(db, student_numbers):
+        for student_number in student_numbers:
+            db.delete_student(student_number)
 
     def edit_student_cmd(self):
         selected = self.get_selected_students()
@@ -321,7 +679,15 @@ class StudentsTab(ctk.CTkFrame):
 
         db = Database()
         student_number = selected[0][0]
-        student = db.get_student(student_number)
+        task_runner.submit(
+            db.get_student,
+            student_number,
+            on_success=self.open_edit_student_window,
+            on_error=show_error,
+            owner=self,
+        )
+
+    def open_edit_student_window(self, student):
         edit_student_window = EditStudentWindow(self, student)
         edit_student_window.grab_set()
 
@@ -332,7 +698,6 @@ class StudentsTab(ctk.CTkFrame):
     def import_excel_cmd(self):
         # open file dialog
         from tkinter import filedialog
-        import pandas as pd
 
         # Only allow excel files
         file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
@@ -340,52 +705,41 @@ class StudentsTab(ctk.CTkFrame):
         if file_path == "":
             return
 
+        task_runner.submit(
+            self.import_excel,
+            file_path,
+            on_success=self.show_import_report,
+            on_error=show_error,
+            owner=self,
+        )
+
+    @staticmethod
+    def import_excel(file_path):
+        import pandas as pd
+
         # Read the excel file
         df = pd.read_excel(file_path)
 
         # Validate the data
-        if not (
-            "student_id" in df.columns
-            and "first_name" in df.columns
-            and "last_name" in df.columns
-            and "year_level" in df.columns
-            and "email" in df.columns
-            and "contact_number" in df.columns
-            and "course_code" in df.columns
-        ):
+        if not all(column in df.columns for column in required_columns):
+            return None
+
+        # Insert the students into the database in concurrent batches
+        db = shared_async_database().blocking
+        return import_students(df, db)
+
+    def show_import_report(self, report):
+        if report is None:
             messagebox.showwarning(
                 "Invalid Excel File",
                 "The excel file you selected is invalid.",
             )
             return
 
-        # Convert the dataframe to a list of dictionaries
-        students = df.to_dict("records")
-
-        # Insert the students into the database
-        db = Database()
-        skipped = 0
-        for student in students:
-            # Check if the student already exists
-            if db.get_student(student["student_id"]) is not None:
-                skipped += 1
-                continue
-
-            db.insert_student(student)
-
         self.populate_students_table()
 
-        # Show a message box with the number of students imported
-        if skipped > 0:
-            messagebox.showinfo(
-                "Import Successful",
-                f"{len(students) - skipped} student(s) imported. {skipped} student(s) skipped because they already exist.",
-            )
-        else:
-            messagebox.showinfo(
-                "Import Successful",
-                f"{len(students)} student(s) imported.",
-            )
+        # Show a message box with the import report
+        messagebox.showinfo("Import Successful", report.summary())
 
 
 class AddStudentWindow(ctk.CTkToplevel):
@@ -498,14 +852,9 @@ class AddStudentWindow(ctk.CTkToplevel):
             return
 
         db = Database()
-        if db.get_student(student_number) is not None:
-            messagebox.showwarning(
-                "Student already exists",
-                "Student number already exists in the database.",
-            )
-            return
-
-        db.insert_student(
+        task_runner.submit(
+            self.insert_student,
+            db,
             {
                 "student_id": student_number,
                 "first_name": first_name,
@@ -515,8 +864,28 @@ class AddStudentWindow(ctk.CTkToplevel):
                 "email": email,
                 "contact_number": contact_number,
                 "course_code": course_code,
-            }
+            },
+            on_success=self.on_submitted,
+            on_error=show_error,
+            owner=self,
         )
+
+    @staticmethod
+    def insert_student(db, student):
+        if db.get_student(student["student_id"]) is not None:
+            return False
+
+        db.insert_student(student)
+        return True
+
+    def on_submitted(self, inserted):
+        if not inserted:
+            messagebox.showwarning(
+                "Student already exists",
+                "Student number already exists in the database.",
+            )
+            return
+
         self.master.populate_students_table()
         self.destroy()
 
@@ -640,7 +1009,8 @@ class EditStudentWindow(ctk.CTkToplevel):
             return
 
         db = Database()
-        db.update_student(
+        task_runner.submit(
+            db.update_student,
             student_number,
             {
                 "first_name": first_name,
@@ -651,7 +1021,12 @@ class EditStudentWindow(ctk.CTkToplevel):
                 "contact_number": contact_number,
                 "course_code": course_code,
             },
+            on_success=self.on_submitted,
+            on_error=show_error,
+            owner=self,
         )
+
+    def on_submitted(self, _):
         self.master.populate_students_table()
         self.destroy()
 
@@ -691,6 +1066,10 @@ class GradesTab(ctk.CTkFrame):
         self.search_bar = ctk.CTkEntry(
             self.search_frame, placeholder_text="Enter student no."
         )
+        self.live_search = LiveSearch(
+            self.search_bar, self.find_student_grades, "grades"
+        )
+        shared_feed().subscribe(self.on_grades_changed, ["grades"], owner=self)
         self.year_option_label = ctk.StringVar(value="Year")
         self.year_option = ctk.CTkOptionMenu(
             self.search_frame,
@@ -738,7 +1117,7 @@ class GradesTab(ctk.CTkFrame):
             command=self.add_grade_cmd,
         )
 
-        self.grades_table = ttk.Treeview(
+        self.grades_table = VirtualTable(
             self,
             columns=(
                 "subject_code",
@@ -807,9 +1186,26 @@ class GradesTab(ctk.CTkFrame):
             )
             return
 
-        db = Database()
-        student_grade = db.get_student_grade(student_number, self.year, self.semester)
-        student_info = db.get_student(student_number)
+        task_runner.submit(
+            self.fetch_student_grades,
+            shared_async_database(),
+            student_number,
+            self.year,
+            self.semester,
+            key="grades_table",
+            on_success=self.show_search_result,
+            on_error=show_error,
+            owner=self,
+            span="GradesTab.search",
+        )
+
+    @staticmethod
+    def fetch_student_grades(db, student_number, year, semester):
+        # The student and their grades are fetched at the same time
+        return run_async(db.get_student_with_grades(student_number, year, semester))
+
+    def show_search_result(self, result):
+        student_info, student_grade = result
 
         if student_info is None:
             messagebox.showwarning(
@@ -827,7 +1223,52 @@ class GradesTab(ctk.CTkFrame):
         )
         self.populate_grades_table(student_grade)
 
+    def find_student_grades(self, student_number):
+        """Load a student's grades as soon as a complete student number is typed.
+
+        The preview is filled from the in-memory student index right away,
+        the grades follow from the database.
+
+        Args:
+            student_number (str): The search bar's text.
+        """
+        if self.year is None or self.semester is None:
+            return
+
+        db = Database()
+        if db.index.ready:
+            student = db.index.get(student_number)
+            if student is None:
+                return
+
+            self.set_preview(
+                student["student_id"],
+                f"{student['first_name']} {student['middle_name']} {student['last_name']}",
+                student["course_code"],
+                student["year_level"],
+            )
+        elif not (student_number.isdigit() and len(student_number) == 9):
+            return
+
+        task_runner.submit(
+            self.fetch_student_grades,
+            shared_async_database(),
+            student_number,
+            self.year,
+            self.semester,
+            key="grades_table",
+            on_success=self.show_live_result,
+            on_error=show_error,
+            owner=self,
+        )
+
+    def show_live_result(self, result):
+        # Unlike an explicit search, a miss while typing is not an error
+        if result[0] is not None:
+            self.show_search_result(result)
+
     def reset(self):
+        self.live_search.reset()
         self.set_preview("", "", "", "")
         self.populate_grades_table()
         self.year_option_label.set("Year")
@@ -837,34 +1278,26 @@ class GradesTab(ctk.CTkFrame):
         self.year = None
         self.semester = None
 
+    @metrics.timed()
     def populate_grades_table(self, grades=None):
-        self.grades_table.delete(*self.grades_table.get_children())
-
         if grades is None:
-            return
+            grades = []
 
-        for grade in grades:
-            self.grades_table.insert(
-                "",
-                "end",
-                values=(
-                    grade["subjects"]["code"],
-                    grade["subjects"]["title"],
-                    grade["subjects"]["units"],
-                    "-" if grade["grade"] is None else "{:.2f}".format(grade["grade"]),
-                    grade["remarks"]["remark"],
-                ),
-            )
+        # Rows are striped by the table itself
+        self.grades_table.set_rows(
+            [self.grade_row(grade) for grade in grades],
+            keys=[grade["grade_id"] for grade in grades],
+        )
 
-        # Set alternating row colors
-        self.grades_table.tag_configure("oddrow", background="#252525")
-        self.grades_table.tag_configure("evenrow", background="#353535")
-        # Apply alternating colors to rows
-        for index, grade in enumerate(self.grades_table.get_children()):
-            if index % 2 == 0:
-                self.grades_table.item(grade, tags=("evenrow",))
-            else:
-                self.grades_table.item(grade, tags=("oddrow",))
+    @staticmethod
+    def grade_row(grade):
+        return (
+            grade["subjects"]["code"],
+            grade["subjects"]["title"],
+            grade["subjects"]["units"],
+            "-" if grade["grade"] is None else "{:.2f}".format(grade["grade"]),
+            grade["remarks"]["remark"],
+        )
 
     def delete_grade_cmd(self):
         selected = self.grades_table.selection()
@@ -887,13 +1320,68 @@ class GradesTab(ctk.CTkFrame):
 
             # Delete the grades from the database
             db = Database()
-            for index in indexes:
-                db.delete_grade(self.grades[index]["grade_id"])
-
-            self.grades = db.get_student_grade(
-                self.student["student_id"], self.year, self.semester
+            task_runner.submit(
+                self.delete_grades,
+                db,
+                [self.grades[index]["grade_id"] for index in indexes],
+                self.student["student_id"],
+                self.year,
+                self.semester,
+                key="grades_table",
+                on_success=self.show_grades,
+                on_error=show_error,
+                owner=self,
             )
-            self.populate_grades_table(self.grades)
+
+    @staticmethod
+    def delete_grades(db, grade_ids, student_number, year, semester):
+        for grade_id in grade_ids:
+            db.delete_grade(grade_id)
+
+        return db.get_student_grade(student_number, year, semester)
+
+    def show_grades(self, grades):
+        self.grades = grades
+        self.populate_grades_table(self.grades)
+
+    def on_grades_changed(self, changes):
+        if self.student is None:
+            return
+
+        # Only reload when a grade of the student on screen changed
+        student_id = str(self.student["student_id"])
+        if not any(
+            change["type"] == RESYNC
+            or self.grades_table.exists(change["key"])
+            or (change["record"] or {}).get("student_id") == student_id
+            for change in changes["grades"]
+        ):
+            return
+
+        db = Database()
+        task_runner.submit(
+            db.get_student_grade,
+            student_id,
+            self.year,
+            self.semester,
+            key="grades_table",
+            on_success=self.show_grades,
+            on_error=show_error,
+            owner=self,
+        )
+
+    def show_grade(self, grade):
+        """Repaint the row of a single edited grade.
+
+        Args:
+            grade (Grade): The grade's updated data.
+        """
+        if grade is None or not self.grades_table.exists(grade["grade_id"]):
+            return
+
+        index = self.grades_table.index(grade["grade_id"])
+        self.grades[index] = grade
+        self.grades_table.item(grade["grade_id"], values=self.grade_row(grade))
 
     def edit_grade_cmd(self):
         selected = self.grades_table.selection()
@@ -932,9 +1420,11 @@ class GradesTab(ctk.CTkFrame):
 
     def year_option_callback(self, value):
         self.year = value
+        self.find_student_grades(self.search_bar.get())
 
     def semester_option_callback(self, value):
         self.semester = value
+        self.find_student_grades(self.search_bar.get())
 
 
 class AddGradeWindow(ctk.CTkToplevel):
@@ -984,7 +1474,9 @@ class AddGradeWindow(ctk.CTkToplevel):
         grade = None if grade == "" else float(grade)
 
         db = Database()
-        db.insert_grade(
+        task_runner.submit(
+            self.insert_grade,
+            db,
             {
                 "student_id": self.student["student_id"],
                 "year": self.year,
@@ -992,12 +1484,19 @@ class AddGradeWindow(ctk.CTkToplevel):
                 "subject_code": subject_code,
                 "grade": grade,
                 "remark_id": infer_remark(grade),
-            }
-        )
-        self.master.grades = db.get_student_grade(
-            self.student["student_id"], self.year, self.semester
+            },
+            on_success=self.on_submitted,
+            on_error=show_error,
+            owner=self,
         )
-        self.master.populate_grades_table(self.master.grades)
+
+    @staticmethod
+    def insert_grade(db, grade):
+        db.insert_grade(grade)
+        return db.get_student_grade(grade["student_id"], grade["year"], grade["sem"])
+
+    def on_submitted(self, grades):
+        self.master.show_grades(grades)
         self.destroy()
 
 
@@ -1062,18 +1561,27 @@ class EditGradeWindow(ctk.CTkToplevel):
         grade = None if grade == "" else float(grade)
 
         db = Database()
-        db.update_grade(
-            self.grade["grade_id"],
+        task_runner.submit(
+            self.update_grade,
+            db,
+            self.grade,
             {
                 "grade": grade,
                 "remark_id": infer_remark(grade),
                 "messaged": False,
             },
+            on_success=self.on_submitted,
+            on_error=show_error,
+            owner=self,
         )
-        self.master.grades = db.get_student_grade(
-            self.grade["student_id"], self.grade["year"], self.grade["sem"]
-        )
-        self.master.populate_grades_table(self.master.grades)
+
+    @staticmethod
+    def update_grade(db, grade, data):
+        db.update_grade(grade["grade_id"], data)
+        return db.get_grade(grade["grade_id"])
+
+    def on_submitted(self, grade):
+        self.master.show_grade(grade)
         self.destroy()
 
 
@@ -1084,7 +1592,7 @@ class DocumentsTab(ctk.CTkFrame):
         self.grid_rowconfigure(1, weight=1)
 
         # Widgets
-        self.documents_table = ttk.Treeview(
+        self.documents_table = VirtualTable(
             self,
             columns=(
                 "request_id",
@@ -1122,7 +1630,10 @@ class DocumentsTab(ctk.CTkFrame):
 
         self.search_frame = ctk.CTkFrame(self)
         self.search_bar = ctk.CTkEntry(
-            self.search_frame, placeholder_text="Enter request ID"
+            self.search_frame, placeholder_text="Enter request or student ID"
+        )
+        self.live_search = LiveSearch(
+            self.search_bar, self.filter_documents, "documents"
         )
         self.search_button = ctk.CTkButton(
             self.search_frame, text="🔍 Search", command=self.search, width=40
@@ -1143,8 +1654,12 @@ class DocumentsTab(ctk.CTkFrame):
         )
         self.status_filter.set(self.status_filter_options[0])
         self.selected_status = self.status_filter_options[0].lower()
+        self.loaded_documents = []
 
         self.populate_documents_table()
+        shared_feed().subscribe(
+            self.on_documents_changed, ["student_requests"], owner=self
+        )
 
         self.buttons_frame = ctk.CTkFrame(self)
         self.mark_as_claimed_button = ctk.CTkButton(
@@ -1210,19 +1725,74 @@ class DocumentsTab(ctk.CTkFrame):
         )
 
     def populate_documents_table(self, documents=None):
-        self.documents_table.delete(*self.documents_table.get_children())
-
         if documents is None:
             db = Database()
-            documents = db.get_document_requests_by_status(self.selected_status)
+            task_runner.submit(
+                db.get_document_requests_by_status,
+                self.selected_status,
+                key="documents_table",
+                on_success=self.show_loaded_documents,
+                on_error=show_error,
+                owner=self,
+                span="DocumentsTab.populate_documents_table",
+            )
+            return
+
+        self.show_documents(documents)
+
+    def on_documents_changed(self, changes):
+        # Only the changed requests are pulled, see Database._synced
+        self.populate_documents_table()
+
+    def show_loaded_documents(self, documents):
+        self.loaded_documents = documents
+        self.filter_documents(self.search_bar.get())
+
+    def filter_documents(self, query):
+        """Show the loaded requests whose ID or student ID starts with a query.
+
+        A request ID that is not loaded, e.g. because it has another status,
+        is looked up in the database.
+
+        Args:
+            query (str): The search bar's text.
+        """
+        task_runner.cancel("documents_search")
+
+        if query == "":
+            self.show_documents(self.loaded_documents)
+            return
+
+        documents = [
+            document
+            for document in self.loaded_documents
+            if str(document["id"]).startswith(query)
+            or str(document["student_id"]).startswith(query)
+        ]
+        self.show_documents(documents)
+
+        if not documents and query.isdigit():
+            db = Database()
+            task_runner.submit(
+                db.get_document_request,
+                query,
+                key="documents_search",
+                on_success=self.show_fallback_document,
+                on_error=show_error,
+                owner=self,
+            )
 
+    def show_fallback_document(self, document):
+        if document is not None:
+            self.show_documents([document])
+
+    def show_documents(self, documents):
         self.documents = documents
 
-        for document in documents:
-            self.documents_table.insert(
-                "",
-                "end",
-                values=(
+        # Rows are striped by the table itself
+        self.documents_table.set_rows(
+            [
+                (
                     document["id"],
                     document["student_id"],
                     document["mode"],
@@ -1235,18 +1805,11 @@ class DocumentsTab(ctk.CTkFrame):
                     document["request_date"],
                     document["receive_date"],
                     document["request_statuses"]["status"],
-                ),
-            )
-
-        # Set alternating row colors
-        self.documents_table.tag_configure("oddrow", background="#252525")
-        self.documents_table.tag_configure("evenrow", background="#353535")
-        # Apply alternating colors to rows
-        for index, document in enumerate(self.documents_table.get_children()):
-            if index % 2 == 0:
-                self.documents_table.item(document, tags=("evenrow",))
-            else:
-                self.documents_table.item(document, tags=("oddrow",))
+                )
+                for document in documents
+            ],
+            keys=[document["id"] for document in documents],
+        )
 
     def search(self):
         request_id = self.search_bar.get()
@@ -1255,8 +1818,16 @@ class DocumentsTab(ctk.CTkFrame):
             return
 
         db = Database()
-        document = db.get_document_request(request_id)
+        task_runner.submit(
+            db.get_document_request,
+            request_id,
+            key="documents_table",
+            on_success=self.show_search_result,
+            on_error=show_error,
+            owner=self,
+        )
 
+    def show_search_result(self, document):
         if document is None:
             messagebox.showwarning(
                 "Record not found", "Request ID not found in the database."
@@ -1266,18 +1837,40 @@ class DocumentsTab(ctk.CTkFrame):
         self.populate_documents_table([document])
 
     def reset(self):
-        self.populate_documents_table()
         self.search_bar.delete(0, "end")
+        self.live_search.reset()
+        self.populate_documents_table()
         self.documents = None
 
     def status_filter_callback(self, value):
-        db = Database()
-        documents = db.get_document_requests_by_status(value.lower())
-        self.populate_documents_table(documents)
+        # Supersedes any fetch still running for the previous status
         self.selected_status = value.lower()
+        self.populate_documents_table()
 
-    def mark_as_claimed_cmd(self):
+    def update_documents(self, ids, data):
+        """Apply the same update to several document requests in the background.
+
+        Args:
+            ids (list): The document requests' IDs.
+            data (StudentRequest): The data to update.
+        """
         db = Database()
+        task_runner.submit(
+            self.update_document_requests,
+            db,
+            ids,
+            data,
+            on_success=lambda _: self.populate_documents_table(),
+            on_error=show_error,
+            owner=self,
+        )
+
+    @staticmethod
+    def update_document_requests(db, ids, data):
+        for id in ids:
+            db.update_document_request(id, dict(data))
+
+    def mark_as_claimed_cmd(self):
         selected = self.documents_table.selection()
         if not selected:
             messagebox.showwarning(
@@ -1289,19 +1882,15 @@ class DocumentsTab(ctk.CTkFrame):
         for document in selected:
             indexes.append(self.documents_table.index(document))
 
-        for index in indexes:
-            db.update_document_request(
-                self.documents[index]["id"],
-                {
-                    "student_request_status_id": 3,
-                    "receive_date": datetime.now().strftime("%Y-%m-%d"),
-                },
-            )
-
-        self.populate_documents_table()
+        self.update_documents(
+            [self.documents[index]["id"] for index in indexes],
+            {
+                "student_request_status_id": 3,
+                "receive_date": datetime.now().strftime("%Y-%m-%d"),
+            },
+        )
 
     def mark_as_ready_cmd(self):
-        db = Database()
         selected = self.documents_table.selection()
         if not selected:
             messagebox.showwarning(
@@ -1313,19 +1902,15 @@ class DocumentsTab(ctk.CTkFrame):
         for document in selected:
             indexes.append(self.documents_table.index(document))
 
-        for index in indexes:
-            db.update_document_request(
-                self.documents[index]["id"],
-                {
-                    "student_request_status_id": 2,
-                    "receive_date": None,
-                },
-            )
-
-        self.populate_documents_table()
+        self.update_documents(
+            [self.documents[index]["id"] for index in indexes],
+            {
+                "student_request_status_id": 2,
+                "receive_date": None,
+            },
+        )
 
     def mark_as_pending_cmd(self):
-        db = Database()
         selected = self.documents_table.selection()
         if not selected:
             messagebox.showwarning(
@@ -1337,17 +1922,14 @@ class DocumentsTab(ctk.CTkFrame):
         for document in selected:
             indexes.append(self.documents_table.index(document))
 
-        for index in indexes:
-            db.update_document_request(
-                self.documents[index]["id"],
-                {
-                    "student_request_status_id": 1,
-                    "receive_date": None,
-                    "messaged": False,
-                },
-            )
-
-        self.populate_documents_table()
+        self.update_documents(
+            [self.documents[index]["id"] for index in indexes],
+            {
+                "student_request_status_id": 1,
+                "receive_date": None,
+                "messaged": False,
+            },
+        )
 
     def delete_document_cmd(self):
         # Delete a document request
@@ -1371,10 +1953,19 @@ class DocumentsTab(ctk.CTkFrame):
 
             # Delete the records from the database
             db = Database()
-            for index in indexes:
-                db.delete_document_request(self.documents[index]["id"])
+            task_runner.submit(
+                self.delete_document_requests,
+                db,
+                [self.documents[index]["id"] for index in indexes],
+                on_success=lambda _: self.populate_documents_table(),
+                on_error=show_error,
+                owner=self,
+            )
 
-            self.populate_documents_table()
+    @staticmethod
+    def delete_document_requests(db, ids):
+        for id in ids:
+            db.delete_document_request(id)
 
     def edit_document_cmd(self):
         # Edit a document request
@@ -1421,24 +2012,10 @@ class AddRequestWindow(ctk.CTkToplevel):
             variable=self.mode_option_label,
         )
 
-        db = Database()
-        self.document_types = db.get_document_types()
+        # Filled once the document types are loaded
         self.document_type_options = {}
-
-        # Map document type to type id
-        for document_type in self.document_types:
-            self.document_type_options[document_type["type"]] = document_type["id"]
-
-        document_type_option_list = list(self.document_type_options.keys())
-
         self.document_type_label = ctk.CTkLabel(self, text="Document Type")
-        self.document_type_option = ctk.CTkOptionMenu(
-            self,
-            values=document_type_option_list,
-        )
-
-        # set default value
-        self.document_type_option.set(document_type_option_list[0])
+        self.document_type_option = ctk.CTkOptionMenu(self, values=[], state="disabled")
 
         self.num_of_copies_label = ctk.CTkLabel(self, text="Number of Copies")
         self.num_of_copies_entry = ctk.CTkEntry(self)
@@ -1455,7 +2032,9 @@ class AddRequestWindow(ctk.CTkToplevel):
         self.payment_date_label = ctk.CTkLabel(self, text="Payment Date")
         self.payment_date_entry = ctk.CTkEntry(self)
 
-        self.submit_button = ctk.CTkButton(self, text="Submit", command=self.submit)
+        self.submit_button = ctk.CTkButton(
+            self, text="Submit", command=self.submit, state="disabled"
+        )
 
         # Grid
         self.student_number_label.grid(
@@ -1492,6 +2071,28 @@ class AddRequestWindow(ctk.CTkToplevel):
 
         self.submit_button.grid(row=16, column=0, padx=10, pady=(20, 10), sticky="ew")
 
+        db = Database()
+        task_runner.submit(
+            db.get_document_types,
+            on_success=self.show_document_types,
+            on_error=show_error,
+            owner=self,
+        )
+
+    def show_document_types(self, document_types):
+        # Map document type to type id
+        for document_type in document_types:
+            self.document_type_options[document_type["type"]] = document_type["id"]
+
+        document_type_option_list = list(self.document_type_options.keys())
+        self.document_type_option.configure(
+            values=document_type_option_list, state="normal"
+        )
+
+        # set default value
+        self.document_type_option.set(document_type_option_list[0])
+        self.submit_button.configure(state="normal")
+
     def submit(self):
         student_number = self.student_number_entry.get()
         mode = self.mode_option_label.get()
@@ -1525,17 +2126,6 @@ class AddRequestWindow(ctk.CTkToplevel):
             )
             return
 
-        db = Database()
-        temp_student = db.get_student(student_number)
-        student_exists = temp_student is not None
-
-        if not student_exists:
-            messagebox.showwarning(
-                "Student not found",
-                "Student number not found in the database.",
-            )
-            return
-
         if not num_of_copies.isdigit():
             messagebox.showwarning(
                 "Invalid Number of Copies",
@@ -1568,14 +2158,9 @@ class AddRequestWindow(ctk.CTkToplevel):
             return
 
         db = Database()
-        if db.get_student(student_number) is None:
-            messagebox.showwarning(
-                "Student not found",
-                "Student number not found in the database.",
-            )
-            return
-
-        db.insert_document_request(
+        task_runner.submit(
+            self.insert_document_request,
+            db,
             {
                 "student_id": student_number,
                 "mode": mode,
@@ -1587,8 +2172,28 @@ class AddRequestWindow(ctk.CTkToplevel):
                 "payment_date": payment_date,
                 "request_date": datetime.now().strftime("%Y-%m-%d"),
                 "receive_date": None,
-            }
+            },
+            on_success=self.on_submitted,
+            on_error=show_error,
+            owner=self,
         )
+
+    @staticmethod
+    def insert_document_request(db, document):
+        if db.get_student(document["student_id"]) is None:
+            return False
+
+        db.insert_document_request(document)
+        return True
+
+    def on_submitted(self, saved):
+        if not saved:
+            messagebox.showwarning(
+                "Student not found",
+                "Student number not found in the database.",
+            )
+            return
+
         self.master.populate_documents_table()
         self.destroy()
 
@@ -1613,24 +2218,10 @@ class EditDocumentWindow(ctk.CTkToplevel):
             variable=self.mode_option_label,
         )
 
-        db = Database()
-        self.document_types = db.get_document_types()
+        # Filled once the document types are loaded
         self.document_type_options = {}
-
-        # Map document type to type id
-        for document_type in self.document_types:
-            self.document_type_options[document_type["type"]] = document_type["id"]
-
-        document_type_option_list = list(self.document_type_options.keys())
-
         self.document_type_label = ctk.CTkLabel(self, text="Document Type")
-        self.document_type_option = ctk.CTkOptionMenu(
-            self,
-            values=document_type_option_list,
-        )
-
-        # set default value
-        self.document_type_option.set(document_type_option_list[0])
+        self.document_type_option = ctk.CTkOptionMenu(self, values=[], state="disabled")
 
         self.num_of_copies_label = ctk.CTkLabel(self, text="Number of Copies")
         self.num_of_copies_entry = ctk.CTkEntry(self)
@@ -1661,7 +2252,9 @@ class EditDocumentWindow(ctk.CTkToplevel):
         if document["receive_date"] is not None:
             self.receive_date_entry.insert(0, document["receive_date"])
 
-        self.submit_button = ctk.CTkButton(self, text="Submit", command=self.submit)
+        self.submit_button = ctk.CTkButton(
+            self, text="Submit", command=self.submit, state="disabled"
+        )
 
         # Grid
         self.student_number_label.grid(
@@ -1708,6 +2301,28 @@ class EditDocumentWindow(ctk.CTkToplevel):
 
         self.submit_button.grid(row=20, column=0, padx=10, pady=(20, 10), sticky="ew")
 
+        db = Database()
+        task_runner.submit(
+            db.get_document_types,
+            on_success=self.show_document_types,
+            on_error=show_error,
+            owner=self,
+        )
+
+    def show_document_types(self, document_types):
+        # Map document type to type id
+        for document_type in document_types:
+            self.document_type_options[document_type["type"]] = document_type["id"]
+
+        document_type_option_list = list(self.document_type_options.keys())
+        self.document_type_option.configure(
+            values=document_type_option_list, state="normal"
+        )
+
+        # set default value
+        self.document_type_option.set(document_type_option_list[0])
+        self.submit_button.configure(state="normal")
+
     def submit(self):
         student_number = self.student_number_entry.get()
         mode = self.mode_option_label.get()
@@ -1744,17 +2359,6 @@ class EditDocumentWindow(ctk.CTkToplevel):
             )
             return
 
-        db = Database()
-        temp_student = db.get_student(student_number)
-        student_exists = temp_student is not None
-
-        if not student_exists:
-            messagebox.showwarning(
-                "Student not found",
-                "Student number not found in the database.",
-            )
-            return
-
         if not num_of_copies.isdigit():
             messagebox.showwarning(
                 "Invalid Number of Copies",
@@ -1808,7 +2412,9 @@ class EditDocumentWindow(ctk.CTkToplevel):
                 return
 
         db = Database()
-        db.update_document_request(
+        task_runner.submit(
+            self.update_document_request,
+            db,
             self.document["id"],
             {
                 "student_id": student_number,
@@ -1823,8 +2429,27 @@ class EditDocumentWindow(ctk.CTkToplevel):
                 "receive_date": receive_date if receive_date != "" else None,
                 "messaged": False,
             },
+            on_success=self.on_submitted,
+            on_error=show_error,
+            owner=self,
         )
 
+    @staticmethod
+    def update_document_request(db, id, document):
+        if db.get_student(document["student_id"]) is None:
+            return False
+
+        db.update_document_request(id, document)
+        return True
+
+    def on_submitted(self, saved):
+        if not saved:
+            messagebox.showwarning(
+                "Student not found",
+                "Student number not found in the database.",
+            )
+            return
+
         self.master.populate_documents_table()
         self.destroy()
 
@@ -1835,8 +2460,15 @@ class SMSTab(ctk.CTkFrame):
 
         self.grid_columnconfigure(0, weight=1)
 
-        sms_types = ["Incomplete Grades", "Failed Grades", "Requested Documents"]
+        self.table_classes = {
+            "Incomplete Grades": IncompleteGradesTable,
+            "Failed Grades": FailedGradesTable,
+            "Requested Documents": RequestedDocumentsTable,
+        }
+        sms_types = list(self.table_classes)
         self.selected_sms_type = sms_types[0]
+        # Built on first selection, then kept
+        self.recipients_tables = {}
 
         # Widgets
         self.sms_type_label = ctk.CTkLabel(self, text="Type")
@@ -1848,14 +2480,25 @@ class SMSTab(ctk.CTkFrame):
         self.sms_type_option.set(sms_types[0])
 
         self.send_button = ctk.CTkButton(self, text="Send", command=self.send)
-        self.recipients_table = IncompleteGradesTable(self)
+        self.recipients_table = self.get_recipients_table(sms_types[0])
 
         self.message_label = ctk.CTkLabel(self, text="Message")
         self.variables_label = ctk.CTkLabel(self, text="Variables: ")
 
         self.message_text_box = ctk.CTkTextbox(self, height=100)
+        self.message_text_box.bind("<KeyRelease>", self.update_message_info)
+        self.message_info_label = ctk.CTkLabel(self, text="")
         self.set_message_text_box(message_templates["incomplete_grade"])
 
+        # Offer to finish campaigns interrupted by a crash
+        task_runner.submit(
+            self.check_outbox,
+            key="sms_outbox",
+            on_success=self.offer_resume,
+            on_error=show_error,
+            owner=self,
+        )
+
         # Grid
         self.sms_type_label.grid(row=0, column=0, padx=10, pady=(10, 0), sticky="w")
         self.sms_type_option.grid(row=1, column=0, padx=10, sticky="ew")
@@ -1863,32 +2506,71 @@ class SMSTab(ctk.CTkFrame):
         self.message_label.grid(row=3, column=0, padx=10, pady=(10, 0), sticky="w")
         self.variables_label.grid(row=4, column=0, padx=10, sticky="w")
         self.message_text_box.grid(row=5, column=0, padx=10, sticky="ew")
-        self.send_button.grid(row=6, column=0, padx=10, pady=(20, 10), sticky="ew")
+        self.message_info_label.grid(row=6, column=0, padx=10, sticky="w")
+        self.send_button.grid(row=7, column=0, padx=10, pady=(20, 10), sticky="ew")
+
+    def get_recipients_table(self, sms_type):
+        table = self.recipients_tables.get(sms_type)
+        if table is None:
+            table = self.table_classes[sms_type](self)
+            self.recipients_tables[sms_type] = table
+        return table
 
     def sms_type_option_callback(self, value):
-        self.recipients_table.destroy()
-        if value == "Incomplete Grades":
-            self.recipients_table = IncompleteGradesTable(self)
-            self.set_message_text_box(message_templates["incomplete_grade"])
-        elif value == "Failed Grades":
-            self.recipients_table = FailedGradesTable(self)
-            self.set_message_text_box(message_templates["failed_grade"])
-        elif value == "Requested Documents":
-            self.recipients_table.destroy()
-            self.recipients_table = RequestedDocumentsTable(self)
-            self.set_message_text_box(message_templates["requested_document"])
+        self.recipients_table.grid_remove()
+        self.recipients_table = self.get_recipients_table(value)
+        self.set_message_text_box(message_templates[self.recipients_table.kind])
         self.recipients_table.grid(row=2, column=0, padx=10, pady=(10, 0), sticky="ew")
         self.selected_sms_type = value
 
+        # Kept while hidden, so it may be out of date
+        self.recipients_table.refresh_if_stale()
+        self.send_button.configure(
+            text=f"Send to {len(self.recipients_table.recipients)} recipient(s)"
+        )
+
+    def refresh_if_stale(self):
+        """Fetch the shown recipients again if they changed or expired."""
+        self.recipients_table.refresh_if_stale()
+
     def set_message_text_box(self, message_template):
-        variables = re.findall(r"\{([A-Za-z_]+)\}", message_template)
-        variables = list(set(variables))
-        variables.sort()
-        variables = ["{" + variable + "}" for variable in variables]
-        variables = ", ".join(variables)
+        variables = compile_template(message_template).variables
+        variables = ", ".join("{" + variable + "}" for variable in variables)
         self.variables_label.configure(text=f"Variables: {variables}")
         self.message_text_box.delete("1.0", "end")
         self.message_text_box.insert("1.0", message_template)
+        self.update_message_info()
+
+    def get_message(self):
+        # Without the newline the text box always ends with
+        return self.message_text_box.get("1.0", "end-1c")
+
+    def update_message_info(self, event=None):
+        """Check the message and show how many SMS parts it is sent as.
+
+        The parts are counted on the message of the first recipient, the
+        others differ by the length of their names and subjects.
+        """
+        table = self.recipients_table
+        try:
+            compile_template(self.get_message(), table.campaign_class.fields)
+        except TemplateError as error:
+            self.message_info_label.configure(text=str(error), text_color="red")
+            return
+
+        messages = table.make_campaign(table.recipients[:1]).build_messages(
+            self.get_message()
+        )
+        if not messages:
+            self.message_info_label.configure(text="", text_color=("gray10", "gray90"))
+            return
+
+        count = count_segments(messages[0]["message"])
+        self.message_info_label.configure(
+            text=f"{count['units']} characters, {count['segments']} SMS part(s) "
+            f"per message ({count['encoding']})",
+            text_color=("gray10", "gray90"),
+        )
 
     def send(self):
         len_recipients = len(self.recipients_table.recipients)
@@ -1899,77 +2581,216 @@ class SMSTab(ctk.CTkFrame):
             )
             return
 
+        message = self.get_message()
+        try:
+            compile_template(message, self.recipients_table.campaign_class.fields)
+        except TemplateError as error:
+            messagebox.showerror("Invalid message", str(error))
+            return
+
         if self.selected_sms_type == "Incomplete Grades":
-            self.send_incomplete_grades()
+            send = self.send_incomplete_grades
         elif self.selected_sms_type == "Failed Grades":
-            self.send_failed_grades()
+            send = self.send_failed_grades
         elif self.selected_sms_type == "Requested Documents":
-            self.send_requested_documents()
+            send = self.send_requested_documents
 
+        self.send_button.configure(state="disabled")
+        task_runner.submit(
+            send,
+            self.recipients_table.recipients,
+            message,
+            key="sms_send",
+            on_success=self.on_sent,
+            on_error=self.on_send_error,
+            owner=self,
+        )
+
+    def on_sent(self, campaign):
+        self.send_button.configure(state="normal")
         self.recipients_table.populate_recipients_table()
 
         # Show success message with count of recipients
-        messagebox.showinfo(
-            "Success",
-            f"Message sent to {len_recipients} recipient(s).",
+        results = campaign["results"]
+        sent = sum(1 for result in results if result["success"])
+        segments = sum(result["segments"] for result in results if result["success"])
+        failed = [result["recipient"] for result in results if not result["success"]]
+        failed_acks = [ack for ack in campaign["acks"] if not ack["success"]]
+        if failed:
+            messagebox.showwarning(
+                "Some messages failed",
+                f"Message sent to {sent} recipient(s). "
+                f"Failed to send to {len(failed)}: {', '.join(failed[:10])}",
+            )
+        elif failed_acks:
+            messagebox.showwarning(
+                "Some records not updated",
+                f"Message sent to {sent} recipient(s), but {len(failed_acks)} of "
+                f"{len(campaign['acks'])} update request(s) failed. They will "
+                f"be retried on the next send.\n{failed_acks[0]['error']}",
+            )
+        else:
+            messagebox.showinfo(
+                "Success",
+                f"Message sent to {sent} recipient(s), {segments} SMS part(s).",
+            )
+
+    def on_send_error(self, error):
+        self.send_button.configure(state="normal")
+        self.recipients_table.populate_recipients_table()
+        show_error(error)
+
+    @staticmethod
+    def send_incomplete_grades(recipients, message):
+        return SMSTab.send_campaign(
+            IncompleteGradeSMS.from_recipients(recipients), message
         )
 
-    def send_incomplete_grades(self):
-        sms_driver = IncompleteGradeSMS(self.recipients_table.recipients)
-        sms_driver.send(self.message_text_box.get("1.0", "end"))
+    @staticmethod
+    def send_failed_grades(recipients, message):
+        return SMSTab.send_campaign(FailedGradeSMS.from_recipients(recipients), message)
 
-        # Update the recipients table column "messaged"
-        db = Database()
-        for recipient in self.recipients_table.recipients:
-            db.update_grade(recipient["grade_id"], {"messaged": True})
+    @staticmethod
+    def send_requested_documents(recipients, message):
+        return SMSTab.send_campaign(DocumentsSMS(recipients), message)
 
-    def send_failed_grades(self):
-        sms_driver = FailedGradeSMS(self.recipients_table.recipients)
-        sms_driver.send(self.message_text_box.get("1.0", "end"))
+    @staticmethod
+    def send_campaign(sms_driver, message=None):
+        # Every message is recorded in the outbox, so a crash midway neither
+        # loses nor repeats messages
+        outbox = shared_outbox()
+        results = sms_driver.send(message, outbox)
 
-        # Update the recipients table column "messaged"
+        # Update the recipients table column "messaged" in chunks, only for
+        # the messages that were actually sent
         db = Database()
-        for recipient in self.recipients_table.recipients:
-            db.update_grade(recipient["grade_id"], {"messaged": True})
+        acks = outbox.flush_acks(db.set_messaged)
 
-    def send_requested_documents(self):
-        sms_driver = DocumentsSMS(self.recipients_table.recipients)
-        sms_driver.send(self.message_text_box.get("1.0", "end"))
+        return {"results": results, "acks": acks}
 
-        # Update the recipients table column "messaged"
+    @staticmethod
+    def resume_campaigns(tables):
+        # Only the messages whose rows are still among the recipients are sent
         db = Database()
-        for recipient in self.recipients_table.recipients:
-            db.update_document_request(recipient["id"], {"messaged": True})
+        outbox = shared_outbox()
+        campaign = {"results": [], "acks": []}
+        for table in tables:
+            sms_driver = table.make_campaign(table.fetch_recipients(db))
+            campaign["results"] += sms_driver.send(outbox=outbox, resume=True)
+
+        campaign["acks"] = outbox.flush_acks(db.set_messaged)
+        return campaign
+
+    @staticmethod
+    def check_outbox():
+        # Rows of messages sent before the app stopped are marked first
+        outbox = shared_outbox()
+        acks = outbox.flush_acks(Database().set_messaged)
+        return {
+            "kinds": outbox.unfinished_kinds(),
+            "uncertain": outbox.uncertain(),
+            "acks": acks,
+        }
+
+    def offer_resume(self, outbox_state):
+        failed_acks = [ack for ack in outbox_state["acks"] if not ack["success"]]
+        if failed_acks:
+            messagebox.showwarning(
+                "Some records not updated",
+                f"{len(failed_acks)} update request(s) for messages sent earlier "
+                "failed. They will be retried on the next send.\n"
+                f"{failed_acks[0]['error']}",
+            )
+
+        kinds = outbox_state["kinds"]
+        uncertain = outbox_state["uncertain"]
+        if uncertain:
+            recipients = ", ".join(message["recipient"] for message in uncertain[:10])
+            delivered = messagebox.askyesno(
+                "Messages possibly sent",
+                f"{len(uncertain)} message(s) were being sent when the app "
+                f"stopped and may have been delivered: {recipients}\n\n"
+                "Yes: treat them as sent.\nNo: send them again.",
+            )
+            shared_outbox().resolve_uncertain(
+                [message["key"] for message in uncertain], delivered
+            )
+            if delivered:
+                task_runner.submit(
+                    shared_outbox().flush_acks,
+                    Database().set_messaged,
+                    key="sms_outbox",
+                    on_error=show_error,
+                    owner=self,
+                )
+            else:
+                kinds = sorted(set(kinds) | {m["kind"] for m in uncertain})
 
+        if not kinds:
+            return
 
-class IncompleteGradesTable(ctk.CTkFrame):
-    def __init__(self, master):
+        resume = messagebox.askyesno(
+            "Unfinished SMS campaign",
+            "A previous SMS campaign was interrupted. "
+            "Send the remaining messages now?",
+        )
+        if resume:
+            tables = [
+                self.get_recipients_table(sms_type)
+                for sms_type, table_class in self.table_classes.items()
+                if table_class.kind in kinds
+            ]
+            self.send_button.configure(state="disabled")
+            task_runner.submit(
+                self.resume_campaigns,
+                tables,
+                key="sms_send",
+                on_success=self.on_sent,
+                on_error=self.on_send_error,
+                owner=self,
+            )
+
+
+class RecipientsTable(ctk.CTkFrame):
+    """Base of the SMS recipients tables, kept alive between visits.
+
+    Changes to the recipients' table refresh it right away while it is on
+    screen, and only mark it stale while it is hidden. A stale table, or
+    one loaded more than `ttl` seconds ago, is refreshed in the background
+    when it is shown again. Refreshes are applied as a diff, so the
+    selection and the scroll position are kept.
+    """
+
+    # Identifies the campaign, see message_templates
+    kind = None
+    # The table whose changes affect the recipients
+    source_table = None
+    # The BulkSMS sending to the recipients
+    campaign_class = None
+    ttl = float(os.environ.get("SMS_RECIPIENTS_TTL", 120))
+
+    def __init__(self, master, columns):
         super().__init__(master, fg_color="transparent")
         self.grid_columnconfigure(0, weight=1)
+        self.recipients = []
+        self.stale = True
+        self.loaded_at = None
 
         # Widgets
-        self.recipients_table = ttk.Treeview(
+        self.recipients_table = VirtualTable(
             self,
-            columns=(
-                "contact_number",
-                "student_id",
-                "subject_code",
-                "course_code",
-                "year",
-                "sem",
-            ),
+            columns=[column for column, _ in columns],
             show="headings",
             selectmode="extended",
         )
         # Header setup
-        self.recipients_table.heading("contact_number", text="Contact Number")
-        self.recipients_table.heading("student_id", text="Student ID")
-        self.recipients_table.heading("subject_code", text="Subject Code")
-        self.recipients_table.heading("course_code", text="Course Code")
-        self.recipients_table.heading("year", text="Year")
-        self.recipients_table.heading("sem", text="Semester")
+        for column, text in columns:
+            self.recipients_table.heading(column, text=text)
 
         self.populate_recipients_table()
+        shared_feed().subscribe(
+            self.on_recipients_changed, [self.source_table], owner=self
+        )
 
         s = ttk.Style()
         s.configure("Treeview", rowheight=25)
@@ -1977,147 +2798,136 @@ class IncompleteGradesTable(ctk.CTkFrame):
         # Grid layout
         self.recipients_table.grid(row=0, column=0, sticky="ew")
 
-    def populate_recipients_table(self):
-        db = Database()
-        self.recipients = db.get_all_grade_not_messaged_yet("incomplete_grade")
-
-        # Delete
-        self.recipients_table.delete(*self.recipients_table.get_children())
-
-        for recipient in self.recipients:
-            self.recipients_table.insert(
-                "",
-                "end",
-                values=(
-                    recipient["student_info"]["contact_number"],
-                    recipient["student_id"],
-                    recipient["subjects"]["code"],
-                    recipient["student_info"]["course_code"],
-                    recipient["year"],
-                    recipient["sem"],
-                ),
-            )
-
-        # Set alternating row colors
-        self.recipients_table.tag_configure("oddrow", background="#252525")
-        self.recipients_table.tag_configure("evenrow", background="#353535")
-        # Apply alternating colors to rows
-        for index, recipient in enumerate(self.recipients_table.get_children()):
-            if index % 2 == 0:
-                self.recipients_table.item(recipient, tags=("evenrow",))
-            else:
-                self.recipients_table.item(recipient, tags=("oddrow",))
-
-        self.master.send_button.configure(
-            text=f"Send to {len(self.recipients)} recipient(s)"
-        )
-
+    def on_recipients_changed(self, changes):
+        # The tab view only unmaps the tab's frame, not the tables in it
+        if self.winfo_viewable():
+            self.populate_recipients_table()
+        else:
+            self.stale = True
 
-class FailedGradesTable(IncompleteGradesTable):
-    def __init__(self, master):
-        super().__init__(master)
+    def refresh_if_stale(self):
+        expired = self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl
+        if self.stale or expired:
+            self.populate_recipients_table()
 
     def populate_recipients_table(self):
-        db = Database()
-        self.recipients = db.get_all_grade_not_messaged_yet("failed_grade")
-
-        # Delete
-        self.recipients_table.delete(*self.recipients_table.get_children())
-
-        for recipient in self.recipients:
-            self.recipients_table.insert(
-                "",
-                "end",
-                values=(
-                    recipient["student_info"]["contact_number"],
-                    recipient["student_id"],
-                    recipient["subjects"]["code"],
-                    recipient["student_info"]["course_code"],
-                    recipient["year"],
-                    recipient["sem"],
-                ),
+        # Changes arriving during the fetch mark the table stale again
+        self.stale = False
+        self.loaded_at = time.monotonic()
+        task_runner.submit(
+            self.fetch_recipients,
+            Database(),
+            key=f"sms_recipients_{self.kind}",
+            on_success=self.show_recipients,
+            on_error=self.on_fetch_error,
+            owner=self,
+            span=f"{type(self).__name__}.populate_recipients_table",
+        )
+
+    def on_fetch_error(self, error):
+        # Fetched again the next time the tab is shown
+        self.stale = True
+        show_error(error)
+
+    def show_recipients(self, recipients):
+        self.recipients = recipients
+
+        # Rows are striped by the table itself
+        self.recipients_table.set_rows(
+            [self.recipient_row(recipient) for recipient in self.recipients],
+            keys=[self.recipient_key(recipient) for recipient in self.recipients],
+        )
+
+        if self.master.recipients_table is self:
+            self.master.send_button.configure(
+                text=f"Send to {len(self.recipients)} recipient(s)"
             )
+            self.master.update_message_info()
 
-        # Set alternating row colors
-        self.recipients_table.tag_configure("oddrow", background="#252525")
-        self.recipients_table.tag_configure("evenrow", background="#353535")
-        # Apply alternating colors to rows
-        for index, recipient in enumerate(self.recipients_table.get_children()):
-            if index % 2 == 0:
-                self.recipients_table.item(recipient, tags=("evenrow",))
-            else:
-                self.recipients_table.item(recipient, tags=("oddrow",))
+    def make_campaign(self, recipients):
+        return self.campaign_class(recipients)
 
-        self.master.send_button.configure(
-            text=f"Send to {len(self.recipients)} recipient(s)"
-        )
 
+class IncompleteGradesTable(RecipientsTable):
+    kind = "incomplete_grade"
+    source_table = "grades"
+    campaign_class = IncompleteGradeSMS
 
-class RequestedDocumentsTable(ctk.CTkFrame):
     def __init__(self, master):
-        super().__init__(master, fg_color="transparent")
-        self.grid_columnconfigure(0, weight=1)
-
-        # Widgets
-        self.recipients_table = ttk.Treeview(
-            self,
-            columns=(
-                "contact_number",
-                "student_id",
-                "request_id",
-                "document_type",
-            ),
-            show="headings",
-            selectmode="extended",
+        super().__init__(
+            master,
+            columns=[
+                ("contact_number", "Contact Number"),
+                ("student_id", "Student ID"),
+                ("subject_codes", "Subject Codes"),
+                ("course_code", "Course Code"),
+            ],
         )
-        # Header setup
-        self.recipients_table.heading("contact_number", text="Contact Number")
-        self.recipients_table.heading("student_id", text="Student ID")
-        self.recipients_table.heading("request_id", text="Request ID")
-        self.recipients_table.heading("document_type", text="Document Type")
 
-        self.populate_recipients_table()
-
-        s = ttk.Style()
-        s.configure("Treeview", rowheight=25)
+    def fetch_recipients(self, db):
+        # One row per student, grouped by the server
+        return db.get_grade_recipients(self.kind)
 
-        # Grid layout
-        self.recipients_table.grid(row=0, column=0, sticky="ew")
+    @staticmethod
+    def recipient_row(recipient):
+        return (
+            recipient["contact_number"],
+            recipient["student_id"],
+            ", ".join(grade["code"] for grade in recipient["grades"]),
+            recipient["course_code"],
+        )
 
-    def populate_recipients_table(self):
-        db = Database()
-        self.recipients = db.get_all_document_requests_not_messaged_yet()
+    @staticmethod
+    def recipient_key(recipient):
+        return recipient["student_id"]
 
-        # Delete
-        self.recipients_table.delete(*self.recipients_table.get_children())
+    def make_campaign(self, recipients):
+        return self.campaign_class.from_recipients(recipients)
 
-        for recipient in self.recipients:
-            self.recipients_table.insert(
-                "",
-                "end",
-                values=(
-                    recipient["student_info"]["contact_number"],
-                    recipient["student_id"],
-                    recipient["id"],
-                    recipient["document_type"]["type"],
-                ),
-            )
 
-        # Set alternating row colors
-        self.recipients_table.tag_configure("oddrow", background="#252525")
-        self.recipients_table.tag_configure("evenrow", background="#353535")
-        # Apply alternating colors to rows
-        for index, recipient in enumerate(self.recipients_table.get_children()):
-            if index % 2 == 0:
-                self.recipients_table.item(recipient, tags=("evenrow",))
-            else:
-                self.recipients_table.item(recipient, tags=("oddrow",))
+class FailedGradesTable(IncompleteGradesTable):
+    kind = "failed_grade"
+    campaign_class = FailedGradeSMS
 
-        self.master.send_button.configure(
-            text=f"Send to {len(self.recipients)} recipient(s)"
-        )
 
+class RequestedDocumentsTable(RecipientsTable):
+    kind = "requested_document"
+    source_table = "student_requests"
+    campaign_class = DocumentsSMS
 
-# Example usage
-login_screen = Login()
-login_screen.mainloop()
+    def __init__(self, master):
+        super().__init__(
+            master,
+            columns=[
+                ("contact_number", "Contact Number"),
+                ("student_id", "Student ID"),
+                ("request_id", "Request ID"),
+                ("document_type", "Document Type"),
+            ],
+        )
+
+    def fetch_recipients(self, db):
+        return db.get_all_document_requests_not_messaged_yet()
+
+    @staticmethod
+    def recipient_row(recipient):
+        return (
+            recipient["student_info"]["contact_number"],
+            recipient["student_id"],
+            recipient["id"],
+            recipient["document_type"]["type"],
+        )
+
+    @staticmethod
+    def recipient_key(recipient):
+        return recipient["id"]
+
+
+if __name__ == "__main__":
+    login_screen = Login()
+    task_runner.bind(login_screen)
+    login_screen.mainloop()
+    task_runner.shutdown()
+    change_feed.shutdown()
+    client_pool.close()
+    async_database.shutdown()
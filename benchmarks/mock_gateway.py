@@ -0,0 +1,90 @@
+"""A local stand-in for the SMS Chef send endpoint, for benchmarks."""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+
+
+class MockGateway:
+    """HTTP server answering like the SMS Chef `/api/send/sms` endpoint.
+
+    Attributes:
+        latency (float): Seconds each request waits before answering.
+        failure_rate (float): Share of requests answered with an error.
+        rate_limit (int): Requests accepted per second before answering with
+            429 Too Many Requests, unlimited when 0.
+        requests (int): The number of requests received so far.
+        throttled (int): The number of requests answered with 429.
+    """
+
+    def __init__(
+        self, latency: float = 0.05, failure_rate: float = 0.0, rate_limit: int = 0
+    ) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self.throttled = 0
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/send/sms"
+
+    def start(self) -> "MockGateway":
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                with gateway._lock:
+                    gateway.requests += 1
+                    second = int(time.monotonic())
+                    window, count = gateway._window
+                    count = count + 1 if window == second else 1
+                    gateway._window = (second, count)
+                    throttled = gateway.rate_limit and count > gateway.rate_limit
+                    if throttled:
+                        gateway.throttled += 1
+
+                time.sleep(gateway.latency)
+                if throttled:
+                    status, body = 429, {"status": 429, "message": "Too many requests"}
+                elif random.random() < gateway.failure_rate:
+                    status, body = 500, {"status": 500, "message": "Server error"}
+                else:
+                    status, body = 200, {"status": 200, "message": "Message queued"}
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockGateway":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
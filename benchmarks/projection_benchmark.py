@@ -0,0 +1,188 @@
+"""Compare the payload of full-row queries with the per-view projections.
+
+Usage:
+    python -m benchmarks.projection_benchmark --rows 20000
+    python -m benchmarks.projection_benchmark --live
+
+By default the responses are synthesized with the shape of each query. With
+--live both versions of every query are run against the database configured
+by SUPABASE_URL and SUPABASE_API_KEY.
+"""
+
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+
+from utils.common import projections
+
+# The select statements used before the projections, per view
+full_selects = {
+    "grade": ("grades", "remarks(remark), subjects(*), *"),
+    "document_request": (
+        "student_requests",
+        "document_type(type), request_statuses(status), *",
+    ),
+    "grade_recipient": ("grades", "student_info(*), remarks(remark), subjects(*), *"),
+    "document_recipient": ("student_requests", "student_info(*), document_type(*), *"),
+}
+
+
+def make_student(i):
+    return {
+        "student_id": f"2021{i:05d}",
+        "first_name": "Juan",
+        "middle_name": "Santos",
+        "last_name": f"Dela Cruz {i}",
+        "year_level": 3,
+        "email": f"juan.delacruz{i}@university.edu.ph",
+        "contact_number": f"0917{i:07d}",
+        "course_code": "BSCS",
+        "created_at": "2023-06-01T08:00:00.000000+00:00",
+        "updated_at": "2023-06-01T08:00:00.000000+00:00",
+    }
+
+
+def make_subject(i):
+    return {
+        "code": f"CS{i % 50:03d}",
+        "title": "Programming Languages",
+        "units": 3,
+        "created_at": "2023-06-01T08:00:00.000000+00:00",
+        "updated_at": "2023-06-01T08:00:00.000000+00:00",
+    }
+
+
+def make_grade(i):
+    return {
+        "grade_id": i,
+        "student_id": f"2021{i:05d}",
+        "grade": None,
+        "remark_id": 3,
+        "year": 3,
+        "sem": 1,
+        "subject_code": f"CS{i % 50:03d}",
+        "messaged": False,
+        "created_at": "2023-06-01T08:00:00.000000+00:00",
+        "updated_at": "2023-06-01T08:00:00.000000+00:00",
+        "remarks": {"remark": "INC"},
+        "subjects": make_subject(i),
+        "student_info": make_student(i),
+    }
+
+
+def make_document_request(i):
+    return {
+        "id": i,
+        "student_id": f"2021{i:05d}",
+        "mode": "Walk-in",
+        "document_type_id": 1,
+        "request_amount": 2,
+        "purpose": "Scholarship application",
+        "total": 150.0,
+        "receipt_no": f"OR-{i:06d}",
+        "payment_date": "2023-06-01",
+        "request_date": "2023-06-01",
+        "receive_date": None,
+        "student_request_status_id": 2,
+        "messaged": False,
+        "created_at": "2023-06-01T08:00:00.000000+00:00",
+        "updated_at": "2023-06-01T08:00:00.000000+00:00",
+        "document_type": {"id": 1, "type": "Transcript of Records"},
+        "request_statuses": {"status": "Ready"},
+        "student_info": make_student(i),
+    }
+
+
+def project(row, columns):
+    """Keep the fields of a row named in a PostgREST select statement."""
+    projected = {}
+    depth = 0
+    field = ""
+    for char in columns + ",":
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            field = field.strip()
+            if "(" in field:
+                name, inner = field.split("(", 1)
+                projected[name] = project(row[name], inner[:-1])
+            else:
+                projected[field] = row[field]
+            field = ""
+        else:
+            field += char
+
+    return projected
+
+
+def synthesize(view, count):
+    table, full = full_selects[view]
+    make = make_grade if table == "grades" else make_document_request
+    rows = [make(i) for i in range(count)]
+
+    if "student_info" not in full:
+        rows = [{k: v for k, v in row.items() if k != "student_info"} for row in rows]
+
+    return rows, [project(row, projections[view]) for row in rows]
+
+
+def fetch(view):
+    from utils.database import Database
+
+    table, full = full_selects[view]
+    db = Database()
+
+    responses = []
+    for columns in (full, projections[view]):
+        start = time.perf_counter()
+        responses.append(db.client.table(table).select(columns).execute().data)
+        print(f"  {view} fetch: {time.perf_counter() - start:.3f}s")
+
+    return responses
+
+
+def measure(rows, repeat):
+    payload = json.dumps(rows).encode()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        json.loads(payload)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    parsed = json.loads(payload)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del parsed
+
+    return len(payload), statistics.median(times), memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    for view in full_selects:
+        full, projected = fetch(view) if args.live else synthesize(view, args.rows)
+
+        print(f"{view} ({len(full)} rows)")
+        before = measure(full, args.repeat)
+        after = measure(projected, args.repeat)
+        for label, (size, parse, memory) in (("before", before), ("after", after)):
+            print(
+                f"  {label:<6}  payload={size / 1024:>8.0f} KiB  "
+                f"parse={parse * 1000:>7.1f} ms  memory={memory / 1024:>8.0f} KiB"
+            )
+        print(f"  saved   payload={1 - after[0] / before[0]:.0%}")
+
+
+if __name__ == "__main__":
+    main()
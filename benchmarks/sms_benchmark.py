@@ -0,0 +1,76 @@
+"""Measure BulkSMS throughput against a local mock gateway.
+
+Usage:
+    python -m benchmarks.sms_benchmark --recipients 500 --latency 0.05
+
+Pass --gateway-limit to make the mock throttle like the provider does, and
+--rate to enable the client side token bucket.
+"""
+
+import argparse
+import time
+
+from benchmarks.mock_gateway import MockGateway
+from utils.ratelimit import TokenBucket
+import utils.sms as sms
+
+
+def make_grades(count):
+    return [
+        {
+            "grade_id": i,
+            "student_id": f"2021{i:05d}",
+            "year": 1,
+            "sem": 1,
+            "student_info": {
+                "first_name": "Juan",
+                "middle_name": "Santos",
+                "last_name": f"Dela Cruz {i}",
+                "contact_number": f"0917{i:07d}",
+            },
+            "subjects": {"title": "Programming Languages"},
+        }
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--recipients", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--gateway-limit", type=int, default=0)
+    parser.add_argument("--rate", type=float, default=0, help="0 disables it")
+    args = parser.parse_args()
+
+    grades = make_grades(args.recipients)
+
+    with MockGateway(
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        rate_limit=args.gateway_limit,
+    ) as gateway:
+        sms.single_message_url = gateway.url
+
+        for concurrency in args.concurrency:
+            sms_driver = sms.IncompleteGradeSMS(grades)
+            sms_driver.concurrency = concurrency
+            sms_driver.rate_limiter = (
+                TokenBucket(args.rate, burst=concurrency) if args.rate else None
+            )
+
+            start = time.perf_counter()
+            results = sms_driver.send()
+            elapsed = time.perf_counter() - start
+
+            sent = sum(1 for result in results if result["success"])
+            print(
+                f"concurrency={concurrency:>3}  sent={sent}/{len(results)}  "
+                f"retries={sms_driver.retry_budget.spent}  "
+                f"time={elapsed:.2f}s  throughput={len(results) / elapsed:.1f} msg/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
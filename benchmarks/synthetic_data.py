@@ -0,0 +1,217 @@
+"""Generate a registrar data set at production scale in a local backend.
+
+Usage:
+    python -m benchmarks.synthetic_data --students 100000 --grades 2000000
+    DATABASE_MODE=local python app.py
+
+The data set is written to DB_LOCAL_PATH (or --path), replacing what is
+there. Log in with employee number "admin" and password "admin".
+"""
+
+import argparse
+import hashlib
+import itertools
+import random
+import time
+
+from utils.local_backend import LocalBackend, local_path
+
+timestamp = "2023-06-01T08:00:00+00:00"
+
+first_names = ["Juan", "Maria", "Jose", "Ana", "Mark", "Angela", "Paolo", "Bea"]
+last_names = ["Dela Cruz", "Santos", "Reyes", "Garcia", "Bautista", "Mendoza"]
+courses = ["BSCS", "BSIT", "BSIS", "BSEMC", "BSA", "BSN", "BSED", "BSCE"]
+
+remarks = [(1, "Passed"), (2, "Failed"), (3, "INC")]
+statuses = [(1, "Pending"), (2, "Ready"), (3, "Claimed")]
+document_types = [
+    (1, "Transcript of Records", 150.0),
+    (2, "Certificate of Enrollment", 50.0),
+    (3, "Certificate of Grades", 75.0),
+    (4, "Diploma", 300.0),
+]
+
+
+def make_lookups(subject_count):
+    return {
+        "remarks": [{"id": i, "remark": remark} for i, remark in remarks],
+        "request_statuses": [{"id": i, "status": status} for i, status in statuses],
+        "document_type": [
+            {
+                "id": i,
+                "type": name,
+                "price": price,
+                "created_at": timestamp,
+                "updated_at": timestamp,
+            }
+            for i, name, price in document_types
+        ],
+        "courses": [
+            {"course_code": code, "created_at": timestamp, "updated_at": timestamp}
+            for code in courses
+        ],
+        "subjects": [
+            {
+                "code": f"SUB{i:04d}",
+                "title": f"Subject {i}",
+                "units": 3,
+                "created_at": timestamp,
+                "updated_at": timestamp,
+            }
+            for i in range(subject_count)
+        ],
+        "login": [
+            {
+                "employee_number": "admin",
+                "hash": hashlib.md5(b"admin").hexdigest(),
+                "first_name": "Admin",
+                "middle_name": "",
+                "last_name": "Registrar",
+            }
+        ],
+    }
+
+
+def student_id(i):
+    return f"{2019 + i % 5}{i:06d}"
+
+
+def make_students(count, rng):
+    for i in range(count):
+        first = rng.choice(first_names)
+        last = rng.choice(last_names)
+        yield {
+            "student_id": student_id(i),
+            "first_name": first,
+            "middle_name": rng.choice(last_names),
+            "last_name": last,
+            "year_level": rng.randint(1, 4),
+            "email": f"{first}.{last}.{i}@university.edu.ph".lower().replace(" ", ""),
+            "contact_number": f"09{rng.randint(100000000, 999999999)}",
+            "course_code": rng.choice(courses),
+            "created_at": timestamp,
+            "updated_at": timestamp,
+        }
+
+
+def make_grades(count, students, subject_count, rng):
+    # 85% passed, 5% failed, 10% incomplete
+    remark_ids = [1] * 17 + [2] + [3] * 2
+
+    for i in range(count):
+        remark_id = rng.choice(remark_ids)
+        yield {
+            "grade_id": i + 1,
+            "student_id": student_id(i % students),
+            "grade": {1: round(rng.uniform(1, 3), 2), 2: 5.0, 3: None}[remark_id],
+            "remark_id": remark_id,
+            "year": rng.randint(1, 4),
+            "sem": rng.randint(1, 2),
+            "subject_code": f"SUB{rng.randrange(subject_count):04d}",
+            "messaged": remark_id == 1 or rng.random() < 0.5,
+            "created_at": timestamp,
+            "updated_at": timestamp,
+        }
+
+
+def make_requests(count, students, rng):
+    for i in range(count):
+        status_id = rng.choice([1, 1, 2, 3])
+        amount = rng.randint(1, 3)
+        document_type_id, _, price = rng.choice(document_types)
+        yield {
+            "id": i + 1,
+            "student_id": student_id(rng.randrange(students)),
+            "mode": rng.choice(["Walk-in", "Online"]),
+            "document_type_id": document_type_id,
+            "request_amount": amount,
+            "purpose": "Scholarship application",
+            "total": price * amount,
+            "receipt_no": f"OR-{i:07d}",
+            "payment_date": "2023-06-01",
+            "request_date": "2023-06-01",
+            "receive_date": "2023-06-08" if status_id == 3 else None,
+            "student_request_status_id": status_id,
+            "messaged": status_id == 3,
+            "created_at": timestamp,
+            "updated_at": timestamp,
+        }
+
+
+def generate(
+    backend,
+    students=100_000,
+    grades=2_000_000,
+    requests=50_000,
+    subjects=400,
+    seed=0,
+    batch_size=50_000,
+):
+    """Replace the data of a local backend with a generated data set.
+
+    Args:
+        backend (LocalBackend): The backend to fill.
+        students (int) (optional): The number of students.
+        grades (int) (optional): The number of grades, spread evenly across
+            the students.
+        requests (int) (optional): The number of document requests.
+        subjects (int) (optional): The number of subjects.
+        seed (int) (optional): The random seed, the same seed gives the same
+            data set.
+        batch_size (int) (optional): The number of rows written at once.
+
+    Returns:
+        dict: The number of rows written per table.
+    """
+    rng = random.Random(seed)
+    backend.clear()
+
+    counts = {}
+    for table, rows in make_lookups(subjects).items():
+        counts[table] = backend.load(table, rows)
+
+    generated = {
+        "student_info": make_students(students, rng),
+        "grades": make_grades(grades, students, subjects, rng),
+        "student_requests": make_requests(requests, students, rng),
+    }
+    for table, rows in generated.items():
+        counts[table] = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            counts[table] += backend.load(table, batch)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--path", default=local_path)
+    parser.add_argument("--students", type=int, default=100_000)
+    parser.add_argument("--grades", type=int, default=2_000_000)
+    parser.add_argument("--requests", type=int, default=50_000)
+    parser.add_argument("--subjects", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    backend = LocalBackend(args.path)
+    start = time.perf_counter()
+    counts = generate(
+        backend,
+        students=args.students,
+        grades=args.grades,
+        requests=args.requests,
+        subjects=args.subjects,
+        seed=args.seed,
+    )
+    backend.close()
+
+    for table, count in counts.items():
+        print(f"  {table:<18} {count:>10,} rows")
+    print(f"Generated {args.path} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
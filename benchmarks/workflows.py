@@ -0,0 +1,328 @@
+"""Benchmark the registrar workflows end to end on a local backend.
+
+Usage:
+    python -m benchmarks.workflows --output results.json
+    python -m benchmarks.workflows --path ~/.registrar/local.sqlite3
+    python -m benchmarks.workflows --compare before.json --output after.json
+
+Runs the code paths behind the hot spots of the app, without the widgets:
+the roster load of StudentsTab.populate_students_table, the grade lookup of
+GradesTab.search, the status filter of DocumentsTab, the Excel import, and
+the generation and dispatch of a bulk SMS campaign against a mock gateway.
+
+Each workflow reports latency percentiles, throughput in items (rows,
+lookups or messages) per second and the peak memory Python allocated while
+it ran. Without --path a data set is generated first (see
+benchmarks/synthetic_data.py), the same seed always gives the same data.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from operator import itemgetter
+
+from benchmarks.mock_gateway import MockGateway
+from benchmarks.synthetic_data import generate, make_students
+from utils.async_database import AsyncDatabase, run as run_async
+from utils.cache import TTLCache
+from utils.common import projections
+from utils.database import Database
+from utils.importer import import_students
+from utils.local_backend import LocalBackend
+from utils.search import StudentIndex
+from utils.sync import parse_select
+import utils.sms as sms
+
+
+class Workflow:
+    """A workflow to benchmark.
+
+    Attributes:
+        name (str): The name it is reported under.
+        run (callable): Runs the workflow once and returns the number of
+            items it processed.
+        setup (callable): Called before each run, outside the measurement.
+    """
+
+    def __init__(self, name, run, setup=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def measure(workflow, repeat, warmup=1):
+    for _ in range(warmup):
+        if workflow.setup:
+            workflow.setup()
+        workflow.run()
+
+    times = []
+    items = 0
+    for _ in range(repeat):
+        if workflow.setup:
+            workflow.setup()
+        start = time.perf_counter()
+        items += workflow.run()
+        times.append(time.perf_counter() - start)
+
+    # Tracing slows every allocation down, so memory is measured apart
+    if workflow.setup:
+        workflow.setup()
+    tracemalloc.start()
+    workflow.run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "iterations": repeat,
+        "items": items,
+        "p50_ms": percentile(times, 0.50) * 1000,
+        "p95_ms": percentile(times, 0.95) * 1000,
+        "p99_ms": percentile(times, 0.99) * 1000,
+        "mean_ms": statistics.mean(times) * 1000,
+        "max_ms": max(times) * 1000,
+        "throughput": items / sum(times) if sum(times) else 0.0,
+        "peak_memory_kib": peak / 1024,
+    }
+
+
+def fresh_database(backend):
+    # Each run starts cold, like the first load after opening the app
+    return Database(backend=backend, cache=TTLCache(), index=StudentIndex())
+
+
+def roster_load(backend):
+    columns = [name for name, _ in parse_select(projections["student"])]
+    student_row = itemgetter(*columns)
+
+    def run():
+        db = fresh_database(backend)
+        rows = []
+        for page in db.iter_all("student_info", columns=projections["student"]):
+            rows += map(student_row, page)
+        return len(rows)
+
+    return Workflow("roster_load", run)
+
+
+def grade_lookup(backend, lookups, rng):
+    student_ids = [
+        row["student_id"]
+        for row in backend.table("student_info").select("student_id").execute().data
+    ]
+
+    def run():
+        db = AsyncDatabase(backend=backend, cache=TTLCache(), index=StudentIndex())
+        for student_id in rng.sample(student_ids, min(lookups, len(student_ids))):
+            run_async(
+                db.get_student_with_grades(
+                    student_id, rng.randint(1, 4), rng.randint(1, 2)
+                )
+            )
+        return min(lookups, len(student_ids))
+
+    return Workflow("grade_lookup", run)
+
+
+def document_status_filter(backend):
+    def run():
+        db = fresh_database(backend)
+        count = 0
+        for status in ("pending", "ready", "claimed"):
+            count += len(db.get_document_requests_by_status(status))
+        return count
+
+    return Workflow("document_status_filter", run)
+
+
+def excel_import(backend, rows, directory):
+    import pandas as pd
+
+    students = list(make_students(rows, random.Random(1)))
+    for i, student in enumerate(students):
+        # Not in the generated data set, so every row is inserted
+        student["student_id"] = f"9{i:09d}"
+    columns = [
+        "student_id",
+        "first_name",
+        "middle_name",
+        "last_name",
+        "year_level",
+        "email",
+        "contact_number",
+        "course_code",
+    ]
+    path = os.path.join(directory, "students.xlsx")
+    pd.DataFrame(students)[columns].to_excel(path, index=False)
+    student_ids = [student["student_id"] for student in students]
+
+    def setup():
+        for start in range(0, len(student_ids), 500):
+            backend.table("student_info").delete().in_(
+                "student_id", student_ids[start : start + 500]
+            ).execute()
+
+    def run():
+        report = import_students(pd.read_excel(path), fresh_database(backend))
+        return report.total
+
+    return Workflow("excel_import", run, setup)
+
+
+def sms_generation(backend):
+    def run():
+        recipients = fresh_database(backend).get_grade_recipients("incomplete_grade")
+        return len(sms.IncompleteGradeSMS.from_recipients(recipients).build_messages())
+
+    return Workflow("sms_generation", run)
+
+
+def sms_dispatch(backend, recipients, concurrency):
+    chosen = fresh_database(backend).get_grade_recipients("incomplete_grade")
+    chosen = chosen[:recipients]
+
+    def run():
+        campaign = sms.IncompleteGradeSMS.from_recipients(chosen)
+        campaign.concurrency = concurrency
+        campaign.rate_limiter = None
+        return len(campaign.send())
+
+    return Workflow("sms_dispatch", run)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before, after):
+    print(f"\nCompared with {before['meta'].get('commit')}:")
+    for name, result in after["results"].items():
+        previous = before["results"].get(name)
+        if previous is None:
+            continue
+        changes = [
+            f"{metric}={result[metric] / previous[metric] - 1:+.0%}"
+            for metric in ("p50_ms", "p95_ms", "throughput", "peak_memory_kib")
+            if previous[metric]
+        ]
+        print(f"  {name:<24} {'  '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--path", help="a local backend to use instead of generating")
+    parser.add_argument("--students", type=int, default=10_000)
+    parser.add_argument("--grades", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=50)
+    parser.add_argument("--import-rows", type=int, default=2_000)
+    parser.add_argument("--sms-recipients", type=int, default=300)
+    parser.add_argument("--sms-latency", type=float, default=0.01)
+    parser.add_argument("--sms-concurrency", type=int, default=sms.max_concurrency)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", help="the workflows to run")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="results of an earlier run")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory, MockGateway(
+        latency=args.sms_latency
+    ) as gateway:
+        sms.single_message_url = gateway.url
+
+        if args.path:
+            backend = LocalBackend(args.path)
+        else:
+            backend = LocalBackend(os.path.join(directory, "local.sqlite3"))
+            print(f"Generating {args.students} students and {args.grades} grades...")
+            generate(
+                backend,
+                students=args.students,
+                grades=args.grades,
+                requests=args.requests,
+                seed=args.seed,
+            )
+
+        workflows = [
+            roster_load(backend),
+            grade_lookup(backend, args.lookups, rng),
+            document_status_filter(backend),
+            excel_import(backend, args.import_rows, directory),
+            sms_generation(backend),
+            sms_dispatch(backend, args.sms_recipients, args.sms_concurrency),
+        ]
+
+        results = {}
+        for workflow in workflows:
+            if args.only and workflow.name not in args.only:
+                continue
+
+            result = results[workflow.name] = measure(workflow, args.repeat)
+            print(
+                f"{workflow.name:<24} p50={result['p50_ms']:>9.1f} ms  "
+                f"p95={result['p95_ms']:>9.1f} ms  "
+                f"throughput={result['throughput']:>10.0f}/s  "
+                f"peak={result['peak_memory_kib'] / 1024:>7.1f} MiB"
+            )
+
+        backend.close()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "data": args.path
+            or {
+                "students": args.students,
+                "grades": args.grades,
+                "requests": args.requests,
+                "seed": args.seed,
+            },
+            "args": vars(args),
+            # Includes SQLite and everything else outside the Python heap
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Saved {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+-- Server side of the delta sync in utils/sync.py. Run once in the Supabase
+-- SQL editor.
+--
+-- Clients stamp updated_at with their own clock and time zone, which cannot
+-- be compared across clients, so every insert and update is restamped by the
+-- server. Deleted rows are recorded in a tombstones table, so clients that
+-- copied a table can drop them without downloading it again.
+
+create or replace function touch_updated_at() returns trigger as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$ language plpgsql;
+
+create table if not exists tombstones (
+    id bigserial primary key,
+    table_name text not null,
+    row_key text not null,
+    deleted_at timestamptz not null default now()
+);
+
+create index if not exists tombstones_table_name_deleted_at
+    on tombstones (table_name, deleted_at);
+
+grant select on tombstones to anon, authenticated;
+
+create or replace function record_tombstone() returns trigger as $$
+begin
+    insert into tombstones (table_name, row_key)
+    values (tg_table_name, to_jsonb(old) ->> tg_argv[0]);
+    return old;
+end;
+$$ language plpgsql;
+
+-- Keep in sync with tracked_tables in utils/sync.py
+do $$
+declare
+    tracked record;
+begin
+    for tracked in
+        select * from (values
+            ('student_info', 'student_id'),
+            ('grades', 'grade_id'),
+            ('subjects', 'code'),
+            ('courses', 'course_code'),
+            ('document_type', 'id'),
+            ('student_requests', 'id')
+        ) as t (table_name, key_column)
+    loop
+        execute format(
+            'alter table %I add column if not exists updated_at timestamptz not null default now()',
+            tracked.table_name
+        );
+        execute format(
+            'create index if not exists %I on %I (updated_at)',
+            tracked.table_name || '_updated_at',
+            tracked.table_name
+        );
+        execute format(
+            'drop trigger if exists touch_updated_at on %I', tracked.table_name
+        );
+        execute format(
+            'create trigger touch_updated_at before insert or update on %I '
+            'for each row execute function touch_updated_at()',
+            tracked.table_name
+        );
+        execute format(
+            'drop trigger if exists record_tombstone on %I', tracked.table_name
+        );
+        execute format(
+            'create trigger record_tombstone after delete on %I '
+            'for each row execute function record_tombstone(%L)',
+            tracked.table_name,
+            tracked.key_column
+        );
+    end loop;
+end;
+$$;
+
+-- Tombstones are only needed for TOMBSTONE_RETENTION_DAYS (30 by default),
+-- clients that did not sync for longer copy the tables again. Prune them
+-- periodically, e.g. with pg_cron:
+--
+--   delete from tombstones where deleted_at < now() - interval '30 days';
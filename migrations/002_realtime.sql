@@ -0,0 +1,4 @@
+-- Publish the row changes the app listens to, see utils/changes.py. Run once
+-- in the Supabase SQL editor.
+
+alter publication supabase_realtime add table grades, student_requests, student_info;
@@ -0,0 +1,41 @@
+-- Recipients of the grade SMS campaigns, one row per student, see
+-- Database.get_grade_recipients. Run once in the Supabase SQL editor.
+--
+-- The campaigns used to fetch one row per grade, each embedding the whole
+-- student, and group them by student on the client. The view groups them
+-- on the server: each student's contact info is sent once, with the list of
+-- their grades not messaged yet. utils/local_backend.py has the same view
+-- for the local backend.
+
+create index if not exists grades_not_messaged
+    on grades (remark_id, student_id) where not messaged;
+
+create or replace view grade_recipients
+with (security_invoker = true) as
+select
+    s.student_id,
+    g.remark_id,
+    s.first_name,
+    s.middle_name,
+    s.last_name,
+    s.contact_number,
+    s.course_code,
+    max(g.updated_at) as updated_at,
+    json_agg(
+        json_build_object(
+            'grade_id', g.grade_id,
+            'code', sub.code,
+            'title', sub.title,
+            'year', g.year,
+            'sem', g.sem,
+            'updated_at', g.updated_at
+        )
+        order by g.grade_id
+    ) as grades
+from grades g
+join student_info s on s.student_id = g.student_id
+join subjects sub on sub.code = g.subject_code
+where not g.messaged
+group by s.student_id, g.remark_id;
+
+grant select on grade_recipients to anon, authenticated;
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.environ["DATABASE_MODE"] = "local"
+os.environ["DB_LOCAL_PATH"] = os.path.join(tempfile.mkdtemp(), "local.sqlite3")
+
+import pytest
+
+from benchmarks.synthetic_data import generate
+from utils.local_backend import shared_local_backend
+from utils.tasks import task_runner
+import app
+
+students = 1500
+
+
+@pytest.fixture(scope="module", autouse=True)
+def roster():
+    backend = shared_local_backend()
+    if not backend.table("student_info").select("student_id").limit(1).execute().data:
+        generate(backend, students=students, grades=100, requests=10)
+
+
+@pytest.fixture
+def root():
+    import tkinter
+
+    try:
+        root = app.ctk.CTk()
+    except tkinter.TclError as error:
+        pytest.skip(f"No display: {error}")
+
+    task_runner.bind(root)
+    yield root
+    task_runner.shutdown()
+    root.destroy()
+
+
+def pump(root, until, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not until():
+        assert time.monotonic() < deadline, "timed out"
+        root.update()
+        time.sleep(0.01)
+
+
+def test_students_tab_streams_the_roster(root):
+    tab = app.StudentsTab(root)
+
+    pump(root, lambda: tab.roster_loaded)
+    keys = tab.students_table.get_children()
+    assert len(keys) == students
+    assert len(set(keys)) == students
+
+
+def test_reload_replaces_an_unfinished_first_load(root):
+    tab = app.StudentsTab(root)
+    tab.populate_students_table()
+
+    pump(root, lambda: tab.roster_loaded)
+    keys = tab.students_table.get_children()
+    assert len(keys) == len(set(keys)) == students
+
+
+def test_reload_clears_the_pages_of_an_unfinished_first_load(monkeypatch):
+    # Runs without a display, on a stand-in for the tab
+    calls = []
+    tab = SimpleNamespace(
+        roster_loaded=False,
+        students_table=SimpleNamespace(
+            set_rows=lambda rows, keys: calls.append(("set_rows", rows, keys))
+        ),
+        add_roster_page=None,
+        show_roster=None,
+        on_roster_error=None,
+    )
+    tab.load_roster = lambda: app.StudentsTab.load_roster(tab)
+    monkeypatch.setattr(
+        task_runner, "stream", lambda *args, **kwargs: calls.append(("stream",))
+    )
+
+    app.StudentsTab.populate_students_table(tab)
+
+    assert calls == [("set_rows", [], []), ("stream",)]
+    assert tab.roster == []
+
+
+def test_roster_load_starts_before_the_table_exists(monkeypatch):
+    # The stand-in has no table, only the stream's callbacks may touch it
+    calls = []
+    tab = SimpleNamespace(add_roster_page=None, show_roster=None, on_roster_error=None)
+    monkeypatch.setattr(
+        task_runner, "stream", lambda *args, **kwargs: calls.append(kwargs["key"])
+    )
+
+    app.StudentsTab.load_roster(tab)
+
+    assert calls == ["students_table"]
+    assert tab.roster == []
+
+
+def test_search_typed_during_the_first_load_waits_for_the_roster(monkeypatch):
+    calls = []
+    tab = SimpleNamespace(
+        roster_loading=True,
+        populate_students_table=lambda: calls.append("populate"),
+    )
+    monkeypatch.setattr(
+        app, "Database", lambda: SimpleNamespace(index=SimpleNamespace(ready=False))
+    )
+    monkeypatch.setattr(
+        task_runner, "submit", lambda *args, **kwargs: calls.append(args)
+    )
+
+    app.StudentsTab.filter_students(tab, "dela cruz")
+    assert calls == []
+
+    # A failed load is started again
+    tab.roster_loading = False
+    app.StudentsTab.filter_students(tab, "dela cruz")
+    assert calls == ["populate"]
@@ -0,0 +1,19 @@
+from utils.sync import synced_query, reset_synced_queries
+from utils.common import projections
+
+
+def test_student_changes_reset_the_queries_embedding_students():
+    client = object()
+    recipients = synced_query(
+        client, "student_requests", projections["document_recipient"], messaged=False
+    )
+    requests = synced_query(
+        client, "student_requests", projections["document_request"], messaged=False
+    )
+    recipients.delta.marks["student_requests"] = {"updated_at": None}
+    requests.delta.marks["student_requests"] = {"updated_at": None}
+
+    reset_synced_queries("student_info")
+
+    assert recipients.delta.marks == {}
+    assert requests.delta.marks == {"student_requests": {"updated_at": None}}
@@ -0,0 +1,248 @@
+from .common import *
+from .cache import TTLCache
+from .metrics import metrics, count_rows, count_async_response_bytes
+from .search import StudentIndex, student_index
+from .database import url, key, database_mode, connect, query_cache
+from .database import Database, Gather, Collect, Page
+import asyncio
+import inspect
+import os
+import threading
+import time
+
+max_in_flight = int(os.environ.get("DB_MAX_IN_FLIGHT", 8))
+request_timeout = float(os.environ.get("DB_TIMEOUT", 30))
+
+
+_loop = None
+_loop_lock = threading.Lock()
+_shared = None
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """Get the background event loop the async database runs on.
+
+    The loop runs forever on a daemon thread, so the HTTP connections of the
+    shared AsyncDatabase stay open between calls made from worker threads.
+    """
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="async-database", daemon=True
+            ).start()
+        return _loop
+
+
+def run(coroutine, timeout: float = None):
+    """Run a coroutine on the background event loop and wait for its result.
+
+    Must not be called from the loop itself, e.g. from inside a coroutine.
+
+    Args:
+        coroutine: The coroutine to run.
+        timeout (float) (optional): Seconds to wait before giving up.
+
+    Returns:
+        The coroutine's result.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result(timeout)
+
+
+def shared_async_database() -> "AsyncDatabase":
+    """Get the process-wide AsyncDatabase, creating it on first use."""
+    global _shared
+
+    with _loop_lock:
+        if _shared is None:
+            _shared = AsyncDatabase()
+        return _shared
+
+
+def shutdown() -> None:
+    """Close the shared database's connections and stop the event loop."""
+    global _loop, _shared
+
+    if _loop is None:
+        return
+
+    if _shared is not None:
+        run(_shared.aclose(), timeout=5)
+        _shared = None
+
+    _loop.call_soon_threadsafe(_loop.stop)
+    _loop = None
+
+
+class Blocking:
+    """Synchronous view of an AsyncDatabase for code running on threads.
+
+    Every operation is run on the background event loop and waited for, so
+    `Blocking(db).insert_students(...)` can be passed anywhere a Database is
+    expected while still sending its requests concurrently.
+    """
+
+    def __init__(self, database: "AsyncDatabase") -> None:
+        self._database = database
+
+    def __getattr__(self, name):
+        attribute = getattr(self._database, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return run(result) if inspect.iscoroutine(result) else result
+
+        return call
+
+
+class AsyncExecutor:
+    """Runs the steps of Database operations as coroutines.
+
+    The steps of a `Gather` run at the same time, at most `max_in_flight`
+    requests at once.
+    """
+
+    synchronous = False
+
+    def __init__(self, max_in_flight: int = max_in_flight) -> None:
+        self.max_in_flight = max_in_flight
+        self._semaphore = None
+
+    async def run(self, name: str, steps):
+        with metrics.counting_bytes():
+            with metrics.span(name) as span:
+                result = await self._drive(steps)
+                span["rows"] = count_rows(result)
+        return result
+
+    async def stream(self, name: str, steps):
+        # Timed while fetching pages, not while the caller holds them
+        start = time.perf_counter()
+        busy = 0.0
+        rows = 0
+        received = 0
+        value = error = None
+        while True:
+            resumed = time.perf_counter()
+            try:
+                step = steps.send(value) if error is None else steps.throw(error)
+            except StopIteration:
+                break
+            value = error = None
+
+            if isinstance(step, Page):
+                busy += time.perf_counter() - resumed
+                rows += len(step.rows)
+                yield step.rows
+                continue
+            try:
+                with metrics.counting_bytes():
+                    before = metrics.received()
+                    value = await self._resolve(step)
+                    received += metrics.received() - before
+            except Exception as exception:
+                error = exception
+            busy += time.perf_counter() - resumed
+        metrics.record(name, start, busy, rows, received)
+
+    async def _drive(self, steps, pages=None):
+        value = error = None
+        while True:
+            try:
+                step = steps.send(value) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            value = error = None
+
+            if isinstance(step, Page):
+                if pages is not None:
+                    pages.append(step.rows)
+                continue
+            try:
+                value = await self._resolve(step)
+            except Exception as exception:
+                error = exception
+
+    async def _resolve(self, step):
+        if isinstance(step, Gather):
+            return list(await asyncio.gather(*map(self._resolve, step.steps)))
+        if isinstance(step, Collect):
+            pages = []
+            await self._drive(step.steps, pages)
+            return pages
+        if inspect.isgenerator(step):
+            return await self._drive(step)
+        return await self._execute(step)
+
+    async def _execute(self, query) -> list:
+        # Created lazily so it belongs to the loop the queries run on
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async with self._semaphore:
+            return (await query.execute()).data
+
+
+class AsyncDatabase(Database):
+    """Database whose operations are coroutines.
+
+    Built on the async PostgREST client, so independent queries can run at
+    the same time, see `AsyncExecutor`. The operations are the ones of
+    `Database`, only run by another executor.
+
+    Shares the query cache and the student index with `Database`, so both
+    see each other's writes.
+    """
+
+    def __init__(
+        self,
+        url: str = url,
+        key: str = key,
+        cache: TTLCache = query_cache,
+        index: StudentIndex = student_index,
+        max_in_flight: int = max_in_flight,
+        backend=None,
+    ) -> None:
+        if backend is None and database_mode != "remote":
+            backend = connect(url, key)
+
+        client = None
+        if backend is None or backend.tables != valid_tables:
+            from postgrest import AsyncPostgrestClient
+
+            client = AsyncPostgrestClient(
+                f"{url}/rest/v1",
+                headers={
+                    "Accept": "application/json",
+                    "Content-Type": "application/json",
+                    "apiKey": key,
+                    "Authorization": f"Bearer {key}",
+                },
+                timeout=request_timeout,
+            )
+            client.session.event_hooks["response"].append(count_async_response_bytes)
+        if backend is not None:
+            from .replica import AsyncReplica
+
+            # Tables the backend does not serve still go to the server
+            client = AsyncReplica(backend, client)
+
+        super().__init__(url, key, cache, index, backend=client)
+        self.executor = AsyncExecutor(max_in_flight)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def __aenter__(self) -> "AsyncDatabase":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    @property
+    def blocking(self) -> Blocking:
+        return Blocking(self)
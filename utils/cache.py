@@ -0,0 +1,96 @@
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a time-to-live.
+
+    Entries are grouped by table so that a write to a table can drop every
+    cached lookup that read from it. Values are copied in and out, so callers
+    can modify the lists and dicts they get without changing the cache.
+
+    Attributes:
+        ttl (float): Seconds an entry stays valid.
+        maxsize (int): Maximum number of entries kept before the least
+            recently used one is evicted.
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 1024) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, table: str, key, default=None):
+        """Get a cached value.
+
+        Args:
+            table (str): The table the value was read from.
+            key: The lookup key.
+            default: Returned when the key is missing or expired.
+
+        Returns:
+            A copy of the cached value, or default.
+        """
+        with self._lock:
+            entry = self._entries.get((table, key))
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end((table, key))
+            self.hits += 1
+            value = entry[1]
+        return copy.deepcopy(value)
+
+    def contains(self, table: str, key) -> bool:
+        """Check whether a fresh value is cached for the key."""
+        with self._lock:
+            entry = self._entries.get((table, key))
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def set(self, table: str, key, value) -> None:
+        """Cache a value.
+
+        Args:
+            table (str): The table the value was read from.
+            key: The lookup key.
+            value: The value to cache.
+        """
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[(table, key)] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end((table, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, table: str, key) -> None:
+        """Drop a single cached value."""
+        with self._lock:
+            self._entries.pop((table, key), None)
+
+    def invalidate(self, table: str = None) -> None:
+        """Drop every cached value of a table, or of all tables.
+
+        Args:
+            table (str) (optional): The table to invalidate. Clears the whole
+                cache when omitted.
+        """
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+                return
+
+            for cache_key in [k for k in self._entries if k[0] == table]:
+                del self._entries[cache_key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
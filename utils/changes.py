@@ -0,0 +1,340 @@
+from .common import primary_keys
+from .cache import TTLCache
+from .search import StudentIndex, student_index
+from .database import url, key, database_mode, query_cache
+from .sync import reset_synced_queries
+from .tasks import task_runner
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+realtime_enabled = os.environ.get("REALTIME_ENABLED", "1") == "1"
+coalesce_window = float(os.environ.get("REALTIME_COALESCE_MS", 250)) / 1000
+heartbeat_interval = float(os.environ.get("REALTIME_HEARTBEAT", 25))
+
+# Tables whose changes are listened to, see migrations/002_realtime.sql
+feed_tables = ["grades", "student_requests", "student_info"]
+
+# Change types
+INSERT = "INSERT"
+UPDATE = "UPDATE"
+DELETE = "DELETE"
+# Changes may have been missed, e.g. while reconnecting
+RESYNC = "RESYNC"
+
+
+def realtime_url(url: str, key: str) -> str:
+    """Get the websocket URL of a Supabase project's realtime server."""
+    host = url.replace("https://", "wss://").replace("http://", "ws://")
+    return f"{host.rstrip('/')}/realtime/v1/websocket?apikey={key}&vsn=1.0.0"
+
+
+class ChangeFeed:
+    """Listens to the row changes of tables and hands them to subscribers.
+
+    Runs a websocket to the Supabase realtime server on a background thread.
+    Changes are collected for `window` seconds after the first one of a
+    burst, and only the last change of each row is delivered, so a bulk
+    update of 500 grades reaches the subscribers as one batch.
+
+    The realtime package of supabase-py only speaks the legacy protocol, whose
+    join message cannot ask for postgres_changes, so the channel is joined
+    here with the same Phoenix messages.
+
+    Attributes:
+        tables (list): The tables listened to.
+        window (float): Seconds changes are collected before delivery.
+        connected (bool): Whether the feed is joined and receiving changes.
+    """
+
+    def __init__(
+        self,
+        url: str = url,
+        key: str = key,
+        tables: list = feed_tables,
+        window: float = coalesce_window,
+    ) -> None:
+        self.url = url
+        self.key = key
+        self.tables = tables
+        self.window = window
+        self.connected = False
+        self._subscribers = []
+        self._pending = {}
+        self._flush_handle = None
+        self._loop = None
+        self._thread = None
+        self._stopping = False
+        self._refs = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback, tables: list = None, owner=None) -> None:
+        """Call a function with every batch of changes.
+
+        Args:
+            callback (callable): Called with a dict mapping each changed table
+                to its changes. A change is a dict with `type`, `table`, `key`
+                (the primary key as text), `record` and `old_record`.
+            tables (list) (optional): Only deliver changes to these tables.
+            owner (widget) (optional): Deliver on the Tk main thread through
+                the task runner, until this widget is destroyed. Without an
+                owner the callback runs on the feed's thread.
+        """
+        with self._lock:
+            self._subscribers.append((callback, tables, owner))
+
+    def unsubscribe(self, callback) -> None:
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[0] != callback]
+
+    def start(self) -> None:
+        """Connect in the background, reconnecting until stopped."""
+        if self._thread is not None:
+            return
+
+        self._stopping = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_until_complete,
+            args=(self._run(),),
+            name="change-feed",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping = True
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._cancel_tasks)
+        self._thread = None
+        self.connected = False
+
+    def _cancel_tasks(self) -> None:
+        for task in asyncio.all_tasks(self._loop):
+            task.cancel()
+
+    async def _run(self) -> None:
+        # Imported on the feed's thread, so they do not slow startup down
+        import websockets
+
+        delay = 1
+        while not self._stopping:
+            error = "connection closed"
+            try:
+                async with websockets.connect(realtime_url(self.url, self.key)) as ws:
+                    await self._join(ws)
+                    delay = 1
+                    heartbeat = asyncio.ensure_future(self._heartbeat(ws))
+                    try:
+                        await self._receive(ws)
+                    finally:
+                        heartbeat.cancel()
+            except asyncio.CancelledError:
+                break
+            except Exception as exception:
+                error = exception
+
+            if self._stopping:
+                break
+
+            if self.connected:
+                logger.warning("Change feed disconnected: %s", error)
+                # Whatever changed while disconnected has to be fetched again
+                self._queue_resync()
+            self.connected = False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def _join(self, ws) -> None:
+        from realtime.message import ChannelEvents
+
+        await ws.send(
+            json.dumps(
+                {
+                    "topic": "realtime:registrar",
+                    "event": ChannelEvents.join,
+                    "payload": {
+                        "config": {
+                            "postgres_changes": [
+                                {"event": "*", "schema": "public", "table": table}
+                                for table in self.tables
+                            ]
+                        },
+                        "access_token": self.key,
+                    },
+                    "ref": str(next(self._refs)),
+                }
+            )
+        )
+
+    async def _heartbeat(self, ws) -> None:
+        from realtime.message import ChannelEvents, PHOENIX_CHANNEL
+
+        while True:
+            await ws.send(
+                json.dumps(
+                    {
+                        "topic": PHOENIX_CHANNEL,
+                        "event": ChannelEvents.heartbeat,
+                        "payload": {},
+                        "ref": str(next(self._refs)),
+                    }
+                )
+            )
+            await asyncio.sleep(heartbeat_interval)
+
+    async def _receive(self, ws) -> None:
+        from realtime.message import ChannelEvents, PHOENIX_CHANNEL
+
+        async for message in ws:
+            message = json.loads(message)
+            event = message.get("event")
+            payload = message.get("payload") or {}
+
+            if event == ChannelEvents.reply and message.get("topic") != PHOENIX_CHANNEL:
+                if payload.get("status") != "ok":
+                    raise Exception(f"Cannot join the change feed: {payload}")
+                if not self.connected:
+                    logger.info("Change feed connected")
+                self.connected = True
+            elif event == ChannelEvents.error:
+                raise Exception(f"Change feed error: {payload}")
+            elif event == "postgres_changes" or event in (INSERT, UPDATE, DELETE):
+                # Newer servers nest the change in `data`
+                self._queue(payload.get("data", payload))
+
+    def _queue(self, data: dict) -> None:
+        table = data.get("table")
+        if table not in self.tables:
+            return
+
+        record = data.get("record") or None
+        old_record = data.get("old_record") or None
+        row = record or old_record or {}
+        pk = primary_keys[table]
+        change = {
+            "type": data.get("type") or data.get("eventType"),
+            "table": table,
+            "key": str(row.get(pk)),
+            "record": record,
+            "old_record": old_record,
+        }
+
+        # The last change of a row wins
+        self._pending[table, change["key"]] = change
+        self._schedule_flush()
+
+    def _queue_resync(self) -> None:
+        for table in self.tables:
+            self._pending[table, None] = {
+                "type": RESYNC,
+                "table": table,
+                "key": None,
+                "record": None,
+                "old_record": None,
+            }
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.window, self._flush
+            )
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        changes = {}
+        for change in self._pending.values():
+            changes.setdefault(change["table"], []).append(change)
+        self._pending = {}
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for callback, tables, owner in subscribers:
+            wanted = {t: c for t, c in changes.items() if tables is None or t in tables}
+            if not wanted:
+                continue
+
+            if owner is None:
+                try:
+                    callback(wanted)
+                except Exception as error:
+                    logger.exception("Change feed subscriber failed: %s", error)
+            else:
+                task_runner.post(self._deliver, callback, owner, wanted)
+
+    def _deliver(self, callback, owner, changes) -> None:
+        # Runs on the main thread, where the owner can be checked
+        if not owner.winfo_exists():
+            self.unsubscribe(callback)
+            return
+
+        callback(changes)
+
+
+def apply_to_caches(
+    changes: dict, cache: TTLCache = query_cache, index: StudentIndex = student_index
+) -> None:
+    """Update the caches and the student index with a batch of changes.
+
+    Args:
+        changes (dict): The changes of each table, as delivered by a
+            ChangeFeed.
+        cache (TTLCache) (optional): The cache to evict changed rows from.
+        index (StudentIndex) (optional): The index to update.
+    """
+    if changes.get("student_info"):
+        # Recipient lists embed the students' contact info
+        reset_synced_queries("student_info")
+
+    for change in changes.get("student_info", []):
+        if change["type"] == RESYNC:
+            cache.invalidate("student_info")
+            continue
+
+        cache.evict("student_info", ("get_student", change["key"]))
+        if not index.ready:
+            continue
+        if change["type"] == DELETE:
+            index.remove(change["key"])
+        elif change["record"] is not None:
+            index.add(change["record"])
+
+    # Grade and request lookups are keyed by query, not by row
+    for table in ("grades", "student_requests"):
+        if changes.get(table):
+            cache.invalidate(table)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_feed() -> ChangeFeed:
+    """Get the process-wide change feed, started on first use.
+
+    The feed keeps the query cache and the student index up to date. It is
+    not started when REALTIME_ENABLED is 0 or on the local backend,
+    subscribers then get no changes.
+    """
+    global _shared
+
+    with _shared_lock:
+        if _shared is None:
+            _shared = ChangeFeed()
+            _shared.subscribe(apply_to_caches)
+            if realtime_enabled and database_mode != "local":
+                _shared.start()
+        return _shared
+
+
+def shutdown() -> None:
+    """Stop the shared change feed."""
+    if _shared is not None:
+        _shared.stop()
@@ -101,6 +101,41 @@ valid_tables = [
     "courses",
 ]
 
+# Unique column of each table, the default order for keyset pagination
+primary_keys = {
+    "document_type": "id",
+    "grades": "grade_id",
+    "login": "employee_number",
+    "remarks": "id",
+    "request_statuses": "id",
+    "student_info": "student_id",
+    "student_requests": "id",
+    "subjects": "code",
+    "courses": "course_code",
+}
+
+# Columns fetched for each view, so a query only returns what is rendered
+projections = {
+    # StudentsTab, EditStudentWindow and the student index
+    "student": "student_id, first_name, middle_name, last_name, year_level, email,"
+    " contact_number, course_code",
+    # GradesTab and EditGradeWindow
+    "grade": "grade_id, student_id, grade, year, sem, remarks(remark),"
+    " subjects(code, title, units)",
+    # DocumentsTab and EditDocumentWindow
+    "document_request": "id, student_id, mode, request_amount, purpose, total,"
+    " receipt_no, payment_date, request_date, receive_date, document_type(type),"
+    " request_statuses(status)",
+    # IncompleteGradesTable, FailedGradesTable and the grade SMS campaigns
+    "grade_recipient": "grade_id, student_id, year, sem, updated_at,"
+    " student_info(first_name, middle_name, last_name, contact_number, course_code),"
+    " subjects(code, title)",
+    # RequestedDocumentsTable and the document SMS campaign
+    "document_recipient": "id, student_id, updated_at,"
+    " student_info(first_name, middle_name, last_name, contact_number),"
+    " document_type(type)",
+}
+
 remarks = {"incomplete_grade": 3, "failed_grade": 2, "passed_grade": 1}
 
 message_templates = {
@@ -1,73 +1,491 @@
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
 from .common import *
+from .cache import TTLCache
+from .search import StudentIndex, student_index
+from .sync import (
+    synced_query,
+    reset_synced_queries,
+    with_columns,
+    _is_missing_relation,
+)
+from .replica import Replica
+from .metrics import metrics, count_rows, count_response_bytes
 from datetime import datetime
+import functools
+import inspect
 import os
 import hashlib
+import threading
+import time
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 url = os.environ.get("SUPABASE_URL")
 key = os.environ.get("SUPABASE_API_KEY")
+# "remote" talks to Supabase directly, "replica" to the local offline replica,
+# "local" to a standalone SQLite database with no server at all
+database_mode = os.environ.get("DATABASE_MODE", "remote")
+
+
+class ClientPool:
+    """Process-wide pool of Supabase clients, one per URL/key pair.
+
+    Creating a client sets up auth and a fresh HTTP connection pool, so the
+    clients are created lazily on first use and shared by every Database
+    instance afterwards. This keeps keep-alive connections open between
+    operations.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[tuple[str, str], "Client"] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, key: str) -> "Client":
+        """Get the shared client for a URL/key pair, creating it if needed.
+
+        Args:
+            url (str): The Supabase project URL.
+            key (str): The Supabase API key.
+
+        Returns:
+            Client: The shared client.
+        """
+        with self._lock:
+            client = self._clients.get((url, key))
+            if client is None:
+                # supabase and httpx take a while to import, so not on startup
+                from supabase import create_client
+
+                client = create_client(url, key)
+                # The PostgREST client is built lazily by supabase, build it
+                # here under the lock so threads never race to create it.
+                client.postgrest
+                client.postgrest.session.event_hooks["response"].append(
+                    count_response_bytes
+                )
+                self._clients[(url, key)] = client
+            return client
+
+    def close(self) -> None:
+        """Close the HTTP connections of every pooled client."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+
+        for client in clients:
+            client.postgrest.session.close()
+
+
+client_pool = ClientPool()
+
+
+def connect(url: str = url, key: str = key, mode: str = database_mode):
+    """Get the client of a database backend.
+
+    Every backend answers the query builder API of the Supabase client, so
+    the Database works the same on top of any of them.
+
+    Args:
+        url (str) (optional): The Supabase project URL.
+        key (str) (optional): The Supabase API key.
+        mode (str) (optional): "remote", "replica" or "local".
+
+    Returns:
+        The shared client of the backend.
+    """
+    if mode == "remote":
+        return client_pool.get(url, key)
+    elif mode == "replica":
+        from .replica import shared_replica
+
+        return shared_replica()
+    elif mode == "local":
+        from .local_backend import shared_local_backend
+
+        return shared_local_backend()
+    else:
+        raise Exception(
+            f"Invalid database mode: {mode}. Valid modes are: remote, replica, local"
+        )
+
+
+# Shared read-through cache for lookups that rarely change
+query_cache = TTLCache(
+    ttl=float(os.environ.get("DB_CACHE_TTL", 60)),
+    maxsize=int(os.environ.get("DB_CACHE_SIZE", 1024)),
+)
+cached_tables = ["courses", "subjects", "document_type", "remarks", "request_statuses"]
+_missing = object()
+# Views of migrations/ the server turned out not to have, asked for once
+_missing_views = set()
+
+
+def group_grade_recipients(grades: list) -> list:
+    """Group grades by student, into the rows of the grade_recipients view.
+
+    Args:
+        grades (list): Grades with the columns of the "grade_recipient"
+            projection and `remark_id`.
+
+    Returns:
+        list: One dict per student and remark, ordered by student ID, see
+            `Database.get_grade_recipients`.
+    """
+    recipients = {}
+    for grade in sorted(grades, key=lambda grade: grade["grade_id"]):
+        # Inner joins in the view
+        if grade["student_info"] is None or grade["subjects"] is None:
+            continue
+
+        group = (grade["student_id"], grade["remark_id"])
+        recipient = recipients.get(group)
+        if recipient is None:
+            student = grade["student_info"]
+            recipient = recipients[group] = {
+                "student_id": grade["student_id"],
+                "remark_id": grade["remark_id"],
+                "first_name": student["first_name"],
+                "middle_name": student["middle_name"],
+                "last_name": student["last_name"],
+                "contact_number": student["contact_number"],
+                "course_code": student["course_code"],
+                "updated_at": grade["updated_at"],
+                "grades": [],
+            }
+
+        recipient["updated_at"] = max(recipient["updated_at"], grade["updated_at"])
+        recipient["grades"].append(
+            {
+                "grade_id": grade["grade_id"],
+                "code": grade["subjects"]["code"],
+                "title": grade["subjects"]["title"],
+                "year": grade["year"],
+                "sem": grade["sem"],
+                "updated_at": grade["updated_at"],
+            }
+        )
+
+    return [recipients[group] for group in sorted(recipients)]
+
+
+class Gather:
+    """Steps of an operation that do not depend on each other.
+
+    The async executor runs them at the same time, the sync one in order.
+    The operation receives the list of their results.
+    """
+
+    def __init__(self, steps) -> None:
+        self.steps = list(steps)
+
+
+class Collect:
+    """Runs the steps of a streamed operation, e.g. `iter_all`.
+
+    The operation receives the list of its pages.
+    """
+
+    def __init__(self, steps) -> None:
+        self.steps = steps
+
+
+class Page:
+    """A page a streamed operation hands to its caller."""
+
+    def __init__(self, rows: list) -> None:
+        self.rows = rows
+
+
+class operation:
+    """Decorate a Database method written as the steps of an operation.
+
+    The method is a generator. It builds its queries, yields them and
+    receives their rows, and does the cache and index bookkeeping, while
+    the Database's executor runs the queries. So `Database` and
+    `AsyncDatabase` share every method: the first blocks and returns the
+    result, the second returns a coroutine.
+
+    Steps an operation can yield:
+        - A query: receives its rows.
+        - Another operation's steps, e.g. `self.get_all.steps(table)`:
+          receives its result.
+        - `Gather(steps)`: receives the list of their results.
+        - `Collect(steps)`: receives the pages of a streamed operation.
+        - `Page(rows)`: hands a page to the caller of a streamed operation.
+
+    An exception raised by a step is raised inside the generator, where it
+    can be caught.
+    """
+
+    streamed = False
+
+    def __init__(self, steps) -> None:
+        functools.update_wrapper(self, steps)
+        self._steps = steps
+
+    def __get__(self, database, owner=None):
+        if database is None:
+            return self
+        return BoundOperation(self, database)
+
+
+class streamed_operation(operation):
+    """An operation handing its results to the caller page by page."""
+
+    streamed = True
+
+
+class BoundOperation:
+    """An operation of a Database instance."""
+
+    def __init__(self, operation: operation, database: "Database") -> None:
+        self.operation = operation
+        self.database = database
+        self.__doc__ = operation.__doc__
+
+    def __call__(self, *args, **kwargs):
+        executor = self.database.executor
+        name = f"{type(self.database).__name__}.{self.operation.__name__}"
+        steps = self.steps(*args, **kwargs)
+        if self.operation.streamed:
+            return executor.stream(name, steps)
+        return executor.run(name, steps)
+
+    def steps(self, *args, **kwargs):
+        """Get the steps of the operation, to yield from another operation."""
+        return self.operation._steps(self.database, *args, **kwargs)
+
+
+class Executor:
+    """Runs the steps of Database operations, blocking until they are done.
+
+    Every operation is recorded in the metrics, with its rows and bytes.
+    """
+
+    synchronous = True
+
+    def run(self, name: str, steps):
+        with metrics.span(name) as span:
+            result = self._result(self._drive(steps))
+            span["rows"] = count_rows(result)
+        return result
+
+    def stream(self, name: str, steps):
+        # Timed while fetching pages, not while the caller holds them
+        start = time.perf_counter()
+        busy = 0.0
+        rows = 0
+        received = 0
+        pages = self._drive(steps)
+        while True:
+            resumed = time.perf_counter()
+            before = metrics.received()
+            try:
+                page = next(pages)
+            except StopIteration:
+                break
+            finally:
+                busy += time.perf_counter() - resumed
+                received += metrics.received() - before
+            rows += len(page)
+            yield page
+        metrics.record(name, start, busy, rows, received)
+
+    def _drive(self, steps):
+        # Yields the pages the operation hands over, returns its result
+        value = error = None
+        while True:
+            try:
+                step = steps.send(value) if error is None else steps.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            value = error = None
+
+            if isinstance(step, Page):
+                yield step.rows
+                continue
+            try:
+                value = self._resolve(step)
+            except Exception as exception:
+                error = exception
+
+    def _resolve(self, step):
+        if isinstance(step, Gather):
+            return [self._resolve(inner) for inner in step.steps]
+        if isinstance(step, Collect):
+            return list(self._drive(step.steps))
+        if inspect.isgenerator(step):
+            return self._result(self._drive(step))
+        return step.execute().data
+
+    @staticmethod
+    def _result(drive):
+        try:
+            while True:
+                next(drive)
+        except StopIteration as stop:
+            return stop.value
 
 
 class Database:
-    def __init__(self, url: str = url, key: str = key) -> None:
+    """The registrar's queries, on the client of any backend.
+
+    Every method that talks to the database is an `operation`, run by
+    `executor`.
+    """
+
+    executor = Executor()
+
+    def __init__(
+        self,
+        url: str = url,
+        key: str = key,
+        cache: TTLCache = query_cache,
+        index: StudentIndex = student_index,
+        backend=None,
+    ) -> None:
         self.url = url
         self.key = key
-        self.client: Client = create_client(url, key)
+        self.client: "Client" = backend if backend is not None else connect(url, key)
+        self.cache = cache
+        self.index = index
 
+    @operation
     def get_document_types(self) -> list:
         """Get all document types from the database.
 
         Returns:
             list: A list of document types.
         """
-        return self.client.table("document_type").select("*").execute().data
+        return (yield self.get_all.steps("document_type"))
+
+    @operation
+    def search_students(self, query: str, limit: int = None) -> list:
+        """Search the students by ID, name or email prefix.
+
+        Served from the in-memory student index, which is built from the
+        roster the first time it is needed.
+
+        Args:
+            query (str): The words to look for.
+            limit (int) (optional): The maximum number of students returned.
+
+        Returns:
+            list: The matching students, ordered by student ID.
+        """
+        if not self.index.ready:
+            yield self.get_all.steps("student_info")
 
-    def get_student(self, student_id: str) -> Student:
+        return self.index.search(query, limit)
+
+    @operation
+    def get_student(
+        self, student_id: str, columns: str = projections["student"]
+    ) -> Student:
         """Get a student's data from the database.
 
         Args:
             student_id (str): The student's ID.
+            columns (str) (optional): The columns to fetch.
 
         Returns:
             Student: The student's data.
         """
-        student = (
+        # Only the default projection is cached, writes evict it by student ID
+        cache_key = ("get_student", str(student_id))
+        cached = _missing
+        if columns == projections["student"]:
+            cached = self.cache.get("student_info", cache_key, _missing)
+        if cached is not _missing:
+            return cached
+
+        student = yield (
             self.client.table("student_info")
-            .select("*")
+            .select(columns)
             .eq("student_id", student_id)
-            .execute()
-            .data
         )
 
-        if student:
-            return student[0]
-        else:
-            return None
+        student = student[0] if student else None
+        # Misses are not cached, the student may be added any time
+        if student is not None and columns == projections["student"]:
+            self.cache.set("student_info", cache_key, student)
+        return student
 
-    def get_student_grade(self, student_id: str, year: int, sem: int) -> Student:
+    @operation
+    def get_student_grade(
+        self, student_id: str, year: int, sem: int, columns: str = projections["grade"]
+    ) -> Student:
         """Get a student's data from the database.
 
         Args:
             student_id (str): The student's ID.
+            columns (str) (optional): The columns to fetch.
 
         Returns:
             Student: The student's data.
         """
-        student = (
+        cache_key = ("get_student_grade", str(student_id), str(year), str(sem), columns)
+        cached = self.cache.get("grades", cache_key, _missing)
+        if cached is not _missing:
+            return cached
+
+        student = yield (
             self.client.table("grades")
-            .select("remarks(remark), subjects(*), *")
+            .select(columns)
             .eq("student_id", student_id)
             .eq("year", year)
             .eq("sem", sem)
-            .execute()
-            .data
         )
 
-        if student:
-            return student
-        else:
-            return None
+        student = student if student else None
+        if student is not None:
+            self.cache.set("grades", cache_key, student)
+        return student
+
+    @operation
+    def get_student_with_grades(self, student_id: str, year: int, sem: int) -> tuple:
+        """Get a student and their grades for a semester.
+
+        The async executor runs both queries at the same time.
 
+        Args:
+            student_id (str): The student's ID.
+            year (int): The school year.
+            sem (int): The semester.
+
+        Returns:
+            tuple: The student's data and their grades.
+        """
+        return tuple(
+            (
+                yield Gather(
+                    [
+                        self.get_student.steps(student_id),
+                        self.get_student_grade.steps(student_id, year, sem),
+                    ]
+                )
+            )
+        )
+
+    @operation
+    def get_grade(self, grade_id: int, columns: str = projections["grade"]) -> Grade:
+        """Get a single grade's data from the database.
+
+        Args:
+            grade_id (int): The grade's ID.
+            columns (str) (optional): The columns to fetch.
+
+        Returns:
+            Grade: The grade's data, None if it does not exist.
+        """
+        grade = yield (
+            self.client.table("grades").select(columns).eq("grade_id", grade_id)
+        )
+
+        return grade[0] if grade else None
+
+    @operation
     def delete_student(self, student_id: str) -> None:
         """Delete a student's data from the database.
 
@@ -77,10 +495,13 @@ class Database:
         Returns:
             None
         """
-        self.client.table("student_info").delete().eq(
-            "student_id", student_id
-        ).execute()
+        yield self.client.table("student_info").delete().eq("student_id", student_id)
+        self.cache.evict("student_info", ("get_student", str(student_id)))
+        self.cache.invalidate("grades")
+        reset_synced_queries("student_info")
+        self.index.remove(student_id)
 
+    @operation
     def update_student(self, student_id: str, data: Student) -> Student:
         """Update a student's data in the database.
 
@@ -91,10 +512,14 @@ class Database:
         Returns:
             Student: The student's updated data.
         """
-        self.client.table("student_info").update(data).eq(
+        yield self.client.table("student_info").update(data).eq(
             "student_id", student_id
-        ).execute()
+        )
+        self.cache.evict("student_info", ("get_student", str(student_id)))
+        reset_synced_queries("student_info")
+        self.index.update(student_id, data)
 
+    @operation
     def insert_student(self, data: Student) -> Student:
         """Insert a student's data into the database.
 
@@ -104,32 +529,128 @@ class Database:
         Returns:
             Student: The student's inserted data.
         """
-        self.client.table("student_info").insert(data).execute()
+        rows = yield self.client.table("student_info").insert(data)
+        self.cache.evict("student_info", ("get_student", str(data["student_id"])))
+        self.index.add(rows[0] if rows else data)
+
+    @operation
+    def get_existing_student_ids(self, student_ids: list, chunk_size: int = 500) -> set:
+        """Find which of the given student IDs already exist in the database.
+
+        The async executor looks the chunks up at the same time.
+
+        Args:
+            student_ids (list): The student IDs to look up.
+            chunk_size (int) (optional): The number of IDs per request.
+
+        Returns:
+            set: The student IDs that already exist.
+        """
+        student_ids = list(student_ids)
+        pages = yield Gather(
+            self.client.table("student_info")
+            .select("student_id")
+            .in_("student_id", student_ids[start : start + chunk_size])
+            for start in range(0, len(student_ids), chunk_size)
+        )
+
+        return {str(row["student_id"]) for rows in pages for row in rows}
+
+    @operation
+    def insert_students(self, students: list, batch_size: int = 500) -> int:
+        """Insert many students using multi-row inserts.
+
+        Students whose ID already exists are ignored by the database instead of
+        failing the whole batch. The async executor sends the batches at the
+        same time.
+
+        Args:
+            students (list): The students' data to insert.
+            batch_size (int) (optional): The number of rows per request.
+
+        Returns:
+            int: The number of students inserted.
+        """
+        inserted = yield Gather(
+            self._insert_batch(students[start : start + batch_size])
+            for start in range(0, len(students), batch_size)
+        )
+
+        return sum(inserted)
+
+    def _insert_batch(self, batch):
+        rows = yield self.client.table("student_info").upsert(
+            batch, on_conflict="student_id", ignore_duplicates=True
+        )
+
+        for student in batch:
+            cache_key = ("get_student", str(student["student_id"]))
+            self.cache.evict("student_info", cache_key)
 
-    def get_all_grade_not_messaged_yet(self, remark=None):
+        # Only the inserted rows are returned, duplicates are skipped
+        for student in rows:
+            self.index.add(student)
+
+        return len(rows)
+
+    @operation
+    def get_all_grade_not_messaged_yet(
+        self, remark=None, columns: str = projections["grade_recipient"]
+    ):
         """Get all grades info from the database.
 
         Args:
             status (int) (optional): The remark's ID. 1 for passed, 2 for failed, 3 for incomplete.
+            columns (str) (optional): The columns to fetch.
 
         Returns:
             Grades: The grades' data.
         """
 
-        select_stmt = "student_info(*), remarks(remark), subjects(*), *"
-
         if remark:
             return (
-                self.client.table("grades")
-                .select(select_stmt)
-                .eq("remark_id", remarks[remark])
-                .eq("messaged", False)
-                .execute()
-                .data
+                yield self._synced(
+                    "grades", columns, remark_id=remarks[remark], messaged=False
+                )
             )
         else:
-            return self.client.table("grades").select(select_stmt).execute().data
+            return (yield self.client.table("grades").select(columns))
+
+    @operation
+    def get_grade_recipients(self, remark: str, page_size: int = 1000) -> list:
+        """Get the students with grades not messaged yet, one row per student.
+
+        The grades are grouped on the server by the grade_recipients view
+        (see migrations/003_grade_recipients.sql), so each student's contact
+        info is sent once instead of with every grade. Without the view, the
+        grades are fetched and grouped here.
+
+        Args:
+            remark (str): "incomplete_grade" or "failed_grade".
+            page_size (int) (optional): The number of students per request.
+
+        Returns:
+            list: One dict per student, ordered by student ID, with
+                `student_id`, `remark_id`, `first_name`, `middle_name`,
+                `last_name`, `contact_number`, `course_code`, `updated_at` (of
+                their latest grade) and `grades`, the dicts of their grades
+                with `grade_id`, `code`, `title`, `year`, `sem` and
+                `updated_at`.
+        """
+        if "grade_recipients" not in _missing_views:
+            try:
+                return (yield self._grade_recipients(remarks[remark], page_size))
+            except Exception as error:
+                if not _is_missing_relation(error):
+                    raise
+                _missing_views.add("grade_recipients")
+
+        columns = with_columns(projections["grade_recipient"], ["remark_id"])
+        return group_grade_recipients(
+            (yield self.get_all_grade_not_messaged_yet.steps(remark, columns))
+        )
 
+    @operation
     def delete_grade(self, grade_id: int) -> None:
         """Delete a grade's data from the database.
 
@@ -139,8 +660,10 @@ class Database:
         Returns:
             None
         """
-        self.client.table("grades").delete().eq("grade_id", grade_id).execute()
+        yield self.client.table("grades").delete().eq("grade_id", grade_id)
+        self.cache.invalidate("grades")
 
+    @operation
     def update_grade(self, grade_id: int, data: Grade) -> Grade:
         now = datetime.now().timestamp()
         """Update a grade's data in the database.
@@ -153,8 +676,10 @@ class Database:
             Grade: The grade's updated data.
         """
         data["updated_at"] = str(datetime.fromtimestamp(now))
-        self.client.table("grades").update(data).eq("grade_id", grade_id).execute()
+        yield self.client.table("grades").update(data).eq("grade_id", grade_id)
+        self.cache.invalidate("grades")
 
+    @operation
     def insert_grade(self, data: Grade) -> Grade:
         """Insert a grade's data into the database.
 
@@ -164,8 +689,10 @@ class Database:
         Returns:
             Grade: The grade's inserted data.
         """
-        self.client.table("grades").insert(data).execute()
+        yield self.client.table("grades").insert(data)
+        self.cache.invalidate("grades")
 
+    @operation
     def get_login_info(self, employee_number: str) -> LoginInfo:
         """Get a login's data from the database.
 
@@ -175,14 +702,14 @@ class Database:
         Returns:
             LoginInfo: The login's data.
         """
-        return (
+        login = yield (
             self.client.table("login")
             .select("*")
             .eq("employee_number", employee_number)
-            .execute()
-            .data[0]
         )
+        return login[0]
 
+    @operation
     def delete_login_info(self, employee_number: str) -> None:
         """Delete a login's data from the database.
 
@@ -192,10 +719,9 @@ class Database:
         Returns:
             None
         """
-        self.client.table("login").delete().eq(
-            "employee_number", employee_number
-        ).execute()
+        yield self.client.table("login").delete().eq("employee_number", employee_number)
 
+    @operation
     def update_login_info(self, employee_number: str, data: LoginInfo) -> LoginInfo:
         """Update a login's data in the database.
 
@@ -206,10 +732,11 @@ class Database:
         Returns:
             LoginInfo: The login's updated data.
         """
-        self.client.table("login").update(data).eq(
+        yield self.client.table("login").update(data).eq(
             "employee_number", employee_number
-        ).execute()
+        )
 
+    @operation
     def insert_login_info(self, data: LoginInfo) -> LoginInfo:
         """Insert a login's data into the database.
 
@@ -219,32 +746,37 @@ class Database:
         Returns:
             LoginInfo: The login's inserted data.
         """
-        self.client.table("login").insert(data).execute()
+        yield self.client.table("login").insert(data)
 
-    def get_document_request(self, id: int) -> StudentRequest:
+    @operation
+    def get_document_request(
+        self, id: int, columns: str = projections["document_request"]
+    ) -> StudentRequest:
         """Get a student request's data from the database.
 
         Args:
             id (int): The student request's ID.
+            columns (str) (optional): The columns to fetch.
 
         Returns:
-            StudentRequest: The student request's data.
+            StudentRequest: The student request's data, None if it does not
+                exist.
         """
-        select_stmt = "document_type(type), request_statuses(status), *"
-
-        return (
-            self.client.table("student_requests")
-            .select(select_stmt)
-            .eq("id", id)
-            .execute()
-            .data[0]
+        document = yield (
+            self.client.table("student_requests").select(columns).eq("id", id)
         )
 
-    def get_document_requests_by_status(self, status: str) -> StudentRequest:
+        return document[0] if document else None
+
+    @operation
+    def get_document_requests_by_status(
+        self, status: str, columns: str = projections["document_request"]
+    ) -> StudentRequest:
         """Get all student request's data from the database.
 
         Args:
             status (str): The student request's status.
+            columns (str) (optional): The columns to fetch.
 
         Returns:
             StudentRequest: The student request's data.
@@ -258,16 +790,16 @@ class Database:
         assert (
             status in student_request_status
         ), f"Invalid status: {status}. Valid statuses are: {student_request_status}"
-        select_stmt = "document_type(type), request_statuses(status), *"
 
         return (
-            self.client.table("student_requests")
-            .select(select_stmt)
-            .eq("student_request_status_id", student_request_status[status])
-            .execute()
-            .data
+            yield self._synced(
+                "student_requests",
+                columns,
+                student_request_status_id=student_request_status[status],
+            )
         )
 
+    @operation
     def delete_document_request(self, id: int) -> None:
         """Delete a student request's data from the database.
 
@@ -277,8 +809,10 @@ class Database:
         Returns:
             None
         """
-        self.client.table("student_requests").delete().eq("id", id).execute()
+        yield self.client.table("student_requests").delete().eq("id", id)
+        self.cache.invalidate("student_requests")
 
+    @operation
     def update_document_request(self, id: int, data: StudentRequest) -> StudentRequest:
         now = datetime.now().timestamp()
         """Update a student request's data in the database.
@@ -291,8 +825,10 @@ class Database:
             StudentRequest: The student request's updated data.
         """
         data["updated_at"] = str(datetime.fromtimestamp(now))
-        self.client.table("student_requests").update(data).eq("id", id).execute()
+        yield self.client.table("student_requests").update(data).eq("id", id)
+        self.cache.invalidate("student_requests")
 
+    @operation
     def insert_document_request(self, data: StudentRequest) -> StudentRequest:
         """Insert a student request's data into the database.
 
@@ -302,8 +838,10 @@ class Database:
         Returns:
             StudentRequest: The student request's inserted data.
         """
-        self.client.table("student_requests").insert(data).execute()
+        yield self.client.table("student_requests").insert(data)
+        self.cache.invalidate("student_requests")
 
+    @operation
     def get_all(self, table: str) -> list:
         """Get all data from a table.
 
@@ -315,8 +853,79 @@ class Database:
         """
         if table not in valid_tables:
             raise Exception(f"Invalid table: {table}. Valid tables are: {valid_tables}")
-        return self.client.table(table).select("*").execute().data
 
+        if table not in cached_tables:
+            pages = yield Collect(self.iter_all.steps(table))
+            return [row for page in pages for row in page]
+
+        cached = self.cache.get(table, ("get_all",), _missing)
+        if cached is not _missing:
+            return cached
+
+        pages = yield Collect(self.iter_all.steps(table))
+        data = [row for page in pages for row in page]
+        self.cache.set(table, ("get_all",), data)
+        return data
+
+    @streamed_operation
+    def iter_all(
+        self,
+        table: str,
+        page_size: int = 1000,
+        order_by: str = None,
+        columns: str = "*",
+    ):
+        """Get all data from a table, one page at a time.
+
+        Uses keyset pagination: each page asks for the rows after the last
+        key of the previous one, so every request is an index range scan no
+        matter how deep into the table it is. Keep `page_size` at or below
+        the server's row limit (1000 by default), a capped page looks like
+        the last one.
+
+        Args:
+            table (str): The table to get data from.
+            page_size (int) (optional): The number of rows per request.
+            order_by (str) (optional): A unique column to page by. Defaults to
+                the table's primary key.
+            columns (str) (optional): The columns to fetch, must include
+                `order_by`.
+
+        Yields:
+            list: The rows of each page, in `order_by` order.
+        """
+        if table not in valid_tables:
+            raise Exception(f"Invalid table: {table}. Valid tables are: {valid_tables}")
+
+        order_by = order_by or primary_keys[table]
+        last = None
+        # A complete pass over the roster refreshes the search index
+        roster = [] if table == "student_info" else None
+
+        while True:
+            query = (
+                self.client.table(table)
+                .select(columns)
+                .order(order_by)
+                .limit(page_size)
+            )
+            if last is not None:
+                query = query.gt(order_by, last)
+
+            page = yield query
+            if page:
+                yield Page(page)
+                if roster is not None:
+                    roster += page
+                last = page[-1][order_by]
+
+            if len(page) < page_size:
+                break
+
+        if roster is not None:
+            self.index.build(roster)
+
+    @operation
     def verify_login(self, employee_number: str, password: str) -> bool:
         """Verify the login credentials against the database.
 
@@ -331,31 +940,130 @@ class Database:
         md5_password = hashlib.md5(password.encode()).hexdigest()
 
         return (
-            self.client.table("login")
+            yield self.client.table("login")
             .select("*")
             .eq("employee_number", employee_number)
             .eq("hash", md5_password)
-            .execute()
-            .data
         )
 
-    def get_all_document_requests_not_messaged_yet(self):
+    @operation
+    def get_all_document_requests_not_messaged_yet(
+        self, columns: str = projections["document_recipient"]
+    ):
         """Get all document requests info that are ready to claim from the database.
 
+        Args:
+            columns (str) (optional): The columns to fetch.
+
         Returns:
             Document requests: The requests' data.
         """
 
-        select_stmt = "student_info(*), document_type(*), *"
-
         return (
-            self.client.table("student_requests")
-            .select(select_stmt)
-            .eq("student_request_status_id", 2)
-            .eq("messaged", False)
-            .execute()
-            .data
+            yield self._synced(
+                "student_requests", columns, student_request_status_id=2, messaged=False
+            )
+        )
+
+    @operation
+    def mark_grades_messaged(self, grade_ids: list, chunk_size: int = 200) -> list:
+        """Mark many grades as messaged, one request per chunk.
+
+        Args:
+            grade_ids (list): The grades' IDs.
+            chunk_size (int) (optional): The number of IDs per request.
+
+        Returns:
+            list: One report per chunk, a dict with `ids`, `success` and
+                `error`.
+        """
+        return (yield self._mark_messaged("grades", "grade_id", grade_ids, chunk_size))
+
+    @operation
+    def mark_document_requests_messaged(self, ids: list, chunk_size: int = 200) -> list:
+        """Mark many student requests as messaged, one request per chunk.
+
+        Args:
+            ids (list): The student requests' IDs.
+            chunk_size (int) (optional): The number of IDs per request.
+
+        Returns:
+            list: One report per chunk, a dict with `ids`, `success` and
+                `error`.
+        """
+        return (yield self._mark_messaged("student_requests", "id", ids, chunk_size))
+
+    @operation
+    def set_messaged(self, table: str, ids: list) -> list:
+        """Mark many grades or student requests as messaged.
+
+        Args:
+            table (str): Either "grades" or "student_requests".
+            ids (list): The rows' IDs.
+
+        Returns:
+            list: One report per chunk, a dict with `ids`, `success` and
+                `error`.
+        """
+        if table == "grades":
+            return (yield self.mark_grades_messaged.steps(ids))
+        elif table == "student_requests":
+            return (yield self.mark_document_requests_messaged.steps(ids))
+        else:
+            raise Exception(
+                f"Invalid table: {table}. Expected grades or student_requests"
+            )
+
+    def _mark_messaged(self, table, key_column, ids, chunk_size):
+        now = datetime.now().timestamp()
+        data = {"messaged": True, "updated_at": str(datetime.fromtimestamp(now))}
+        ids = list(dict.fromkeys(ids))
+        reports = yield Gather(
+            self._mark_chunk(table, key_column, ids[start : start + chunk_size], data)
+            for start in range(0, len(ids), chunk_size)
         )
 
-    def get_client(self) -> Client:
+        self.cache.invalidate(table)
+        return reports
+
+    def _mark_chunk(self, table, key_column, chunk, data):
+        try:
+            yield self.client.table(table).update(data).in_(key_column, chunk)
+            return {"ids": chunk, "success": True, "error": None}
+        except Exception as error:
+            return {"ids": chunk, "success": False, "error": str(error)}
+
+    def _grade_recipients(self, remark_id: int, page_size: int) -> list:
+        recipients = []
+        last = None
+
+        while True:
+            query = (
+                self.client.table("grade_recipients")
+                .select("*")
+                .eq("remark_id", remark_id)
+                .order("student_id")
+                .limit(page_size)
+            )
+            if last is not None:
+                query = query.gt("student_id", last)
+
+            page = yield query
+            recipients += page
+            if len(page) < page_size:
+                return recipients
+            last = page[-1]["student_id"]
+
+    def _synced(self, table: str, columns: str, **filters) -> list:
+        # Refreshed with deltas, which block, so local backends and the async
+        # executor query directly
+        if self.executor.synchronous and not isinstance(self.client, Replica):
+            return synced_query(self.client, table, columns, **filters).refresh()
+
+        query = self.client.table(table).select(columns)
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        return (yield query)
+
+    def get_client(self) -> "Client":
         return self.client
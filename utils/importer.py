@@ -0,0 +1,153 @@
+import time
+
+required_columns = [
+    "student_id",
+    "first_name",
+    "last_name",
+    "year_level",
+    "email",
+    "contact_number",
+    "course_code",
+]
+optional_columns = ["middle_name"]
+
+
+class ImportReport:
+    """Outcome of a bulk student import.
+
+    Attributes:
+        total (int): The number of rows in the file.
+        inserted (int): The number of students inserted.
+        skipped (int): The number of students that already existed.
+        rejected (dict): Maps a rejection reason to the Excel row numbers
+            rejected for it.
+        elapsed (float): The time the import took, in seconds.
+    """
+
+    def __init__(self, total: int) -> None:
+        self.total = total
+        self.inserted = 0
+        self.skipped = 0
+        self.rejected = {}
+        self.elapsed = 0.0
+
+    @property
+    def rejected_count(self) -> int:
+        return sum(len(rows) for rows in self.rejected.values())
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def reject(self, reason: str, rows: list) -> None:
+        if rows:
+            self.rejected.setdefault(reason, []).extend(rows)
+
+    def summary(self) -> str:
+        """Build a human readable summary of the import."""
+        lines = [
+            f"{self.inserted} student(s) imported.",
+            f"{self.skipped} student(s) skipped because they already exist.",
+        ]
+
+        for reason, rows in self.rejected.items():
+            shown = ", ".join(str(row) for row in rows[:10])
+            more = f" and {len(rows) - 10} more" if len(rows) > 10 else ""
+            lines.append(f"{len(rows)} row(s) rejected ({reason}): rows {shown}{more}")
+
+        lines.append(
+            f"Processed {self.total} row(s) in {self.elapsed:.2f}s "
+            f"({self.rows_per_second:.0f} rows/s)."
+        )
+        return "\n".join(lines)
+
+
+def _as_text(series):
+    """Convert a column to stripped strings, keeping integers without '.0'."""
+    import pandas as pd
+
+    if pd.api.types.is_float_dtype(series):
+        try:
+            series = series.astype("Int64")
+        except TypeError:
+            pass
+
+    return series.astype("string").str.strip()
+
+
+def import_students(df, db, batch_size: int = 500, lookup_chunk_size: int = 500):
+    """Validate and insert a roster of students in bulk.
+
+    The rows are validated column by column, existing students are looked up
+    with a few chunked `in` queries, and new students are inserted with
+    multi-row requests, so the number of round trips grows with the number of
+    batches instead of the number of rows.
+
+    Args:
+        df (DataFrame): The roster, one student per row.
+        db (Database): The database to import into.
+        batch_size (int) (optional): The number of rows per insert request.
+        lookup_chunk_size (int) (optional): The number of IDs per lookup request.
+
+    Returns:
+        ImportReport: The number of rows inserted, skipped and rejected.
+    """
+    import pandas as pd
+
+    start = time.perf_counter()
+    report = ImportReport(len(df))
+
+    df = df.copy()
+    # Excel row numbers, counting the header row
+    df["_row"] = df.index + 2
+
+    for column in required_columns + optional_columns:
+        if column in df.columns:
+            df[column] = _as_text(df[column])
+
+    if "middle_name" not in df.columns:
+        df["middle_name"] = ""
+    df["middle_name"] = df["middle_name"].fillna("")
+
+    missing = df[required_columns].isna().any(axis=1) | (
+        df[required_columns] == ""
+    ).any(axis=1)
+    report.reject("missing fields", df.loc[missing, "_row"].tolist())
+    df = df[~missing]
+
+    year_level = pd.to_numeric(df["year_level"], errors="coerce")
+    invalid = (
+        ~df["student_id"].str.fullmatch(r"\d+")
+        | year_level.isna()
+        | ~df["contact_number"].str.fullmatch(r"\+?\d+")
+    )
+    report.reject(
+        "invalid student no., year level or contact number",
+        df.loc[invalid, "_row"].tolist(),
+    )
+    df = df[~invalid]
+
+    duplicated = df["student_id"].duplicated(keep="first")
+    report.reject("duplicate student no. in file", df.loc[duplicated, "_row"].tolist())
+    df = df[~duplicated]
+
+    existing = db.get_existing_student_ids(df["student_id"].tolist(), lookup_chunk_size)
+    exists = df["student_id"].isin(existing)
+    report.skipped = int(exists.sum())
+    df = df[~exists]
+
+    df["year_level"] = pd.to_numeric(df["year_level"]).astype(int)
+    students = df[required_columns + optional_columns].to_dict("records")
+    for student in students:
+        for column, value in student.items():
+            if not isinstance(value, (int, str)):
+                student[column] = None if pd.isna(value) else str(value)
+
+    inserted = db.insert_students(students, batch_size)
+    report.inserted = inserted
+    # Rows that disappeared between the lookup and the insert were added by
+    # someone else in the meantime
+    report.skipped += len(students) - inserted
+
+    report.elapsed = time.perf_counter() - start
+    return report
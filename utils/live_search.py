@@ -0,0 +1,132 @@
+from .metrics import metrics
+from collections import deque
+import logging
+import os
+import time
+
+debounce_delay = int(os.environ.get("SEARCH_DEBOUNCE_MS", 150))
+latency_budget = float(os.environ.get("SEARCH_LATENCY_BUDGET_MS", 50)) / 1000
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Keeps the most recent search latencies and summarizes them.
+
+    Searches are also recorded in the metrics as `search.<label>`, so the
+    diagnostics panel shows them.
+
+    Attributes:
+        budget (float): The latency in seconds a search should stay under.
+        samples (deque): The latest (label, seconds) measurements.
+    """
+
+    def __init__(self, budget: float = latency_budget, size: int = 500) -> None:
+        self.budget = budget
+        self.samples = deque(maxlen=size)
+
+    def record(self, label: str, seconds: float) -> None:
+        self.samples.append((label, seconds))
+        metrics.record(f"search.{label}", time.perf_counter() - seconds, seconds)
+        if seconds > self.budget:
+            logger.debug(
+                "Slow search in %s: %.1f ms (budget %.0f ms)",
+                label,
+                seconds * 1000,
+                self.budget * 1000,
+            )
+
+    def stats(self, label: str = None) -> dict:
+        """Summarize the recorded latencies.
+
+        Args:
+            label (str) (optional): Only include the searches of this tab.
+
+        Returns:
+            dict: `count`, `p50`, `p95` and `max` in milliseconds, and
+                `over_budget`, the number of searches slower than the budget.
+        """
+        values = sorted(
+            seconds for name, seconds in self.samples if label in (None, name)
+        )
+        if not values:
+            return {"count": 0, "p50": 0, "p95": 0, "max": 0, "over_budget": 0}
+
+        def percentile(p):
+            return values[min(len(values) - 1, int(p * len(values)))] * 1000
+
+        return {
+            "count": len(values),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": values[-1] * 1000,
+            "over_budget": sum(1 for seconds in values if seconds > self.budget),
+        }
+
+
+search_latency = LatencyTracker()
+
+
+class LiveSearch:
+    """Runs a search as the user types in an entry.
+
+    Keystrokes restart a short timer and the search only runs once typing
+    pauses, with the entry's text at that moment. The time from the search
+    starting until Tk is idle again, table repaint included, is recorded in
+    the latency tracker.
+
+    Attributes:
+        entry: The entry widget to watch.
+        on_search (callable): Called with the entry's text.
+        label (str): The name latencies are recorded under.
+        delay (int): Milliseconds to wait after the last keystroke.
+    """
+
+    def __init__(
+        self,
+        entry,
+        on_search,
+        label: str,
+        delay: int = debounce_delay,
+        tracker: LatencyTracker = search_latency,
+    ) -> None:
+        self.entry = entry
+        self.on_search = on_search
+        self.label = label
+        self.delay = delay
+        self.tracker = tracker
+        self._after_id = None
+        self._last_query = entry.get()
+
+        entry.bind("<KeyRelease>", self._on_key)
+
+    def cancel(self) -> None:
+        """Drop a search waiting for typing to pause."""
+        if self._after_id is not None:
+            self.entry.after_cancel(self._after_id)
+            self._after_id = None
+
+    def reset(self) -> None:
+        """Forget the last query, e.g. after the entry was cleared in code."""
+        self.cancel()
+        self._last_query = self.entry.get()
+
+    def _on_key(self, event) -> None:
+        # Arrow keys, Shift and the like do not change the text
+        if self.entry.get() == self._last_query:
+            return
+
+        self.cancel()
+        self._after_id = self.entry.after(self.delay, self._run)
+
+    def _run(self) -> None:
+        self._after_id = None
+        query = self.entry.get()
+        if query == self._last_query:
+            return
+
+        self._last_query = query
+        start = time.perf_counter()
+        self.on_search(query)
+        self.entry.after_idle(
+            lambda: self.tracker.record(self.label, time.perf_counter() - start)
+        )
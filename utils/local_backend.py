@@ -0,0 +1,204 @@
+from .common import primary_keys, projections, valid_tables
+from .replica import Replica, Query
+from .sync import parse_select, tracked_tables, with_columns
+from .metrics import metrics
+from datetime import datetime, timezone
+import json
+import os
+import threading
+
+local_path = os.environ.get(
+    "DB_LOCAL_PATH",
+    os.path.join(os.path.expanduser("~"), ".registrar", "local.sqlite3"),
+)
+
+# Views of migrations/ answered by the local backend
+views = ["grade_recipients"]
+
+
+class LocalBackend(Replica):
+    """Standalone SQLite database with the query surface of the Supabase client.
+
+    Serves every table locally and never talks to a server, so the app, the
+    benchmarks and load tests can run on one machine against a generated
+    data set (see benchmarks/synthetic_data.py). Queries go through the same
+    builder as the replica: `eq`, `in_`, ranges, `order`, `limit` and
+    embedded resources such as `remarks(remark), subjects(*)`.
+
+    Behaves like the server where the Database depends on it: numeric keys
+    are assigned on insert, `updated_at` is stamped on every write like the
+    touch_updated_at trigger does, and inserting an existing key fails.
+    The views in `views` are computed from the tables.
+    """
+
+    def __init__(self, path: str = local_path) -> None:
+        super().__init__(path, tables=valid_tables)
+        # Next key of the tables with numeric keys, read on first insert
+        self._next_keys = {}
+        with self._lock, self._connection:
+            # Like the partial index of migrations/003_grade_recipients.sql
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS grades_not_messaged ON grades("
+                f"{self._column_text('remark_id')}, "
+                f"{self._column_text('student_id')}) "
+                f"WHERE {self._column_text('messaged')} = '0'"
+            )
+
+    @property
+    def remote(self):
+        raise Exception("The local backend has no server")
+
+    def start(self, interval: float = None) -> None:
+        pass
+
+    def sync(self, full: bool = False) -> dict:
+        return {}
+
+    def serves(self, table: str) -> bool:
+        return table in views or super().serves(table)
+
+    def execute(self, query: Query) -> list:
+        if query.table in views:
+            if query.operation != "select":
+                raise Exception(f"{query.table} is a view, it cannot be written")
+            return self._grade_recipients(query)
+
+        if query.table in tracked_tables and query.operation != "select":
+            now = datetime.now(timezone.utc).isoformat()
+            if query.operation == "update":
+                query.payload = {**query.payload, "updated_at": now}
+            elif query.operation != "delete":
+                rows = (
+                    query.payload
+                    if isinstance(query.payload, list)
+                    else [query.payload]
+                )
+                query.payload = [
+                    {"created_at": now, **row, "updated_at": now} for row in rows
+                ]
+
+        return super().execute(query)
+
+    def load(self, table: str, rows) -> int:
+        """Write rows as they are, without stamping or key checks.
+
+        Much faster than inserting through `table()`, for loading generated
+        data sets.
+
+        Args:
+            table (str): The table to write to.
+            rows (iterable): The rows, each with its primary key. Rows with
+                an existing key replace it.
+
+        Returns:
+            int: The number of rows written.
+        """
+        rows = list(rows)
+        with self._lock, self._connection:
+            self._store(table, rows)
+        self._next_keys.pop(table, None)
+        return len(rows)
+
+    def clear(self) -> None:
+        """Delete every row of every table."""
+        with self._lock, self._connection:
+            for table in self.tables:
+                self._connection.execute(f'DELETE FROM "{table}"')
+        self._next_keys.clear()
+
+    def _grade_recipients(self, query: Query) -> list:
+        from .database import group_grade_recipients
+
+        # Grades not messaged yet of the first `limit` students matching the
+        # filters, found with the grades_not_messaged index
+        clauses = [f"{self._column_text('messaged')} = '0'"]
+        params = []
+        for operator, column, value in query.filters:
+            if column not in ("student_id", "remark_id"):
+                raise Exception(f"Cannot filter grade_recipients by {column}")
+            if operator == "in_":
+                values = list(map(str, value)) or [None]
+                clauses.append(
+                    f"{self._column_text(column)} IN ({', '.join('?' * len(values))})"
+                )
+                params += values
+            else:
+                symbol = {"eq": "=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+                clauses.append(f"{self._column_text(column)} {symbol[operator]} ?")
+                params.append(str(value))
+
+        where = " AND ".join(clauses)
+        sql = f"SELECT data FROM grades WHERE {where}"
+        if query.row_limit is not None:
+            student_id = self._column_text("student_id")
+            sql += (
+                f" AND {student_id} IN (SELECT DISTINCT {student_id} FROM grades "
+                f"WHERE {where} ORDER BY {student_id} LIMIT {int(query.row_limit)})"
+            )
+            params += params
+
+        with self._lock:
+            grades = [
+                json.loads(row[0]) for row in self._connection.execute(sql, params)
+            ]
+
+        fields = parse_select(
+            with_columns(projections["grade_recipient"], ["remark_id"])
+        )
+        lookups = {}
+        recipients = group_grade_recipients(
+            [self._project("grades", grade, fields, lookups) for grade in grades]
+        )
+        for column, desc in reversed(query.ordering):
+            recipients.sort(key=lambda row: row[column], reverse=desc)
+        if query.row_limit is not None:
+            recipients = recipients[: query.row_limit]
+
+        if metrics.enabled:
+            # Counted like the response bodies of the server
+            metrics.add_bytes(len(json.dumps(recipients)))
+        fields = parse_select(query.columns)
+        return [self._project(query.table, row, fields, {}) for row in recipients]
+
+    def _ensure_synced(self, table: str) -> None:
+        pass
+
+    def _queue(self, table, operation, payload, filters, options) -> None:
+        pass
+
+    def _new_key(self, table: str):
+        if table not in self._next_keys:
+            last = self._connection.execute(
+                f'SELECT MAX({self._column(primary_keys[table])}) FROM "{table}"'
+            ).fetchone()[0]
+            if isinstance(last, str):
+                raise Exception(f"{table} needs a {primary_keys[table]} on insert")
+            self._next_keys[table] = (last or 0) + 1
+
+        key = self._next_keys[table]
+        self._next_keys[table] += 1
+        return key
+
+    def _store(self, table: str, rows: list) -> None:
+        super()._store(table, rows)
+
+        # Keys given on insert move the next assigned key past them
+        if table in self._next_keys:
+            pk = primary_keys[table]
+            for row in rows:
+                if isinstance(row[pk], int) and row[pk] >= self._next_keys[table]:
+                    self._next_keys[table] = row[pk] + 1
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_local_backend() -> LocalBackend:
+    """Get the process-wide local backend, opened on first use."""
+    global _shared
+
+    with _shared_lock:
+        if _shared is None:
+            _shared = LocalBackend()
+        return _shared
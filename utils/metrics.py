@@ -0,0 +1,310 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+metrics_enabled = os.environ.get("METRICS_ENABLED", "1") == "1"
+buffer_size = int(os.environ.get("METRICS_BUFFER_SIZE", 20000))
+
+
+def count_rows(result) -> int:
+    """Count the rows of an operation's result: a list's length, or 1 row."""
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple, set)):
+        return len(result)
+    return 1
+
+
+class Metrics:
+    """Records the timings of operations in a ring buffer.
+
+    Each call of a timed function becomes a span with its name, start, wall
+    time, row count and payload bytes. Only the last `size` spans are kept,
+    so recording costs the same however long the app runs.
+
+    Payload bytes are counted by the transports as they receive data, see
+    `add_bytes`, and attributed to the operations running on the same thread,
+    or in the same coroutine, see `counting_bytes`.
+
+    Attributes:
+        enabled (bool): Whether spans are recorded.
+    """
+
+    def __init__(self, size: int = buffer_size, enabled: bool = metrics_enabled):
+        self.enabled = enabled
+        self._spans = collections.deque(maxlen=size)
+        self._local = threading.local()
+        # The byte counter of the running coroutine, if it has its own
+        self._counter = contextvars.ContextVar("received", default=None)
+        # Spans are timed with perf_counter, this maps them to wall clock time
+        self._origin = (time.time(), time.perf_counter())
+
+    def add_bytes(self, count: int) -> None:
+        """Count bytes received for the operations running on this thread."""
+        self._bytes()[0] += count
+
+    def received(self) -> int:
+        """Get the bytes received so far by the operations on this thread."""
+        return self._bytes()[0]
+
+    @contextlib.contextmanager
+    def counting_bytes(self):
+        """Count the bytes received in the block apart from other coroutines.
+
+        Coroutines sharing the event loop's thread would otherwise count each
+        other's bytes. Tasks and threads started in the block (`asyncio.gather`,
+        `asyncio.to_thread`) count into the block's counter, which is added to
+        the enclosing one at the end.
+        """
+        counter = [0]
+        token = self._counter.set(counter)
+        try:
+            yield
+        finally:
+            self._counter.reset(token)
+            self._bytes()[0] += counter[0]
+
+    def _bytes(self) -> list:
+        counter = self._counter.get()
+        if counter is None:
+            counter = getattr(self._local, "bytes", None)
+            if counter is None:
+                counter = self._local.bytes = [0]
+        return counter
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        """Record the block as a span.
+
+        Yields a dict the block can set the span's `rows` in.
+
+        Args:
+            name (str): The span name.
+        """
+        span = {"rows": 0}
+        before = self.received()
+        start = time.perf_counter()
+        yield span
+        self.record(
+            name,
+            start,
+            time.perf_counter() - start,
+            span["rows"],
+            self.received() - before,
+        )
+
+    def record(
+        self, name: str, start: float, duration: float, rows=0, payload_bytes=0
+    ) -> None:
+        """Add a span.
+
+        Args:
+            name (str): The operation's name.
+            start (float): When it started, from `time.perf_counter()`.
+            duration (float): Its wall time in seconds.
+            rows (int) (optional): The number of rows it returned.
+            payload_bytes (int) (optional): The bytes it received.
+        """
+        if self.enabled:
+            self._spans.append(
+                (
+                    name,
+                    start,
+                    duration,
+                    rows,
+                    payload_bytes,
+                    threading.current_thread().name,
+                )
+            )
+
+    def timed(self, name: str = None, rows=count_rows):
+        """Decorate a function so every call is recorded.
+
+        Works on plain functions, generators (timed while producing items,
+        not while the consumer holds them) and coroutines.
+
+        Args:
+            name (str) (optional): The span name. Defaults to the function's
+                qualified name.
+            rows (callable) (optional): Counts the rows of a result.
+        """
+
+        def decorator(fn):
+            span = name or fn.__qualname__
+
+            if inspect.isgeneratorfunction(fn):
+
+                @functools.wraps(fn)
+                def generator(*args, **kwargs):
+                    if not self.enabled:
+                        yield from fn(*args, **kwargs)
+                        return
+
+                    start = time.perf_counter()
+                    busy = 0.0
+                    count = 0
+                    received = 0
+                    iterator = fn(*args, **kwargs)
+                    while True:
+                        resumed = time.perf_counter()
+                        before = self.received()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            break
+                        finally:
+                            busy += time.perf_counter() - resumed
+                            received += self.received() - before
+                        count += rows(item)
+                        yield item
+                    self.record(span, start, busy, count, received)
+
+                return generator
+
+            if inspect.iscoroutinefunction(fn):
+
+                @functools.wraps(fn)
+                async def coroutine(*args, **kwargs):
+                    start = time.perf_counter()
+                    result = await fn(*args, **kwargs)
+                    self.record(span, start, time.perf_counter() - start, rows(result))
+                    return result
+
+                return coroutine
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+
+                before = self.received()
+                start = time.perf_counter()
+                result = fn(*args, **kwargs)
+                self.record(
+                    span,
+                    start,
+                    time.perf_counter() - start,
+                    rows(result),
+                    self.received() - before,
+                )
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def spans(self) -> list:
+        """Get the recorded spans, oldest first.
+
+        Returns:
+            list: Dicts with `name`, `start` (Unix time), `duration`
+                (seconds), `rows`, `bytes` and `thread`.
+        """
+        wall, counter = self._origin
+        return [
+            {
+                "name": name,
+                "start": wall + start - counter,
+                "duration": duration,
+                "rows": rows,
+                "bytes": payload_bytes,
+                "thread": thread,
+            }
+            for name, start, duration, rows, payload_bytes, thread in list(self._spans)
+        ]
+
+    def summary(self) -> dict:
+        """Summarize the recorded spans per operation.
+
+        Returns:
+            dict: For each operation name, `count`, `p50_ms`, `p95_ms`,
+                `max_ms`, `total_ms`, `rows` and `bytes`.
+        """
+        grouped = {}
+        for name, _, duration, rows, payload_bytes, _ in list(self._spans):
+            grouped.setdefault(name, []).append((duration, rows, payload_bytes))
+
+        summary = {}
+        for name, spans in sorted(grouped.items()):
+            durations = sorted(span[0] for span in spans)
+            summary[name] = {
+                "count": len(spans),
+                "p50_ms": _percentile(durations, 0.50) * 1000,
+                "p95_ms": _percentile(durations, 0.95) * 1000,
+                "max_ms": durations[-1] * 1000,
+                "total_ms": sum(durations) * 1000,
+                "rows": sum(span[1] for span in spans),
+                "bytes": sum(span[2] for span in spans),
+            }
+        return summary
+
+    def clear(self) -> None:
+        self._spans.clear()
+
+    def export_json(self, path: str) -> None:
+        """Save the spans and their summary as JSON."""
+        with open(path, "w") as file:
+            json.dump({"summary": self.summary(), "spans": self.spans()}, file)
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Save the spans in the Chrome trace event format.
+
+        The file opens in chrome://tracing or https://ui.perfetto.dev, with
+        one track per thread.
+        """
+        threads = {}
+        events = []
+        for span in self.spans():
+            tid = threads.setdefault(span["thread"], len(threads) + 1)
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["name"].split(".")[0],
+                    "ph": "X",
+                    "ts": span["start"] * 1e6,
+                    "dur": span["duration"] * 1e6,
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"rows": span["rows"], "bytes": span["bytes"]},
+                }
+            )
+        for thread, tid in threads.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": thread},
+                }
+            )
+
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+def _percentile(ordered: list, share: float) -> float:
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+metrics = Metrics()
+
+
+def count_response_bytes(response, *args, **kwargs) -> None:
+    """Response hook of httpx and requests counting the bytes received."""
+    if hasattr(response, "read"):
+        # httpx hooks run before the body is read
+        response.read()
+    metrics.add_bytes(len(response.content))
+
+
+async def count_async_response_bytes(response) -> None:
+    """Response hook of httpx.AsyncClient counting the bytes received."""
+    await response.aread()
+    metrics.add_bytes(len(response.content))
@@ -0,0 +1,398 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+outbox_path = os.environ.get(
+    "SMS_OUTBOX_PATH",
+    os.path.join(os.path.expanduser("~"), ".registrar", "sms_outbox.sqlite3"),
+)
+
+# Message states
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+UNCERTAIN = "uncertain"
+ACKED = "acked"
+SUPERSEDED = "superseded"
+
+schema = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    completed_at REAL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    idempotency_key TEXT PRIMARY KEY,
+    campaign_id TEXT NOT NULL REFERENCES campaigns(id),
+    kind TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    message TEXT NOT NULL,
+    ack_table TEXT,
+    ack_ids TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    response TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_state ON messages(kind, state);
+"""
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_outbox():
+    """Get the process-wide outbox, opening it on first use."""
+    global _shared
+
+    with _shared_lock:
+        if _shared is None:
+            _shared = Outbox()
+        return _shared
+
+
+def idempotency_key(kind: str, student_id: str, versions: list) -> str:
+    """Build the key identifying one message to one student.
+
+    The key only depends on who is messaged and about which versions of which
+    rows, so the same recipients produce the same keys after a restart, even if
+    the message text was edited in between. Editing a row changes its version,
+    so the student is messaged again.
+
+    Args:
+        kind (str): The campaign kind, e.g. "incomplete_grade".
+        student_id (str): The recipient's student ID.
+        versions (list): The row ID and `updated_at` of each row the message
+            is about.
+
+    Returns:
+        str: The idempotency key.
+    """
+    rows = ",".join(sorted(str(version) for version in versions))
+    return hashlib.sha256(f"{kind}:{student_id}:{rows}".encode()).hexdigest()
+
+
+class Outbox:
+    """Durable local record of generated SMS messages and their delivery.
+
+    Every message is stored before it is sent and its state is updated as soon
+    as the gateway answers. A campaign interrupted by a crash resumes from the
+    messages that were never sent, and a message is never sent twice.
+
+    States:
+        pending: Stored, not sent yet.
+        sending: Handed to the gateway, no answer recorded yet.
+        sent: Accepted by the gateway, the database rows are not updated yet.
+        failed: Rejected by the gateway, sent again on the next run.
+        uncertain: Was being sent when the app stopped, it may have been
+            delivered so it is not sent again until the user decides, see
+            `resolve_uncertain`.
+        acked: Sent and the database rows are marked as messaged.
+        superseded: Replaced by a later campaign of the same kind before it
+            was sent.
+    """
+
+    def __init__(self, path: str = outbox_path) -> None:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(schema)
+
+        self.recover()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def recover(self) -> int:
+        """Flag messages left in the sending state by a previous run.
+
+        Called when the outbox is opened, before anything is sent.
+
+        Returns:
+            int: The number of messages flagged as uncertain.
+        """
+        with self._lock, self._connection:
+            return self._connection.execute(
+                "UPDATE messages SET state = ?, updated_at = ? WHERE state = ?",
+                (UNCERTAIN, time.time(), SENDING),
+            ).rowcount
+
+    def enqueue(self, kind: str, ack_table: str, messages: list) -> str:
+        """Store the messages of a new campaign.
+
+        The campaign replaces the unsent messages of earlier campaigns of the
+        same kind, whose text or rows may be outdated: one with the same
+        idempotency key is taken over with the new text, the others are
+        superseded. Messages that were sent, or may have been, are kept, so
+        no one is messaged twice.
+
+        Args:
+            kind (str): The campaign kind.
+            ack_table (str): The table whose rows are marked once sent.
+            messages (list): Dicts with `student_id`, `recipient`, `message`,
+                `ack_ids` and `versions`.
+
+        Returns:
+            str: The campaign ID, None if there was nothing to queue.
+        """
+        campaign_id = uuid.uuid4().hex
+        now = time.time()
+
+        with self._lock, self._connection:
+            if not messages:
+                # Nothing qualifies any more
+                self._supersede(kind, None, now)
+                return None
+
+            self._connection.execute(
+                "INSERT INTO campaigns (id, kind, created_at) VALUES (?, ?, ?)",
+                (campaign_id, kind, now),
+            )
+            self._connection.executemany(
+                "INSERT INTO messages (idempotency_key, campaign_id, kind,"
+                " student_id, recipient, message, ack_table, ack_ids, state,"
+                " updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (idempotency_key) DO UPDATE SET"
+                " campaign_id = excluded.campaign_id,"
+                " recipient = excluded.recipient, message = excluded.message,"
+                " ack_ids = excluded.ack_ids, state = excluded.state,"
+                " updated_at = excluded.updated_at"
+                " WHERE messages.state IN (?, ?, ?)",
+                [
+                    (
+                        idempotency_key(kind, m["student_id"], m["versions"]),
+                        campaign_id,
+                        kind,
+                        str(m["student_id"]),
+                        m["recipient"],
+                        m["message"],
+                        ack_table,
+                        json.dumps(m["ack_ids"]),
+                        PENDING,
+                        now,
+                        PENDING,
+                        FAILED,
+                        SUPERSEDED,
+                    )
+                    for m in messages
+                ],
+            )
+            self._supersede(kind, campaign_id, now)
+
+        return campaign_id
+
+    def claim(self, kind: str, campaign_id: str = None, keys=None) -> list:
+        """Take the unsent messages of a campaign and mark them as sending.
+
+        Args:
+            kind (str): The campaign kind.
+            campaign_id (str) (optional): The campaign, from `enqueue`. Takes
+                the unsent messages of every campaign of the kind when
+                omitted, to resume interrupted ones.
+            keys (set) (optional): The idempotency keys of the messages whose
+                rows still qualify. The other unsent messages of the kind are
+                superseded instead of taken.
+
+        Returns:
+            list: Dicts with `key`, `student_id`, `recipient`, `message` and
+                `ack_ids`.
+        """
+        query = "SELECT * FROM messages WHERE kind = ? AND state IN (?, ?)"
+        parameters = (kind, PENDING, FAILED)
+        if campaign_id is not None:
+            query += " AND campaign_id = ?"
+            parameters += (campaign_id,)
+
+        with self._lock, self._connection:
+            rows = self._connection.execute(query, parameters).fetchall()
+            if keys is not None:
+                stale = [row for row in rows if row["idempotency_key"] not in keys]
+                self._connection.executemany(
+                    "UPDATE messages SET state = ?, updated_at = ?"
+                    " WHERE idempotency_key = ?",
+                    [
+                        (SUPERSEDED, time.time(), row["idempotency_key"])
+                        for row in stale
+                    ],
+                )
+                rows = [row for row in rows if row["idempotency_key"] in keys]
+            self._connection.executemany(
+                "UPDATE messages SET state = ?, updated_at = ?"
+                " WHERE idempotency_key = ?",
+                [(SENDING, time.time(), row["idempotency_key"]) for row in rows],
+            )
+
+        return [
+            {
+                "key": row["idempotency_key"],
+                "student_id": row["student_id"],
+                "recipient": row["recipient"],
+                "message": row["message"],
+                "ack_ids": json.loads(row["ack_ids"]),
+            }
+            for row in rows
+        ]
+
+    def record(self, key: str, success: bool, attempts: int, response) -> None:
+        """Store the gateway's answer for a message.
+
+        Args:
+            key (str): The message's idempotency key.
+            success (bool): Whether the gateway accepted the message.
+            attempts (int): The number of requests made for it.
+            response: The gateway's reply or the error.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE messages SET state = ?, attempts = attempts + ?,"
+                " response = ?, updated_at = ? WHERE idempotency_key = ?",
+                (
+                    SENT if success else FAILED,
+                    attempts,
+                    json.dumps(response, default=str),
+                    time.time(),
+                    key,
+                ),
+            )
+
+    def uncertain(self) -> list:
+        """Get the messages that may have been sent when the app stopped.
+
+        Returns:
+            list: Dicts with `key`, `kind`, `student_id` and `recipient`.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT idempotency_key, kind, student_id, recipient FROM messages"
+                " WHERE state = ? ORDER BY updated_at",
+                (UNCERTAIN,),
+            ).fetchall()
+
+        return [
+            {
+                "key": row["idempotency_key"],
+                "kind": row["kind"],
+                "student_id": row["student_id"],
+                "recipient": row["recipient"],
+            }
+            for row in rows
+        ]
+
+    def resolve_uncertain(self, keys: list, sent: bool) -> None:
+        """Settle messages that may have been sent, as the user decided.
+
+        Args:
+            keys (list): The messages' idempotency keys.
+            sent (bool): Whether they were delivered. Delivered messages are
+                acknowledged by the next `flush_acks`, the others are sent
+                again with the unfinished campaigns.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE messages SET state = ?, updated_at = ?"
+                " WHERE idempotency_key = ? AND state = ?",
+                [
+                    (SENT if sent else FAILED, time.time(), key, UNCERTAIN)
+                    for key in keys
+                ],
+            )
+
+    def flush_acks(self, write) -> list:
+        """Write sent messages back to the database.
+
+        A message is acknowledged once every row it covers was marked. Rows of
+        failed chunks stay in the sent state and are written on the next flush.
+
+        Args:
+            write (callable): Called with a table name and a list of row IDs,
+                marks those rows as messaged and returns one report per chunk,
+                each a dict with `ids`, `success` and `error`.
+
+        Returns:
+            list: The chunk reports of every write.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT idempotency_key, ack_table, ack_ids FROM messages"
+                " WHERE state = ? ORDER BY ack_table",
+                (SENT,),
+            ).fetchall()
+
+        by_table = {}
+        for row in rows:
+            by_table.setdefault(row["ack_table"], []).append(row)
+
+        reports = []
+        for table, table_rows in by_table.items():
+            ids = [id for row in table_rows for id in json.loads(row["ack_ids"])]
+            table_reports = write(table, ids)
+            reports += table_reports
+
+            marked = set()
+            for report in table_reports:
+                if report["success"]:
+                    marked.update(report["ids"])
+
+            acked = [
+                row["idempotency_key"]
+                for row in table_rows
+                if marked.issuperset(json.loads(row["ack_ids"]))
+            ]
+            with self._lock, self._connection:
+                self._connection.executemany(
+                    "UPDATE messages SET state = ?, updated_at = ?"
+                    " WHERE idempotency_key = ?",
+                    [(ACKED, time.time(), key) for key in acked],
+                )
+
+        self._complete_campaigns()
+        return reports
+
+    def unfinished_kinds(self) -> list:
+        """Get the kinds of campaigns that still have unsent messages."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT kind FROM messages WHERE state IN (?, ?, ?)",
+                (PENDING, SENDING, FAILED),
+            ).fetchall()
+
+        return [row["kind"] for row in rows]
+
+    def counts(self) -> dict:
+        """Get the number of messages in each state."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT state, COUNT(*) FROM messages GROUP BY state"
+            ).fetchall()
+
+        return {row[0]: row[1] for row in rows}
+
+    def _supersede(self, kind: str, campaign_id: str, now: float) -> None:
+        self._connection.execute(
+            "UPDATE messages SET state = ?, updated_at = ? WHERE kind = ?"
+            " AND campaign_id IS NOT ? AND state IN (?, ?)",
+            (SUPERSEDED, now, kind, campaign_id, PENDING, FAILED),
+        )
+
+    def _complete_campaigns(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE campaigns SET completed_at = ? WHERE completed_at IS NULL"
+                " AND NOT EXISTS (SELECT 1 FROM messages WHERE campaign_id ="
+                " campaigns.id AND state IN (?, ?, ?, ?, ?))",
+                (time.time(), PENDING, SENDING, SENT, FAILED, UNCERTAIN),
+            )
@@ -0,0 +1,109 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    Attributes:
+        rate (float): Tokens added per second, the sustained request rate.
+            0 means unlimited.
+        burst (int): Maximum tokens held, the largest burst allowed.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        if rate < 0:
+            raise Exception(f"Invalid rate: {rate}. Expected 0 (unlimited) or more")
+        if burst < 1:
+            raise Exception(f"Invalid burst: {burst}. Expected 1 or more")
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available, then take it."""
+        if self.rate == 0:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    Attributes:
+        max_retries (int): Retries allowed for a single request.
+        base_delay (float): Delay ceiling in seconds for the first retry.
+        max_delay (float): Upper bound on the delay ceiling.
+    """
+
+    def __init__(
+        self, max_retries: int = 4, base_delay: float = 0.5, max_delay: float = 30
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        """Get how long to wait before a retry.
+
+        Args:
+            attempt (int): The number of attempts already made, starting at 0.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2**attempt)
+        return random.uniform(0, ceiling)
+
+
+class RetryBudget:
+    """Caps the total number of retries spent by one campaign.
+
+    When the provider is down every request would otherwise retry up to its
+    own limit, multiplying the load on the gateway.
+
+    Attributes:
+        limit (int): Total retries allowed.
+        spent (int): Retries used so far.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def try_spend(self) -> bool:
+        """Take one retry from the budget.
+
+        Returns:
+            bool: False if the budget is exhausted.
+        """
+        with self._lock:
+            if self.spent >= self.limit:
+                return False
+
+            self.spent += 1
+            return True
+
+    @property
+    def remaining(self) -> int:
+        return self.limit - self.spent
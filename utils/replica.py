@@ -0,0 +1,774 @@
+from .common import primary_keys
+from .sync import DeltaSync, parse_select
+from .metrics import metrics
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+replica_path = os.environ.get(
+    "DB_REPLICA_PATH",
+    os.path.join(os.path.expanduser("~"), ".registrar", "replica.sqlite3"),
+)
+logger = logging.getLogger(__name__)
+sync_interval = float(os.environ.get("DB_REPLICA_SYNC_INTERVAL", 60))
+
+# Tables copied locally, the rest (e.g. login) are always read from the server
+replicated_tables = [
+    "student_info",
+    "grades",
+    "subjects",
+    "courses",
+    "document_type",
+    "student_requests",
+    # Small lookup tables, needed to serve the embedded remark and status
+    "remarks",
+    "request_statuses",
+]
+
+# Columns the Database filters on, indexed in the replica
+indexed_columns = {
+    "grades": ["student_id", "remark_id", "messaged"],
+    "student_requests": ["student_id", "student_request_status_id", "messaged"],
+}
+
+# Embeddable resources: (table, embedded table) -> foreign key column
+relations = {
+    ("grades", "student_info"): "student_id",
+    ("grades", "subjects"): "subject_code",
+    ("grades", "remarks"): "remark_id",
+    ("student_requests", "student_info"): "student_id",
+    ("student_requests", "document_type"): "document_type_id",
+    ("student_requests", "request_statuses"): "student_request_status_id",
+    ("student_info", "courses"): "course_code",
+}
+
+# Primary keys of rows inserted while offline start with this
+local_prefix = "local-"
+
+schema = """
+CREATE TABLE IF NOT EXISTS sync_marks (
+    table_name TEXT PRIMARY KEY,
+    mark TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    payload TEXT,
+    filters TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL
+);
+"""
+
+# Write states
+PENDING = "pending"
+FAILED = "failed"
+
+# Errors meaning the server could not be reached, as opposed to a rejected
+# request. httpx errors are imported lazily with the rest of the client.
+offline_errors = (OSError, TimeoutError)
+
+
+def _offline_errors():
+    import httpx
+
+    return offline_errors + (httpx.TransportError,)
+
+
+def _text(value) -> str:
+    # Keys are compared as text, so "5" finds the grade with ID 5
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
+
+
+class Response:
+    """The result of a query, shaped like the PostgREST client's."""
+
+    def __init__(self, data: list) -> None:
+        self.data = data
+
+
+class Query:
+    """Query builder with the subset of the PostgREST API the Database uses.
+
+    Reads are answered from the replica. Writes are applied to the replica
+    and queued to be replayed on the server.
+    """
+
+    def __init__(self, replica: "Replica", table: str) -> None:
+        self.replica = replica
+        self.table = table
+        self.operation = "select"
+        self.columns = "*"
+        self.payload = None
+        self.options = {}
+        self.filters = []
+        self.ordering = []
+        self.row_limit = None
+
+    def select(self, columns: str = "*", **kwargs) -> "Query":
+        self.columns = columns
+        return self
+
+    def insert(self, json, **kwargs) -> "Query":
+        self.operation = "insert"
+        self.payload = json
+        return self
+
+    def upsert(
+        self, json, on_conflict: str = "", ignore_duplicates: bool = False, **kwargs
+    ) -> "Query":
+        self.operation = "upsert"
+        self.payload = json
+        self.options = {
+            "on_conflict": on_conflict,
+            "ignore_duplicates": ignore_duplicates,
+        }
+        return self
+
+    def update(self, json, **kwargs) -> "Query":
+        self.operation = "update"
+        self.payload = json
+        return self
+
+    def delete(self, **kwargs) -> "Query":
+        self.operation = "delete"
+        return self
+
+    def eq(self, column: str, value) -> "Query":
+        self.filters.append(("eq", column, value))
+        return self
+
+    def in_(self, column: str, values) -> "Query":
+        self.filters.append(("in_", column, list(values)))
+        return self
+
+    def gt(self, column: str, value) -> "Query":
+        self.filters.append(("gt", column, value))
+        return self
+
+    def gte(self, column: str, value) -> "Query":
+        self.filters.append(("gte", column, value))
+        return self
+
+    def lt(self, column: str, value) -> "Query":
+        self.filters.append(("lt", column, value))
+        return self
+
+    def lte(self, column: str, value) -> "Query":
+        self.filters.append(("lte", column, value))
+        return self
+
+    def order(self, column: str, *, desc: bool = False, **kwargs) -> "Query":
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, size: int, **kwargs) -> "Query":
+        self.row_limit = size
+        return self
+
+    def execute(self) -> Response:
+        return Response(self.replica.execute(self))
+
+
+class AsyncQuery(Query):
+    """Query whose `execute` is a coroutine, for the AsyncDatabase."""
+
+    async def execute(self) -> Response:
+        return Response(await asyncio.to_thread(self.replica.execute, self))
+
+
+class Replica:
+    """Local SQLite copy of the registrar tables.
+
+    Stands in for the Supabase client: `table()` returns a query builder that
+    reads from the replica, so the Database works the same on top of either.
+    Writes change the replica right away and are queued, then replayed on the
+    server in order by `sync()`, which also pulls the rows changed on the
+    server since the last sync. While the server cannot be reached, reads
+    keep working and writes stay queued.
+
+    Each table is stored as JSON documents keyed by primary key. Changes are
+    pulled with a DeltaSync, whose high-water marks are saved in the replica
+    so a restart resumes where the last sync stopped. Without the tombstones
+    table, rows deleted on the server are only dropped by a full sync.
+
+    Writes the server rejects are kept, see `failed_writes`, until the user
+    has been shown them.
+
+    Attributes:
+        online (bool): Whether the last exchange with the server succeeded.
+    """
+
+    def __init__(
+        self, path: str = replica_path, remote=None, tables: list = replicated_tables
+    ) -> None:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.tables = tables
+        self.online = True
+        self._remote = remote
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._delta = None
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(schema)
+            for table in tables:
+                self._connection.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{table}" '
+                    "(pk TEXT PRIMARY KEY, data TEXT NOT NULL)"
+                )
+                # Keyset pagination orders by the typed key, not its text
+                self._connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{table}_order" '
+                    f'ON "{table}"({self._column(primary_keys[table])})'
+                )
+                for column in indexed_columns.get(table, []):
+                    self._connection.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{table}_{column}" '
+                        f'ON "{table}"({self._column_text(column)})'
+                    )
+
+    @property
+    def remote(self):
+        """The Supabase client the replica syncs with, created on first use."""
+        if self._remote is None:
+            from .database import client_pool, url, key
+
+            self._remote = client_pool.get(url, key)
+        return self._remote
+
+    @property
+    def delta(self) -> DeltaSync:
+        """The sync engine pulling from the server, resumed from the replica."""
+        if self._delta is None:
+            with self._lock:
+                marks = {
+                    table: json.loads(mark)
+                    for table, mark in self._connection.execute(
+                        "SELECT table_name, mark FROM sync_marks"
+                    )
+                }
+            self._delta = DeltaSync(self.remote, marks, require_tombstones=False)
+        return self._delta
+
+    def close(self) -> None:
+        self.stop()
+        self._connection.close()
+
+    def table(self, table: str):
+        """Start a query on a table, like `Client.table`."""
+        if not self.serves(table):
+            return self.remote.table(table)
+
+        return Query(self, table)
+
+    def serves(self, table: str) -> bool:
+        """Whether queries on a table run here rather than on the server."""
+        return table in self.tables
+
+    # Background sync
+
+    def start(self, interval: float = sync_interval) -> None:
+        """Sync in a background thread every `interval` seconds."""
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.sync()
+                except Exception as error:
+                    logger.exception("Replica sync failed: %s", error)
+                if self._stop.wait(interval):
+                    break
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, name="replica-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    # Sync
+
+    def sync(self, full: bool = False) -> dict:
+        """Replay the queued writes, then pull the changes from the server.
+
+        Nothing is pulled until every queued write is replayed, so the rows
+        written locally are never overwritten by older server versions.
+
+        Args:
+            full (bool) (optional): Copy every table whole instead of only the
+                changed rows, which also drops rows deleted on the server.
+
+        Returns:
+            dict: `replayed`, the number of writes replayed, and `pulled`,
+                the number of rows pulled per table. Empty if the server
+                could not be reached.
+        """
+        with self._sync_lock:
+            try:
+                replayed = self._replay()
+                if self.pending_count():
+                    return {}
+
+                pulled = {}
+                for table in self.tables:
+                    pulled[table] = self._pull(table, full)
+            except _offline_errors() as error:
+                if self.online:
+                    logger.warning(
+                        "Working offline, the server cannot be reached: %s", error
+                    )
+                self.online = False
+                return {}
+
+            self.online = True
+            return {"replayed": replayed, "pulled": pulled}
+
+    def pending_count(self) -> int:
+        """Get the number of writes waiting to be replayed."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM pending_writes WHERE state = ?", (PENDING,)
+            ).fetchone()[0]
+
+    def failed_writes(self) -> list:
+        """Get the writes the server rejected when they were replayed.
+
+        Returns:
+            list: One dict per write, with `id`, `table`, `operation`,
+                `payload`, `filters` and `error`.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM pending_writes WHERE state = ? ORDER BY id", (FAILED,)
+            ).fetchall()
+
+        return [
+            {
+                "id": row[0],
+                "table": row[1],
+                "operation": row[2],
+                "payload": json.loads(row[3]),
+                "filters": json.loads(row[4]),
+                "error": row[7],
+            }
+            for row in rows
+        ]
+
+    def dismiss_failed_writes(self, ids: list) -> None:
+        """Forget rejected writes, once the user has been shown them.
+
+        Args:
+            ids (list): The writes' `id`, from `failed_writes`.
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM pending_writes WHERE id = ? AND state = ?",
+                [(id, FAILED) for id in ids],
+            )
+
+    def _replay(self) -> int:
+        with self._lock:
+            writes = self._connection.execute(
+                "SELECT id, table_name, operation, payload, filters, options "
+                "FROM pending_writes WHERE state = ? ORDER BY id",
+                (PENDING,),
+            ).fetchall()
+
+        replayed = 0
+        for id, table, operation, payload, filters, options in writes:
+            payload = json.loads(payload)
+            options = json.loads(options)
+            query = self.remote.table(table)
+            temporary = []
+
+            if operation in ("insert", "upsert"):
+                pk = primary_keys[table]
+                rows = payload if isinstance(payload, list) else [payload]
+                temporary = [row[pk] for row in rows if self._is_local(row.get(pk))]
+                # The server assigns the real keys
+                rows = [
+                    {k: v for k, v in row.items() if not (k == pk and v in temporary)}
+                    for row in rows
+                ]
+                if not rows:
+                    self._finish_write(id)
+                    continue
+                if operation == "insert":
+                    query = query.insert(rows)
+                else:
+                    query = query.upsert(rows, **options)
+            elif operation == "update":
+                query = query.update(payload)
+            else:
+                query = query.delete()
+
+            for operator, column, value in json.loads(filters):
+                query = getattr(query, operator)(column, value)
+
+            try:
+                rows = query.execute().data
+            except _offline_errors():
+                raise
+            except Exception as error:
+                logger.warning(
+                    "Replica write %s to %s was rejected: %s", id, table, error
+                )
+                with self._lock, self._connection:
+                    self._connection.execute(
+                        "UPDATE pending_writes SET state = ?, error = ? WHERE id = ?",
+                        (FAILED, str(error), id),
+                    )
+                continue
+
+            with self._lock, self._connection:
+                self._delete_keys(table, temporary)
+                if operation != "delete":
+                    self._store(table, rows)
+                self._finish_write(id)
+            replayed += 1
+
+        return replayed
+
+    def _finish_write(self, id: int) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM pending_writes WHERE id = ?", (id,))
+
+    def _pull(self, table: str, full: bool = False) -> int:
+        if full:
+            self.delta.reset(table)
+
+        changes = self.delta.pull(table)
+        with self._lock, self._connection:
+            if changes["full"]:
+                self._connection.execute(
+                    f'DELETE FROM "{table}" WHERE pk NOT LIKE ?', (local_prefix + "%",)
+                )
+            self._store(table, changes["rows"])
+            self._delete_keys(table, changes["deleted"])
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sync_marks VALUES (?, ?)",
+                (table, json.dumps(self.delta.marks[table])),
+            )
+
+        return len(changes["rows"])
+
+    def _ensure_synced(self, table: str) -> None:
+        # The first read of a table waits for its first copy
+        with self._lock:
+            synced = self._connection.execute(
+                "SELECT 1 FROM sync_marks WHERE table_name = ?", (table,)
+            ).fetchone()
+        if synced:
+            return
+
+        with self._sync_lock:
+            try:
+                self._pull(table, full=True)
+            except _offline_errors() as error:
+                if self.online:
+                    logger.warning("Cannot copy %s for offline use: %s", table, error)
+                self.online = False
+
+    # Local queries
+
+    def execute(self, query: Query) -> list:
+        """Run a query against the replica."""
+        self._ensure_synced(query.table)
+        if query.operation == "select":
+            return self._select(query)
+
+        with self._lock, self._connection:
+            if query.operation in ("insert", "upsert"):
+                return self._insert(query)
+            elif query.operation == "update":
+                return self._update(query)
+            else:
+                return self._delete(query)
+
+    def _select(self, query: Query) -> list:
+        where, params = self._where(query.table, query.filters)
+        sql = f'SELECT data FROM "{query.table}"{where}'
+        if query.ordering:
+            sql += " ORDER BY " + ", ".join(
+                f"{self._column(column)}{' DESC' if desc else ''}"
+                for column, desc in query.ordering
+            )
+        if query.row_limit is not None:
+            sql += f" LIMIT {int(query.row_limit)}"
+
+        with self._lock:
+            documents = [row[0] for row in self._connection.execute(sql, params)]
+        # Counted like the response bodies of the server
+        metrics.add_bytes(sum(map(len, documents)))
+        rows = list(map(json.loads, documents))
+
+        fields = parse_select(query.columns)
+        return [self._project(query.table, row, fields, {}) for row in rows]
+
+    def _project(self, table: str, row: dict, fields: list, lookups: dict) -> dict:
+        projected = {}
+        for name, nested in fields:
+            if nested is None:
+                if name == "*":
+                    projected.update(row)
+                else:
+                    projected[name] = row.get(name)
+                continue
+
+            foreign_key = relations.get((table, name))
+            if foreign_key is None:
+                raise Exception(f"No relationship between {table} and {name}")
+
+            value = row.get(foreign_key)
+            if (name, value) not in lookups:
+                lookups[name, value] = self._get(name, value)
+            referenced = lookups[name, value]
+            projected[name] = (
+                self._project(name, referenced, parse_select(nested), lookups)
+                if referenced is not None
+                else None
+            )
+
+        return projected
+
+    def _get(self, table: str, key) -> dict:
+        if key is None:
+            return None
+
+        self._ensure_synced(table)
+        with self._lock:
+            row = self._connection.execute(
+                f'SELECT data FROM "{table}" WHERE pk = ?', (_text(key),)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _insert(self, query: Query) -> list:
+        table = query.table
+        pk = primary_keys[table]
+        rows = query.payload if isinstance(query.payload, list) else [query.payload]
+        ignore_duplicates = query.options.get("ignore_duplicates", False)
+
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            if row.get(pk) is None:
+                row[pk] = self._new_key(table)
+
+        existing = self._load(table, [_text(row[pk]) for row in rows])
+        written = []
+        for row in rows:
+            current = existing.get(_text(row[pk]))
+            if current is not None:
+                if query.operation == "insert":
+                    raise Exception(f"Duplicate key {pk}={row[pk]} in {table}")
+                if ignore_duplicates:
+                    continue
+                row = {**current, **row}
+            written.append(row)
+
+        self._store(table, written)
+        self._queue(table, query.operation, rows, [], query.options)
+        return written
+
+    def _update(self, query: Query) -> list:
+        table = query.table
+        pk = primary_keys[table]
+        rows = self._matching(query)
+        updated = [{**row, **query.payload} for row in rows]
+        self._store(table, updated)
+
+        # Rows only inserted locally are not on the server yet, change the
+        # queued insert instead
+        local = {row[pk]: row for row in updated if self._is_local(row[pk])}
+        if local:
+            self._rewrite_inserts(
+                table,
+                lambda row: local.get(row.get(pk), row),
+            )
+        if not updated or len(local) < len(updated):
+            self._queue(table, "update", query.payload, query.filters, {})
+
+        return updated
+
+    def _delete(self, query: Query) -> list:
+        table = query.table
+        pk = primary_keys[table]
+        rows = self._matching(query)
+        self._delete_keys(table, [row[pk] for row in rows])
+
+        local = {row[pk] for row in rows if self._is_local(row[pk])}
+        if local:
+            self._rewrite_inserts(
+                table, lambda row: None if row.get(pk) in local else row
+            )
+        if not rows or len(local) < len(rows):
+            self._queue(table, "delete", None, query.filters, {})
+
+        return rows
+
+    def _matching(self, query: Query) -> list:
+        where, params = self._where(query.table, query.filters)
+        return [
+            json.loads(row[0])
+            for row in self._connection.execute(
+                f'SELECT data FROM "{query.table}"{where}', params
+            )
+        ]
+
+    def _rewrite_inserts(self, table: str, rewrite) -> None:
+        writes = self._connection.execute(
+            "SELECT id, payload FROM pending_writes "
+            "WHERE table_name = ? AND operation IN ('insert', 'upsert') AND state = ?",
+            (table, PENDING),
+        ).fetchall()
+
+        for id, payload in writes:
+            rows = [row for row in map(rewrite, json.loads(payload)) if row is not None]
+            self._connection.execute(
+                "UPDATE pending_writes SET payload = ? WHERE id = ?",
+                (json.dumps(rows), id),
+            )
+
+    def _new_key(self, table: str):
+        # Replaced by the key the server assigns when the insert is replayed
+        return f"{local_prefix}{uuid.uuid4().hex}"
+
+    def _queue(self, table, operation, payload, filters, options) -> None:
+        self._connection.execute(
+            "INSERT INTO pending_writes "
+            "(table_name, operation, payload, filters, options, state, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                table,
+                operation,
+                json.dumps(payload),
+                json.dumps(filters),
+                json.dumps(options),
+                PENDING,
+                time.time(),
+            ),
+        )
+
+    def _load(self, table: str, keys: list) -> dict:
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            found.update(
+                (pk, json.loads(data))
+                for pk, data in self._connection.execute(
+                    f'SELECT pk, data FROM "{table}" WHERE pk IN ({placeholders})',
+                    chunk,
+                )
+            )
+        return found
+
+    def _store(self, table: str, rows: list) -> None:
+        pk = primary_keys[table]
+        self._connection.executemany(
+            f'INSERT OR REPLACE INTO "{table}" VALUES (?, ?)',
+            ((_text(row[pk]), json.dumps(row)) for row in rows),
+        )
+
+    def _delete_keys(self, table: str, keys: list) -> None:
+        self._connection.executemany(
+            f'DELETE FROM "{table}" WHERE pk = ?', ((_text(key),) for key in keys)
+        )
+
+    def _where(self, table: str, filters: list) -> tuple:
+        pk = primary_keys[table]
+        clauses = []
+        params = []
+        for operator, column, value in filters:
+            if operator == "eq" and column == pk:
+                clauses.append("pk = ?")
+                params.append(_text(value))
+            elif operator == "in_" and column == pk and value:
+                clauses.append(f"pk IN ({', '.join('?' * len(value))})")
+                params += map(_text, value)
+            elif operator == "eq":
+                clauses.append(f"{self._column_text(column)} = ?")
+                params.append(_text(value))
+            elif operator == "in_":
+                if not value:
+                    clauses.append("0")
+                    continue
+                placeholders = ", ".join("?" * len(value))
+                clauses.append(f"{self._column_text(column)} IN ({placeholders})")
+                params += map(_text, value)
+            else:
+                symbol = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}[operator]
+                clauses.append(f"{self._column(column)} {symbol} ?")
+                params.append(value)
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    @staticmethod
+    def _column(column: str) -> str:
+        return f"json_extract(data, '$.{column}')"
+
+    @staticmethod
+    def _column_text(column: str) -> str:
+        return f"CAST(json_extract(data, '$.{column}') AS TEXT)"
+
+    @staticmethod
+    def _is_local(key) -> bool:
+        return isinstance(key, str) and key.startswith(local_prefix)
+
+
+class AsyncReplica:
+    """The replica as an async PostgREST client, for the AsyncDatabase.
+
+    Queries on the replica run on a worker thread, tables that are not
+    replicated go to the async client given as `remote`. Works the same with
+    a LocalBackend, which serves every table.
+    """
+
+    def __init__(self, replica: Replica, remote) -> None:
+        self.replica = replica
+        self.remote = remote
+
+    def table(self, table: str):
+        if not self.replica.serves(table):
+            return self.remote.table(table)
+
+        return AsyncQuery(self.replica, table)
+
+    async def aclose(self) -> None:
+        if self.remote is not None:
+            await self.remote.aclose()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_replica() -> Replica:
+    """Get the process-wide replica, opening it and starting its sync."""
+    global _shared
+
+    with _shared_lock:
+        if _shared is None:
+            _shared = Replica()
+            _shared.start()
+        return _shared
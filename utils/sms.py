@@ -1,33 +1,256 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import os
+import time
 from .common import message_templates
+from .ratelimit import RetryBudget, RetryPolicy, TokenBucket
+from .metrics import metrics, count_response_bytes
+from .templates import compile_template, count_segments
+from .outbox import idempotency_key
 
 api_key = os.environ.get("SMS_CHEF_API_KEY")
 device_id = os.environ.get("SMS_CHEF_DEVICE_ID")
+single_message_url = os.environ.get(
+    "SMS_CHEF_URL", "https://www.cloud.smschef.com/api/send/sms"
+)
+max_concurrency = int(os.environ.get("SMS_MAX_CONCURRENCY", 8))
+request_timeout = 15
 country_code = "+63"
 
+# Shared by every campaign so that together they stay under the provider's
+# limit. A rate of 0 sends without limit.
+gateway_rate_limiter = TokenBucket(
+    rate=float(os.environ.get("SMS_RATE_LIMIT", 10)),
+    burst=int(os.environ.get("SMS_RATE_BURST", 10)),
+)
+
+
+class SMSGatewayError(Exception):
+    """Raised when the gateway keeps answering with a retryable error."""
+
+    def __init__(self, status, response):
+        super().__init__(f"SMS gateway returned status {status}")
+        self.status = status
+        self.response = response
+
+
+def is_retryable_status(status):
+    return status == 429 or 500 <= status < 600
+
 
 class BulkSMS:
-    def __init__(self):
+    # Identifies the campaign in the outbox, and the table whose rows are
+    # marked as messaged once sent
+    kind = None
+    ack_table = None
+    # Fields of `students` the message templates can use
+    fields = ()
+
+    def __init__(
+        self,
+        concurrency=max_concurrency,
+        rate_limiter=gateway_rate_limiter,
+        retry_policy=None,
+        retry_budget_ratio=0.2,
+    ):
         self.students = {}
+        self.ack_ids = {}
+        self.versions = {}
         self.message_template = ""
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_budget_ratio = retry_budget_ratio
+        self.retry_budget = None
+        self._session = None
+
+    @property
+    def session(self):
+        """HTTP session shared by the workers so connections are kept alive."""
+        if self._session is None:
+            # requests is imported with the first campaign, not on startup
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            adapter = HTTPAdapter(pool_maxsize=self.concurrency)
+            self._session = requests.Session()
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+            self._session.hooks["response"].append(count_response_bytes)
+        return self._session
+
+    def compile(self, message_template=None):
+        """Parse a template and check it only uses the campaign's fields.
+
+        Args:
+            message_template (str) (optional): Overrides the default template.
+
+        Returns:
+            Template: The parsed template.
+
+        Raises:
+            TemplateError: If the template is malformed or uses unknown fields.
+        """
+        return compile_template(message_template or self.message_template, self.fields)
+
+    def build_messages(self, message_template=None):
+        """Generate the message for every student.
+
+        Args:
+            message_template (str) (optional): Overrides the default template.
+
+        Returns:
+            list: Dicts with `student_id`, `recipient`, `message`, `ack_ids`
+                and `versions`.
+
+        Raises:
+            TemplateError: If the template is malformed or uses unknown fields,
+                before any message is generated.
+        """
+        template = self.compile(message_template)
+        students = [
+            self._template_fields(student) for student in self.students.values()
+        ]
+
+        return [
+            {
+                "student_id": student_id,
+                "recipient": student_info["contact_number"],
+                "message": message,
+                "ack_ids": self.ack_ids.get(student_id, []),
+                "versions": self.versions.get(student_id, []),
+            }
+            for (student_id, student_info), message in zip(
+                self.students.items(), template.render_many(students)
+            )
+        ]
+
+    def estimate(self, message_template=None):
+        """Count the SMS parts the campaign will be sent as.
+
+        Args:
+            message_template (str) (optional): Overrides the default template.
+
+        Returns:
+            dict: `messages`, `segments` (their total), `max_segments` (of the
+                longest message) and `ucs2` (the number of messages sent as
+                UCS-2, which fits less than half as many characters per part).
+        """
+        counts = [
+            count_segments(message["message"])
+            for message in self.build_messages(message_template)
+        ]
+        return {
+            "messages": len(counts),
+            "segments": sum(count["segments"] for count in counts),
+            "max_segments": max((count["segments"] for count in counts), default=0),
+            "ucs2": sum(count["encoding"] == "UCS-2" for count in counts),
+        }
+
+    def send(self, message_template=None, outbox=None, resume=False):
+        """Send the message to every student, several at a time.
+
+        With an outbox, the messages are stored before sending and every answer
+        is recorded as it arrives. They replace the unsent messages of earlier
+        campaigns of the same kind, and messages already sent are skipped.
+
+        Args:
+            message_template (str) (optional): Overrides the default template.
+            outbox (Outbox) (optional): The outbox to record the campaign in.
+            resume (bool) (optional): Send the unsent messages of the
+                interrupted campaigns of this kind in the outbox instead, as
+                they were written. Only the ones about the campaign's students
+                and the current versions of their rows are sent, the others
+                are outdated.
+
+        Returns:
+            list: One result per message, with keys `student_id`, `recipient`,
+                `ack_ids`, `success`, `attempts`, `segments` (the SMS parts it is
+                sent as) and `response` (the gateway's reply, or the error).
+        """
+        if resume:
+            keys = {
+                idempotency_key(
+                    self.kind, student_id, self.versions.get(student_id, [])
+                )
+                for student_id in self.students
+            }
+            messages = outbox.claim(self.kind, keys=keys)
+        elif outbox is not None:
+            messages = self.build_messages(message_template)
+            campaign_id = outbox.enqueue(self.kind, self.ack_table, messages)
+            messages = outbox.claim(self.kind, campaign_id) if campaign_id else []
+        else:
+            messages = self.build_messages(message_template)
+
+        # Retries allowed for this campaign, shared by all recipients
+        self.retry_budget = RetryBudget(
+            max(10, int(len(messages) * self.retry_budget_ratio))
+        )
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                return list(
+                    executor.map(
+                        lambda message: self._send_message(message, outbox),
+                        messages,
+                    )
+                )
+        finally:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
 
-    def send(self, message_template=None):
-        if not message_template:
-            message_template = self.message_template
+    def _send_message(self, message, outbox=None):
+        result = {
+            "student_id": message["student_id"],
+            "recipient": message["recipient"],
+            "ack_ids": message["ack_ids"],
+            "success": False,
+            "attempts": 0,
+            "response": None,
+            "segments": count_segments(message["message"])["segments"],
+        }
+
+        try:
+            response = self._send_single(
+                message["recipient"], message["message"], result
+            )
+            result["response"] = response
+            result["success"] = response.get("status") == 200
+        except SMSGatewayError as error:
+            result["response"] = error.response
+        except Exception as error:
+            result["response"] = str(error)
 
-        for student_id, student_info in self.students.items():
-            self._send_single(
-                student_info["contact_number"],
-                self._generate_message(message_template, student_info),
+        if outbox is not None:
+            outbox.record(
+                message["key"],
+                result["success"],
+                result["attempts"],
+                result["response"],
             )
 
-    def _generate_message(self, message_template, student):
-        pass
+        return result
+
+    def _template_fields(self, student):
+        # The values of the template fields, from a student of `students`
+        return student
+
+    @metrics.timed("BulkSMS._send_single")
+    def _send_single(self, recipient_no, message, result=None):
+        """Send one message, retrying throttled and failed requests.
+
+        Args:
+            recipient_no (str): The recipient's contact number.
+            message (str): The message to send.
+            result (dict) (optional): Receives the number of attempts made.
+
+        Returns:
+            dict: The gateway's reply.
+        """
+        import requests
 
-    def _send_single(self, recipient_no, message):
         recipient_no = self._preprocess_numbers([recipient_no])[0]
-        single_message_url = "https://www.cloud.smschef.com/api/send/sms"
         message_params = {
             "secret": api_key,
             "mode": "devices",
@@ -37,10 +260,54 @@ class BulkSMS:
             "phone": recipient_no,
             "message": message,
         }
-        request = requests.post(url=single_message_url, params=message_params)
-        result = request.json()
 
-        return result
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            attempt += 1
+            if result is not None:
+                result["attempts"] = attempt
+
+            try:
+                request = self.session.post(
+                    url=single_message_url,
+                    params=message_params,
+                    timeout=request_timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if not self._can_retry(attempt):
+                    raise
+                time.sleep(self.retry_policy.delay(attempt - 1))
+                continue
+
+            try:
+                response = request.json()
+            except ValueError:
+                response = {"status": request.status_code, "message": request.text}
+
+            status = request.status_code
+            if status == 200 and isinstance(response.get("status"), int):
+                status = response["status"]
+
+            if not is_retryable_status(status):
+                return response
+
+            if not self._can_retry(attempt):
+                raise SMSGatewayError(status, response)
+
+            delay = self.retry_policy.delay(attempt - 1)
+            retry_after = request.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+    def _can_retry(self, attempt):
+        if attempt > self.retry_policy.max_retries:
+            return False
+
+        return self.retry_budget is None or self.retry_budget.try_spend()
 
     def _preprocess_numbers(self, numbers):
         preprocessed = []
@@ -49,17 +316,53 @@ class BulkSMS:
             if number[:3] != country_code:
                 shift = 1 if number[0] == "0" else 0
                 number = country_code + number[shift:]
-                preprocessed.append(number)
+            preprocessed.append(number)
 
         return preprocessed
 
 
 class IncompleteGradeSMS(BulkSMS):
+    kind = "incomplete_grade"
+    ack_table = "grades"
+    fields = ("first_name", "middle_name", "last_name", "subjects")
+
     def __init__(self, grades):
         super().__init__()
         self.message_template = message_templates["incomplete_grade"]
         self._process_grades(grades)
 
+    @classmethod
+    def from_recipients(cls, recipients):
+        """Create the campaign from students grouped with their grades.
+
+        Args:
+            recipients (list): The rows of `Database.get_grade_recipients`.
+
+        Returns:
+            IncompleteGradeSMS: The campaign, of the class it is called on.
+        """
+        campaign = cls([])
+        for recipient in recipients:
+            student_id = recipient["student_id"]
+            grades = recipient["grades"]
+
+            campaign.students[student_id] = {
+                "first_name": recipient["first_name"],
+                "middle_name": recipient["middle_name"],
+                "last_name": recipient["last_name"],
+                "contact_number": recipient["contact_number"],
+                "subjects": [
+                    f"{grade['title']} (Year: {grade['year']}, Sem: {grade['sem']})"
+                    for grade in grades
+                ],
+            }
+            campaign.ack_ids[student_id] = [grade["grade_id"] for grade in grades]
+            campaign.versions[student_id] = [
+                f"{grade['grade_id']}@{grade['updated_at']}" for grade in grades
+            ]
+
+        return campaign
+
     def _process_grades(self, grades):
         for grade in grades:
             student_id = grade["student_id"]
@@ -72,27 +375,34 @@ class IncompleteGradeSMS(BulkSMS):
                     "contact_number": grade["student_info"]["contact_number"],
                     "subjects": [],
                 }
+                self.ack_ids[student_id] = []
+                self.versions[student_id] = []
 
+            self.ack_ids[student_id].append(grade["grade_id"])
+            self.versions[student_id].append(
+                f"{grade['grade_id']}@{grade.get('updated_at')}"
+            )
             self.students[student_id]["subjects"].append(
                 f"{grade['subjects']['title']} (Year: {grade['year']}, Sem: {grade['sem']})"
             )
 
-    def _generate_message(self, message_template, student):
-        return message_template.format(
-            first_name=student["first_name"],
-            middle_name=student["middle_name"],
-            last_name=student["last_name"],
-            subjects=", ".join(student["subjects"]),
-        )
+    def _template_fields(self, student):
+        return {**student, "subjects": ", ".join(student["subjects"])}
 
 
 class FailedGradeSMS(IncompleteGradeSMS):
+    kind = "failed_grade"
+
     def __init__(self, grades):
         super().__init__(grades)
         self.message_template = message_templates["failed_grade"]
 
 
 class DocumentsSMS(BulkSMS):
+    kind = "requested_document"
+    ack_table = "student_requests"
+    fields = ("first_name", "middle_name", "last_name", "document")
+
     def __init__(self, documents):
         super().__init__()
 
@@ -112,11 +422,10 @@ class DocumentsSMS(BulkSMS):
                     "contact_number": document["student_info"]["contact_number"],
                     "document": document["document_type"]["type"],
                 }
+                self.ack_ids[student_id] = []
+                self.versions[student_id] = []
 
-    def _generate_message(self, message_template, student):
-        return message_template.format(
-            first_name=student["first_name"],
-            middle_name=student["middle_name"],
-            last_name=student["last_name"],
-            document=student["document"],
-        )
+            self.ack_ids[student_id].append(document["id"])
+            self.versions[student_id].append(
+                f"{document['id']}@{document.get('updated_at')}"
+            )
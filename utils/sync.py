@@ -0,0 +1,368 @@
+from .common import primary_keys
+from datetime import datetime, timedelta
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Rows changed this many seconds before the high-water mark are pulled again,
+# so rows committed late by a long transaction are not missed
+sync_overlap = float(os.environ.get("SYNC_OVERLAP", 30))
+# Tombstones older than this are deleted on the server, a table not synced
+# for that long is copied whole again
+tombstone_retention = float(os.environ.get("TOMBSTONE_RETENTION_DAYS", 30)) * 86400
+
+# Tables stamped by the touch_updated_at trigger and tracked by the
+# record_tombstone trigger, see migrations/001_delta_sync.sql
+tracked_tables = [
+    "student_info",
+    "grades",
+    "subjects",
+    "courses",
+    "document_type",
+    "student_requests",
+]
+
+
+def parse_select(columns: str) -> list:
+    """Split a PostgREST select statement into its fields.
+
+    Args:
+        columns (str): e.g. "grade_id, remarks(remark), subjects(code, title)".
+
+    Returns:
+        list: (name, nested columns) tuples, nested columns is None for plain
+            columns.
+    """
+    fields = []
+    depth = 0
+    field = ""
+    for char in columns + ",":
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            field = field.strip()
+            if "(" in field:
+                name, inner = field.split("(", 1)
+                fields.append((name.strip(), inner[:-1]))
+            elif field:
+                fields.append((field, None))
+            field = ""
+        else:
+            field += char
+
+    return fields
+
+
+def with_columns(columns: str, required: list) -> str:
+    """Add the columns missing from a select statement."""
+    present = {name for name, nested in parse_select(columns) if nested is None}
+    if "*" in present:
+        return columns
+
+    missing = [column for column in required if column not in present]
+    return ", ".join([columns] + missing) if missing else columns
+
+
+def _before(timestamp: str, seconds: float) -> str:
+    return (datetime.fromisoformat(timestamp) - timedelta(seconds=seconds)).isoformat()
+
+
+class DeltaSync:
+    """Pulls the rows of tables changed since the last pull.
+
+    Keeps a high-water mark per table: the newest `updated_at` pulled and the
+    newest tombstone seen. The first pull of a table copies it whole, the
+    next ones only ask for the rows stamped after the mark and for the keys
+    deleted since, which is a range scan on the updated_at index.
+
+    Needs the triggers of migrations/001_delta_sync.sql: clients stamp
+    updated_at with their own clock, so the server has to restamp it, and
+    deleted rows leave no trace without the tombstones table.
+
+    Attributes:
+        client: The Supabase or PostgREST client to pull from.
+        marks (dict): The high-water mark of each table, can be saved and
+            passed back to resume.
+        require_tombstones (bool): Whether to copy tables whole when the
+            tombstones table is missing, instead of missing deletes.
+    """
+
+    def __init__(
+        self,
+        client,
+        marks: dict = None,
+        require_tombstones: bool = True,
+        overlap: float = sync_overlap,
+        retention: float = tombstone_retention,
+    ) -> None:
+        self.client = client
+        self.marks = marks if marks is not None else {}
+        self.require_tombstones = require_tombstones
+        self.overlap = overlap
+        self.retention = retention
+        self.tombstones = True
+
+    def reset(self, table: str = None) -> None:
+        """Forget the mark of a table, or of all tables, to copy them again."""
+        if table is None:
+            self.marks.clear()
+        else:
+            self.marks.pop(table, None)
+
+    def pull(
+        self, table: str, columns: str = "*", filters: dict = None, page_size=1000
+    ) -> dict:
+        """Get the rows of a table changed since the last pull.
+
+        Args:
+            table (str): The table to pull.
+            columns (str) (optional): The columns to fetch.
+            filters (dict) (optional): Column values the rows of a full copy
+                must have. Changed rows are returned whether they match or
+                not, so rows that stopped matching can be dropped.
+            page_size (int) (optional): The number of rows per request.
+
+        Returns:
+            dict: `rows`, the changed rows, `deleted`, the primary keys of the
+                deleted rows as text, and `full`, whether `rows` is a full
+                copy replacing everything pulled before.
+        """
+        pk = primary_keys[table]
+        mark = self.marks.get(table)
+        columns = with_columns(columns, [pk, "updated_at"] + list(filters or {}))
+
+        if (
+            mark is None
+            or table not in tracked_tables
+            or (self.require_tombstones and not self.tombstones)
+            or time.time() - mark["synced_at"] > self.retention
+        ):
+            return self._copy(table, columns, filters or {}, page_size)
+
+        since = mark["updated_at"] and _before(mark["updated_at"], self.overlap)
+        rows = self._pages(table, columns, since, page_size)
+        tombstones = self._deleted(table, mark["deleted_at"])
+
+        # A key deleted and then inserted again is kept
+        newest = {str(row[pk]): row["updated_at"] or "" for row in rows}
+        deleted = [
+            key
+            for key, deleted_at in tombstones.items()
+            if key not in newest or newest[key] < deleted_at
+        ]
+
+        stamps = [row["updated_at"] for row in rows if row["updated_at"]]
+        self.marks[table] = {
+            "updated_at": max(stamps + [mark["updated_at"] or ""]) or None,
+            "deleted_at": max(list(tombstones.values()) + [mark["deleted_at"] or ""])
+            or None,
+            "synced_at": time.time(),
+        }
+        return {"rows": rows, "deleted": deleted, "full": False}
+
+    def _copy(self, table, columns, filters, page_size) -> dict:
+        mark = {"updated_at": None, "deleted_at": None, "synced_at": time.time()}
+
+        if table in tracked_tables:
+            # Taken before the copy, so changes made during it are pulled next
+            mark["updated_at"] = self._latest(
+                self.client.table(table).select("updated_at"), "updated_at"
+            )
+            if self.tombstones:
+                try:
+                    mark["deleted_at"] = self._latest(
+                        self.client.table("tombstones")
+                        .select("deleted_at")
+                        .eq("table_name", table),
+                        "deleted_at",
+                    )
+                except Exception as error:
+                    if not _is_missing_relation(error):
+                        raise
+                    logger.warning(
+                        "Deletes cannot be synced, tombstones are missing: %s", error
+                    )
+                    self.tombstones = False
+
+        rows = self._pages(table, columns, None, page_size, filters)
+        self.marks[table] = mark
+        return {"rows": rows, "deleted": [], "full": True}
+
+    def _latest(self, query, column: str) -> str:
+        rows = (
+            query.not_.is_(column, "null")
+            .order(column, desc=True)
+            .limit(1)
+            .execute()
+            .data
+        )
+        return rows[0][column] if rows else None
+
+    def _pages(self, table, columns, since, page_size, filters=None) -> list:
+        # Keyset pagination by primary key over a fixed set of rows
+        pk = primary_keys[table]
+        rows = []
+        last = None
+
+        while True:
+            query = self.client.table(table).select(columns).order(pk).limit(page_size)
+            for column, value in (filters or {}).items():
+                query = query.eq(column, value)
+            if since is not None:
+                query = query.gte("updated_at", since)
+            if last is not None:
+                query = query.gt(pk, last)
+
+            page = query.execute().data
+            rows += page
+            if len(page) < page_size:
+                return rows
+            last = page[-1][pk]
+
+    def _deleted(self, table: str, deleted_at: str, page_size=1000) -> dict:
+        if not self.tombstones:
+            return {}
+
+        since = deleted_at and _before(deleted_at, self.overlap)
+        deleted = {}
+        last = None
+
+        while True:
+            query = (
+                self.client.table("tombstones")
+                .select("id, row_key, deleted_at")
+                .eq("table_name", table)
+                .order("id")
+                .limit(page_size)
+            )
+            if since is not None:
+                query = query.gte("deleted_at", since)
+            if last is not None:
+                query = query.gt("id", last)
+
+            page = query.execute().data
+            for tombstone in page:
+                deleted[tombstone["row_key"]] = tombstone["deleted_at"]
+            if len(page) < page_size:
+                return deleted
+            last = page[-1]["id"]
+
+
+def _is_offline(error: Exception) -> bool:
+    import httpx
+
+    return isinstance(error, (OSError, TimeoutError, httpx.TransportError))
+
+
+def _is_missing_relation(error: Exception) -> bool:
+    # PostgREST 12 reports a table or view missing from its schema cache as
+    # PGRST205, older versions pass on the error of Postgres
+    return getattr(error, "code", None) in ("PGRST205", "42P01")
+
+
+class SyncedQuery:
+    """The rows of a table matching column values, kept up to date by deltas.
+
+    The first refresh fetches the matching rows, later ones only pull the
+    rows changed since and apply them: changed rows that still match are
+    replaced, the ones that no longer match and the deleted ones are dropped.
+    Embedded rows only change with the row embedding them, so queries are
+    reset when an embedded table changes, see reset_synced_queries.
+
+    Attributes:
+        table (str): The table queried.
+        columns (str): The columns fetched.
+        filters (dict): The column values the rows must have.
+    """
+
+    def __init__(self, client, table: str, columns: str, filters: dict) -> None:
+        self.table = table
+        self.columns = columns
+        self.filters = filters
+        self.delta = DeltaSync(client)
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    @property
+    def embedded(self) -> set:
+        """The tables embedded in the fetched columns."""
+        return {name for name, nested in parse_select(self.columns) if nested}
+
+    def reset(self) -> None:
+        """Fetch the matching rows again on the next refresh."""
+        with self._lock:
+            self.delta.reset()
+
+    def refresh(self) -> list:
+        """Pull the changes and get the matching rows.
+
+        Returns:
+            list: The matching rows, in primary key order for the ones
+                fetched by the first refresh, then in the order they appeared.
+        """
+        pk = primary_keys[self.table]
+
+        with self._lock:
+            changes = self.delta.pull(self.table, self.columns, self.filters)
+            if changes["full"]:
+                self._rows = {}
+
+            for row in changes["rows"]:
+                key = str(row[pk])
+                if all(row.get(c) == v for c, v in self.filters.items()):
+                    self._rows[key] = row
+                else:
+                    self._rows.pop(key, None)
+
+            for key in changes["deleted"]:
+                self._rows.pop(key, None)
+
+            return list(self._rows.values())
+
+
+_synced_queries = {}
+_synced_lock = threading.Lock()
+
+
+def synced_query(client, table: str, columns: str, **filters) -> SyncedQuery:
+    """Get the shared SyncedQuery for a query, creating it on first use.
+
+    Args:
+        client: The Supabase client to pull from.
+        table (str): The table to query.
+        columns (str): The columns to fetch.
+        **filters: The column values the rows must have.
+
+    Returns:
+        SyncedQuery: The query, shared by every caller asking for the same
+            rows so each refresh only pulls what changed since the last one.
+    """
+    key = (id(client), table, columns, tuple(sorted(filters.items())))
+
+    with _synced_lock:
+        query = _synced_queries.get(key)
+        if query is None:
+            query = _synced_queries[key] = SyncedQuery(client, table, columns, filters)
+        return query
+
+
+def reset_synced_queries(table: str) -> None:
+    """Reset the shared SyncedQueries embedding the rows of a table.
+
+    Their next refresh fetches the matching rows again, e.g. with the new
+    contact number of a student whose requests did not change.
+
+    Args:
+        table (str): The changed table, e.g. "student_info".
+    """
+    with _synced_lock:
+        queries = list(_synced_queries.values())
+
+    for query in queries:
+        if table in query.embedded:
+            query.reset()
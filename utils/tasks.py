@@ -0,0 +1,327 @@
+from .metrics import metrics, count_rows
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import queue
+import threading
+import time
+import traceback
+
+
+class Task:
+    """A unit of work submitted to a TaskRunner.
+
+    Attributes:
+        key (str): Tasks sharing a key supersede each other, only the result
+            of the latest one is delivered.
+        token (int): The task's position in the submission order.
+        cancelled (bool): Whether the task was cancelled.
+        span (str): The name the task is recorded under in the metrics, if
+            any.
+    """
+
+    def __init__(
+        self, key, token, on_success, on_error, owner, on_item=None, span=None
+    ) -> None:
+        self.key = key
+        self.token = token
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_item = on_item
+        self.owner = owner
+        self.cancelled = False
+        self.future = None
+        self.span = span
+        self.started = time.perf_counter()
+        self.rows = 0
+
+    def cancel(self) -> None:
+        """Drop the task's result, and skip it if it has not started yet."""
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class TaskRunner:
+    """Runs blocking calls on a thread pool and hands results back to Tk.
+
+    Results are queued by the worker threads and delivered on the Tk main
+    loop thread by polling with `after()`, so callbacks may touch widgets.
+
+    Attributes:
+        max_workers (int): The size of the thread pool.
+        poll_interval (int): Milliseconds between checks for finished tasks.
+    """
+
+    def __init__(self, max_workers: int = 4, poll_interval: int = 25) -> None:
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self._executor = None
+        self._results = queue.Queue()
+        self._latest = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._finished = object()
+        self._busy_listeners = []
+        self._widget = None
+        self._after_id = None
+
+    def bind(self, widget) -> None:
+        """Start delivering results on the main loop of a Tk widget.
+
+        Args:
+            widget: Any widget of the running Tk application.
+        """
+        self._widget = widget
+        if self._after_id is None:
+            self._after_id = widget.after(self.poll_interval, self._poll)
+
+    def submit(
+        self,
+        fn,
+        *args,
+        key=None,
+        on_success=None,
+        on_error=None,
+        owner=None,
+        span=None,
+        **kwargs,
+    ) -> Task:
+        """Run a function on a worker thread.
+
+        Args:
+            fn (callable): The blocking function to run.
+            key (str) (optional): Cancels any earlier task with the same key.
+            on_success (callable) (optional): Called with the function's result
+                on the main thread.
+            on_error (callable) (optional): Called with the raised exception on
+                the main thread. Prints the traceback when omitted.
+            owner (widget) (optional): Callbacks are skipped once this widget
+                is destroyed.
+            span (str) (optional): Records the task in the metrics under this
+                name, from its submission until `on_success` returns.
+
+        Returns:
+            Task: The submitted task.
+        """
+        task = self._new_task(key, on_success, on_error, owner, span=span)
+        return self._start(task, fn, *args, **kwargs)
+
+    def stream(
+        self,
+        fn,
+        *args,
+        key=None,
+        on_item=None,
+        on_success=None,
+        on_error=None,
+        owner=None,
+        span=None,
+        **kwargs,
+    ) -> Task:
+        """Run a generator function on a worker thread, handing over each item.
+
+        Items are delivered on the main thread in the order they are yielded,
+        while the generator keeps running. Cancelling the task stops the
+        generator at its next item.
+
+        Args:
+            fn (callable): The generator function to run.
+            key (str) (optional): Cancels any earlier task with the same key.
+            on_item (callable) (optional): Called with each yielded item on the
+                main thread.
+            on_success (callable) (optional): Called with the number of items
+                once the generator is exhausted.
+            on_error (callable) (optional): Called with the raised exception on
+                the main thread. Prints the traceback when omitted.
+            owner (widget) (optional): Callbacks are skipped once this widget
+                is destroyed.
+            span (str) (optional): Records the task in the metrics under this
+                name, from its submission until `on_success` returns, with
+                the rows of every item.
+
+        Returns:
+            Task: The submitted task.
+        """
+        task = self._new_task(key, on_success, on_error, owner, on_item, span)
+
+        def consume():
+            count = 0
+            for item in fn(*args, **kwargs):
+                if task.cancelled:
+                    break
+                self._results.put((task, item))
+                count += 1
+            return count
+
+        return self._start(task, consume)
+
+    def _new_task(
+        self, key, on_success, on_error, owner, on_item=None, span=None
+    ) -> Task:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="task"
+                )
+
+            task = Task(
+                key, next(self._tokens), on_success, on_error, owner, on_item, span
+            )
+            if key is not None:
+                previous = self._latest.get(key)
+                if previous is not None:
+                    previous.cancel()
+                self._latest[key] = task
+
+            self._pending += 1
+
+        return task
+
+    def _start(self, task: Task, fn, *args, **kwargs) -> Task:
+        self._notify_busy()
+        task.future = self._executor.submit(fn, *args, **kwargs)
+        task.future.add_done_callback(
+            lambda future: self._results.put((task, self._finished))
+        )
+        return task
+
+    def post(self, fn, *args, owner=None) -> None:
+        """Call a function on the main thread, from any thread.
+
+        Args:
+            fn (callable): The function to call.
+            owner (widget) (optional): The call is skipped if this widget is
+                destroyed by then.
+        """
+        task = Task(None, None, None, None, owner, on_item=lambda _: fn(*args))
+        self._results.put((task, None))
+
+    def cancel(self, key) -> None:
+        """Cancel the latest task submitted with a key.
+
+        Args:
+            key (str): The task key.
+        """
+        with self._lock:
+            task = self._latest.pop(key, None)
+
+        if task is not None:
+            task.cancel()
+
+    @property
+    def pending(self) -> int:
+        """The number of tasks whose result has not been delivered yet."""
+        return self._pending
+
+    def add_busy_listener(self, callback) -> None:
+        """Register a callback that receives the pending task count on change.
+
+        Args:
+            callback (callable): Called on the main thread with the count.
+        """
+        self._busy_listeners.append(callback)
+
+    def remove_busy_listener(self, callback) -> None:
+        if callback in self._busy_listeners:
+            self._busy_listeners.remove(callback)
+
+    def shutdown(self) -> None:
+        """Stop polling and let running tasks finish without callbacks."""
+        if self._widget is not None and self._after_id is not None:
+            try:
+                self._widget.after_cancel(self._after_id)
+            except Exception:
+                pass
+
+        self._after_id = None
+        self._widget = None
+        self._busy_listeners.clear()
+
+        with self._lock:
+            for task in self._latest.values():
+                task.cancel()
+            self._latest.clear()
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self) -> None:
+        delivered = False
+
+        while True:
+            try:
+                task, item = self._results.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is not self._finished:
+                self._deliver_item(task, item)
+                continue
+
+            delivered = True
+            with self._lock:
+                self._pending -= 1
+                if task.key is not None and self._latest.get(task.key) is task:
+                    del self._latest[task.key]
+
+            self._deliver(task)
+
+        if delivered:
+            self._notify_busy()
+
+        if self._widget is not None:
+            self._after_id = self._widget.after(self.poll_interval, self._poll)
+
+    def _deliver(self, task: Task) -> None:
+        if task.cancelled or task.future.cancelled():
+            return
+
+        if task.owner is not None and not task.owner.winfo_exists():
+            return
+
+        error = task.future.exception()
+        try:
+            if error is None:
+                result = task.future.result()
+                if task.on_success is not None:
+                    task.on_success(result)
+                if task.span is not None:
+                    if task.on_item is None:
+                        task.rows = count_rows(result)
+                    metrics.record(
+                        task.span,
+                        task.started,
+                        time.perf_counter() - task.started,
+                        task.rows,
+                    )
+            elif task.on_error is not None:
+                task.on_error(error)
+            else:
+                traceback.print_exception(error)
+        except Exception:
+            traceback.print_exc()
+
+    def _deliver_item(self, task: Task, item) -> None:
+        if task.cancelled or task.on_item is None:
+            return
+
+        if task.owner is not None and not task.owner.winfo_exists():
+            return
+
+        task.rows += count_rows(item)
+        try:
+            task.on_item(item)
+        except Exception:
+            traceback.print_exc()
+
+    def _notify_busy(self) -> None:
+        if threading.current_thread() is not threading.main_thread():
+            return
+
+        for callback in list(self._busy_listeners):
+            callback(self._pending)
+
+
+task_runner = TaskRunner()
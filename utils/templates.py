@@ -0,0 +1,164 @@
+from functools import lru_cache
+from operator import itemgetter
+import math
+import os
+import string
+
+template_cache_size = int(os.environ.get("SMS_TEMPLATE_CACHE_SIZE", 64))
+
+# GSM 03.38 default alphabet, one 7-bit unit per character
+gsm_basic = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+# Its extension table, two units per character (escape + character)
+gsm_extended = set("^{}\\[~]|€\f")
+
+# Units of a single message, and of each part of a concatenated one, whose
+# header takes the rest
+segment_sizes = {"GSM-7": (160, 153), "UCS-2": (70, 67)}
+
+
+class TemplateError(Exception):
+    """Raised when a message template cannot be parsed or uses unknown fields."""
+
+
+def count_segments(message: str) -> dict:
+    """Count the SMS parts a message is sent as, which is what it costs.
+
+    A message only made of GSM-7 characters is sent in 160 character parts,
+    or 153 once it needs more than one. Any other character sends the whole
+    message as UCS-2, in parts of 70, or 67.
+
+    Args:
+        message (str): The message.
+
+    Returns:
+        dict: `encoding` ("GSM-7" or "UCS-2"), `units` (the characters, as
+            the encoding counts them) and `segments`.
+    """
+    characters = set(message)
+    if characters <= gsm_basic:
+        encoding, units = "GSM-7", len(message)
+    elif characters <= gsm_basic | gsm_extended:
+        encoding = "GSM-7"
+        units = len(message) + sum(
+            message.count(char) for char in characters & gsm_extended
+        )
+    else:
+        # Characters outside the basic plane take two UTF-16 units
+        encoding, units = "UCS-2", len(message.encode("utf-16-le")) // 2
+
+    single, part = segment_sizes[encoding]
+    segments = 1 if units <= single else math.ceil(units / part)
+    return {"encoding": encoding, "units": units, "segments": segments}
+
+
+class Template:
+    """A message template parsed once, then rendered for many recipients.
+
+    Placeholders are written like `str.format` fields, e.g. "Hi {first_name}",
+    without a conversion or format spec, which could only fail once rendered.
+    Rendering looks the fields up by name and formats them positionally,
+    which is about twice as fast as `str.format` with keyword arguments on
+    large batches.
+
+    Attributes:
+        text (str): The template.
+        variables (list): The names of its placeholders, sorted.
+    """
+
+    def __init__(self, text: str, fields=None) -> None:
+        """Parse a template.
+
+        Args:
+            text (str): The template.
+            fields (iterable) (optional): The placeholders allowed. Any
+                placeholder is allowed if not given.
+
+        Raises:
+            TemplateError: If the template is malformed, has a conversion or
+                format spec, or uses a field not in `fields`.
+        """
+        self.text = text
+
+        pattern = []
+        names = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as error:
+            raise TemplateError(f"Invalid message template: {error}")
+
+        for literal, name, spec, conversion in parsed:
+            pattern.append(literal.replace("{", "{{").replace("}", "}}"))
+            if name is None:
+                continue
+            if not name.isidentifier() or conversion or spec:
+                placeholder = (
+                    name
+                    + (f"!{conversion}" if conversion else "")
+                    + (f":{spec}" if spec else "")
+                )
+                raise TemplateError(
+                    f"Invalid placeholder {{{placeholder}}}, use a field name "
+                    "like {first_name}"
+                )
+            names.append(name)
+            pattern.append("{}")
+
+        self.variables = sorted(set(names))
+        if fields is not None:
+            unknown = [name for name in self.variables if name not in fields]
+            if unknown:
+                unknown = ", ".join(f"{{{name}}}" for name in unknown)
+                available = ", ".join(f"{{{name}}}" for name in fields)
+                raise TemplateError(
+                    f"Unknown placeholder(s): {unknown}. Available: {available}"
+                )
+
+        self._format = "".join(pattern).format
+        if len(names) == 1:
+            name = names[0]
+            self._values = lambda row: (row[name],)
+        elif names:
+            self._values = itemgetter(*names)
+        else:
+            self._values = lambda row: ()
+
+    def render(self, row: dict) -> str:
+        """Render the template with the fields of a row."""
+        return self._format(*self._values(row))
+
+    def render_many(self, rows) -> list:
+        """Render the template for many rows.
+
+        Args:
+            rows (iterable): Dicts with the template's fields.
+
+        Returns:
+            list: The rendered messages, in the order of `rows`.
+        """
+        format = self._format
+        values = self._values
+        return [format(*values(row)) for row in rows]
+
+
+@lru_cache(maxsize=template_cache_size)
+def _compile(text: str, fields) -> Template:
+    return Template(text, fields)
+
+
+def compile_template(text: str, fields=None) -> Template:
+    """Get the parsed template, parsing each text only once.
+
+    Args:
+        text (str): The template.
+        fields (iterable) (optional): The placeholders allowed.
+
+    Returns:
+        Template: The shared parsed template.
+
+    Raises:
+        TemplateError: If the template is malformed or uses an unknown field.
+    """
+    return _compile(text, tuple(fields) if fields is not None else None)
@@ -0,0 +1,356 @@
+from tkinter import ttk
+from itertools import repeat
+import operator
+
+
+class VirtualTable(ttk.Frame):
+    """A Treeview that only creates items for the rows on screen.
+
+    The rows live in a plain list and a fixed pool of Treeview items is
+    refilled from it as the user scrolls, so showing 50k rows costs the same
+    as showing one screenful. Rows are addressed by key instead of by Treeview
+    item ID: `selection()`, `focus()`, `item()` and `index()` take and return
+    row keys, which makes the widget a drop-in for the tables in app.py.
+
+    Attributes:
+        stripes (tuple): Background colors of even and odd rows.
+    """
+
+    def __init__(self, master, columns, stripes=("#353535", "#252525"), **kwargs):
+        super().__init__(master)
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+        self.stripes = stripes
+        self._keys = []
+        self._values = []
+        self._positions = {}
+        self._selected = set()
+        self._focus = None
+        self._offset = 0
+        self._slots = []
+        self._painted = {}
+        self._render_pending = False
+
+        self.tree = ttk.Treeview(self, columns=columns, **kwargs)
+        self.scrollbar = ttk.Scrollbar(
+            self, orient="vertical", command=self._on_scrollbar
+        )
+        self.tree.tag_configure("evenrow", background=stripes[0])
+        self.tree.tag_configure("oddrow", background=stripes[1])
+
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.tree.bind("<Configure>", lambda event: self._schedule_render())
+        self.tree.bind("<MouseWheel>", self._on_mousewheel)
+        self.tree.bind("<Button-4>", lambda event: self._scroll_by(-3))
+        self.tree.bind("<Button-5>", lambda event: self._scroll_by(3))
+        self.tree.bind("<Up>", lambda event: self._move_focus(-1, event))
+        self.tree.bind("<Down>", lambda event: self._move_focus(1, event))
+        self.tree.bind("<Prior>", lambda event: self._scroll_by(-len(self._slots)))
+        self.tree.bind("<Next>", lambda event: self._scroll_by(len(self._slots)))
+        self.tree.bind("<<TreeviewSelect>>", self._on_select, add="+")
+
+    # Treeview passthroughs
+
+    def heading(self, column, **kwargs):
+        return self.tree.heading(column, **kwargs)
+
+    def column(self, column, **kwargs):
+        return self.tree.column(column, **kwargs)
+
+    def tag_configure(self, tag, **kwargs):
+        return self.tree.tag_configure(tag, **kwargs)
+
+    def bind(self, sequence=None, func=None, add=None):
+        return self.tree.bind(sequence, func, add)
+
+    # Data
+
+    def set_rows(self, rows, keys=None):
+        """Replace the rows of the table with a new version of them.
+
+        Rows are matched by key, so the selection and the scroll position
+        survive a refresh: the row at the top of the view stays there as long
+        as it still exists. Only the lines on screen whose values changed are
+        repainted.
+
+        Args:
+            rows (list): The rows' values, one tuple per row.
+            keys (list) (optional): A unique key per row. Defaults to the
+                row's position.
+
+        Returns:
+            dict: The number of rows `inserted`, `updated` and `deleted`.
+        """
+        # Runs on every keystroke of a live search, so the loops are kept in C
+        values = list(map(tuple, rows))
+        keys = list(map(str, keys if keys is not None else range(len(values))))
+        top = self._keys[self._offset] if self._offset < len(self._keys) else None
+
+        # Old position of each new row, new rows point at a None sentinel
+        old_positions = list(map(self._positions.get, keys, repeat(-1)))
+        old_values = self._values + [None]
+        kept = len(keys) - old_positions.count(-1)
+        differing = sum(
+            map(operator.ne, map(old_values.__getitem__, old_positions), values)
+        )
+        changes = {
+            "inserted": len(keys) - kept,
+            "updated": differing - (len(keys) - kept),
+            "deleted": len(self._keys) - kept,
+        }
+
+        self._keys = keys
+        self._values = values
+        self._positions = dict(zip(keys, range(len(keys))))
+        self._selected &= self._positions.keys()
+        if self._focus not in self._positions:
+            self._focus = None
+        if top in self._positions:
+            self._offset = self._positions[top]
+        self._offset = min(self._offset, self._max_offset())
+        self._schedule_render()
+
+        return changes
+
+    def append_rows(self, rows, keys):
+        """Add rows at the end of the table, e.g. a page of a streamed load.
+
+        Args:
+            rows (list): The rows' values, one tuple per row.
+            keys (list): A unique key per row, not already in the table.
+        """
+        start = len(self._keys)
+        self._values += map(tuple, rows)
+        self._keys += map(str, keys)
+        self._positions.update(zip(self._keys[start:], range(start, len(self._keys))))
+        self._schedule_render()
+
+    def insert(self, parent, index, iid=None, values=()):
+        """Add a row, with the same signature as `Treeview.insert`.
+
+        Returns:
+            str: The row's key.
+        """
+        key = str(iid) if iid is not None else str(len(self._keys))
+        while key in self._positions:
+            key += "_"
+
+        position = len(self._keys) if index == "end" else int(index)
+        self._keys.insert(position, key)
+        self._values.insert(position, tuple(values))
+        if position == len(self._keys) - 1:
+            self._positions[key] = position
+        else:
+            self._positions = {k: i for i, k in enumerate(self._keys)}
+
+        self._schedule_render()
+        return key
+
+    def delete(self, *keys):
+        """Remove rows by key."""
+        if not keys:
+            return
+
+        if len(keys) == len(self._keys):
+            self.set_rows([])
+            return
+
+        removed = set(keys)
+        rows = [
+            (key, values)
+            for key, values in zip(self._keys, self._values)
+            if key not in removed
+        ]
+        self.set_rows([row[1] for row in rows], [row[0] for row in rows])
+
+    def get_children(self, item=""):
+        """Get the keys of every row, in display order."""
+        return tuple(self._keys)
+
+    def item(self, key, option=None, **kwargs):
+        """Get or set a row's values, like `Treeview.item`.
+
+        Tags are ignored, rows are striped automatically.
+        """
+        position = self._positions[str(key)]
+
+        if "values" in kwargs:
+            self._values[position] = tuple(kwargs["values"])
+            self._schedule_render()
+
+        info = {"values": list(self._values[position]), "tags": ""}
+        return info[option] if option is not None else info
+
+    def index(self, key):
+        """Get a row's position in the table."""
+        return self._positions[str(key)]
+
+    def exists(self, key):
+        return str(key) in self._positions
+
+    # Selection
+
+    def selection(self):
+        """Get the keys of the selected rows, in display order."""
+        return tuple(sorted(self._selected, key=self._positions.__getitem__))
+
+    def selection_set(self, *keys):
+        self._selected = {str(key) for key in keys if str(key) in self._positions}
+        self._schedule_render()
+
+    def focus(self, key=None):
+        """Get the focused row's key, or focus a row."""
+        if key is None:
+            return self._focus or ""
+
+        self._focus = str(key)
+        self.see(key)
+
+    def see(self, key):
+        """Scroll so the row with the key is visible."""
+        position = self._positions[str(key)]
+        visible = max(1, len(self._slots) - 1)
+
+        if position < self._offset:
+            self._offset = position
+        elif position >= self._offset + visible:
+            self._offset = position - visible + 1
+
+        self._offset = min(self._offset, self._max_offset())
+        self._schedule_render()
+
+    # Rendering
+
+    def _schedule_render(self):
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render)
+
+    def _render(self):
+        self._render_pending = False
+        if not self.winfo_exists():
+            return
+
+        self._resize_pool()
+
+        attached = set(self.tree.get_children())
+        selected_slots = []
+        for i, slot in enumerate(self._slots):
+            position = self._offset + i
+            if position < len(self._keys):
+                key = self._keys[position]
+                painted = (
+                    self._values[position],
+                    "evenrow" if position % 2 == 0 else "oddrow",
+                )
+                # Lines showing the same values are left alone
+                if self._painted.get(slot) != painted:
+                    self.tree.item(slot, values=painted[0], tags=(painted[1],))
+                    self._painted[slot] = painted
+                if slot not in attached:
+                    self.tree.move(slot, "", i)
+                if key in self._selected:
+                    selected_slots.append(slot)
+                if key == self._focus:
+                    self.tree.focus(slot)
+            elif slot in attached:
+                self.tree.detach(slot)
+                self._painted.pop(slot, None)
+
+        if set(selected_slots) != set(self.tree.selection()):
+            self.tree.selection_set(selected_slots)
+        self.tree.yview_moveto(0)
+        self._update_scrollbar()
+
+    def _resize_pool(self):
+        height = self.tree.winfo_height()
+        rows = int(self.tree.cget("height"))
+
+        if height > 1 and self._slots:
+            bbox = self.tree.bbox(self._slots[0])
+            if bbox:
+                # Rows that fit below the heading, plus a partially visible one
+                rows = max(1, (height - bbox[1]) // bbox[3] + 1)
+
+        while len(self._slots) < rows:
+            slot = f"slot{len(self._slots)}"
+            self.tree.insert("", "end", iid=slot)
+            self._slots.append(slot)
+
+        while len(self._slots) > rows:
+            slot = self._slots.pop()
+            self.tree.delete(slot)
+            self._painted.pop(slot, None)
+
+    def _visible_rows(self):
+        return max(1, len(self._slots) - 1)
+
+    def _max_offset(self):
+        return max(0, len(self._keys) - self._visible_rows())
+
+    def _update_scrollbar(self):
+        if not self._keys:
+            self.scrollbar.set(0, 1)
+            return
+
+        first = self._offset / len(self._keys)
+        last = min(1, (self._offset + self._visible_rows()) / len(self._keys))
+        self.scrollbar.set(first, last)
+
+    def _scroll_to(self, offset):
+        offset = max(0, min(int(offset), self._max_offset()))
+        if offset != self._offset:
+            self._offset = offset
+            self._schedule_render()
+
+    def _scroll_by(self, rows):
+        self._scroll_to(self._offset + rows)
+        return "break"
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self._scroll_to(float(amount) * len(self._keys))
+        elif unit == "pages":
+            self._scroll_by(int(amount) * self._visible_rows())
+        else:
+            self._scroll_by(int(amount))
+
+    def _on_mousewheel(self, event):
+        # Windows reports multiples of 120, macOS small deltas
+        step = event.delta // 120 if abs(event.delta) >= 120 else event.delta
+        return self._scroll_by(-3 * step)
+
+    def _move_focus(self, step, event):
+        if not self._keys:
+            return "break"
+
+        position = self._positions.get(self._focus, self._offset - step)
+        position = max(0, min(position + step, len(self._keys) - 1))
+        self._focus = self._keys[position]
+        if not event.state & 0x0001:  # Shift extends the selection
+            self._selected = set()
+        self._selected.add(self._focus)
+        self.see(self._focus)
+        return "break"
+
+    def _on_select(self, event):
+        # Sync the rows on screen, rows scrolled out of view keep their state
+        selected_slots = set(self.tree.selection())
+        for i, slot in enumerate(self._slots):
+            position = self._offset + i
+            if position >= len(self._keys):
+                break
+            key = self._keys[position]
+            if slot in selected_slots:
+                self._selected.add(key)
+            else:
+                self._selected.discard(key)
+
+        focused = self.tree.focus()
+        if focused in self._slots:
+            position = self._offset + self._slots.index(focused)
+            if position < len(self._keys):
+                self._focus = self._keys[position]